@@ -0,0 +1,21 @@
+"""
+Offline stand-ins for everything a recording node talks to: Huddle01 rooms with
+synthetic participants (`benchmarks.harness.huddle`), R2/S3 and the webhook endpoint.
+Used by `benchmarks.load`.
+
+Point the environment at the stand-ins before chatot's subsystems start: chatot
+reads its settings once, on the first `get_settings()` call (`reload_settings()`
+reads them again), and each subsystem reads its own knobs when it is created.
+`benchmarks.harness.huddle` imports chatot's room handling, so it is not imported
+here.
+"""
+
+from .servers import FakeS3Server, FakeWebhookServer
+from .tracks import SyntheticAudioTrack, speech_pattern
+
+__all__ = [
+    "FakeS3Server",
+    "FakeWebhookServer",
+    "SyntheticAudioTrack",
+    "speech_pattern",
+]
@@ -0,0 +1,296 @@
+"""
+A local stand-in for the Huddle01 side of a room.
+
+`FakeHuddle01` holds rooms and their synthetic participants. `FakeHuddle01Manager`
+takes the place of `Huddle01Manager` (see `huddle_service.set_manager_factory`):
+joining a fake room consumes every participant through the real `on_new_consumer`,
+so recording, uploads, webhooks and session tracking run exactly as they would for
+a Huddle01 room. Participants can join and rooms can close while they are recorded.
+"""
+
+import asyncio
+import threading
+import types
+import uuid
+import zlib
+from typing import Dict, List
+
+from pyee import AsyncIOEventEmitter
+
+from chatot.huddle.handlers import (
+    finish_room_manifest,
+    on_new_consumer,
+    start_consumer_activity,
+    start_room_manifest,
+    start_room_mix,
+    stop_consumer_activity,
+    stop_peer_recordings,
+    stop_room_mix,
+)
+from chatot.recorder import RecordingOptions
+
+from .tracks import SyntheticAudioTrack, speech_pattern
+
+
+class FakeObserver:
+    """The part of mediasoup's consumer observer `on_new_consumer` uses."""
+
+    def __init__(self):
+        self._handlers = {}
+
+    def on(self, event: str):
+        def register(handler):
+            self._handlers.setdefault(event, []).append(handler)
+            return handler
+
+        return register
+
+    async def emit(self, event: str):
+        for handler in self._handlers.get(event, []):
+            await handler()
+
+
+class FakeConsumer:
+    """An audio consumer of one synthetic participant."""
+
+    def __init__(self, track: SyntheticAudioTrack, peer_id: str = ""):
+        self.id = uuid.uuid4().hex
+        self.peer_id = peer_id
+        self.kind = types.SimpleNamespace(value="audio")
+        self.track = track
+        # No RTP receiver, so "opus" mode falls back to transcoding like it does in Huddle01
+        self.rtpReceiver = None
+        self._observer = FakeObserver()
+
+    async def pause(self):
+        self.track.pause()
+
+    async def resume(self):
+        self.track.resume()
+
+    async def close(self):
+        self.track.stop()
+        await self._observer.emit("close")
+
+
+class FakeRoom:
+    """
+    A room, its participants and the managers that joined it.
+
+    Args:
+        room_id: Id passed to `/start`.
+        participants: Peers in the room before the recorder joins.
+        join_delay: Seconds joining takes, like signalling and ICE would.
+        max_delay: Seconds a track's consumer may lag behind before frames are dropped.
+    """
+
+    def __init__(
+        self,
+        room_id: str,
+        participants: int,
+        join_delay: float = 0.05,
+        max_delay: float = 0.2,
+    ):
+        self.room_id = room_id
+        self.join_delay = join_delay
+        self.max_delay = max_delay
+        self.peers: List[str] = [
+            f"{room_id}-peer-{index}" for index in range(participants)
+        ]
+        self.managers: List["FakeHuddle01Manager"] = []
+        self.tracks: List[SyntheticAudioTrack] = []
+        self.closed = False
+
+    def track_for(self, peer_id: str) -> SyntheticAudioTrack:
+        # A handful of voices is enough, and keeps the patterns out of the memory per room
+        voice = zlib.crc32(peer_id.encode()) % 8
+        track = SyntheticAudioTrack(
+            speech_pattern(seed=voice), max_delay=self.max_delay, peer_id=peer_id
+        )
+        self.tracks.append(track)
+        return track
+
+
+class FakeHuddle01:
+    """
+    The fake Huddle01 service every `FakeHuddle01Manager` joins rooms on.
+    Implemented as a singleton.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(FakeHuddle01, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        self._lock = threading.Lock()
+        self.rooms: Dict[str, FakeRoom] = {}
+        self._initialized = True
+
+    def create_room(self, room_id: str, participants: int, **kwargs) -> FakeRoom:
+        room = FakeRoom(room_id, participants, **kwargs)
+        with self._lock:
+            self.rooms[room_id] = room
+        return room
+
+    def add_peer(self, room_id: str, peer_id: str | None = None):
+        """A participant joins a room, and is consumed by every manager in it."""
+        room = self.rooms[room_id]
+        peer_id = peer_id or f"{room_id}-peer-{len(room.peers)}"
+        room.peers.append(peer_id)
+        for manager in list(room.managers):
+            asyncio.run_coroutine_threadsafe(manager.consume(peer_id), manager.loop)
+
+    def reconnect_peer(self, room_id: str, peer_id: str, away: float = 1.0):
+        """A participant drops and rejoins `away` seconds later, with new consumers."""
+        room = self.rooms[room_id]
+        for manager in list(room.managers):
+            asyncio.run_coroutine_threadsafe(
+                manager.reconnect(peer_id, away), manager.loop
+            )
+
+    def mute_peer(
+        self, room_id: str, peer_id: str, muted: bool = True, signal: bool = True
+    ):
+        """
+        A participant mutes (or unmutes): its tracks send silence, and with `signal`
+        every manager in the room is told, like Huddle01 reports producer pauses.
+        """
+        room = self.rooms[room_id]
+        for track in room.tracks:
+            if track.peer_id == peer_id:
+                track.muted = muted
+        if not signal:
+            return
+        for manager in list(room.managers):
+            if manager.activity:
+                notify = (
+                    manager.activity.producer_muted
+                    if muted
+                    else manager.activity.producer_unmuted
+                )
+                manager.loop.call_soon_threadsafe(notify, peer_id)
+
+    def close_room(self, room_id: str):
+        """The room ends for everybody, like Huddle01's RoomClosed."""
+        room = self.rooms[room_id]
+        room.closed = True
+        for manager in list(room.managers):
+            manager.loop.call_soon_threadsafe(manager.emit, "completed")
+
+    def remove_room(self, room_id: str):
+        """Forget a room, so long runs do not keep every track ever created."""
+        with self._lock:
+            self.rooms.pop(room_id, None)
+
+    def track_stats(self) -> dict:
+        """Frames produced, delivered and dropped over every track ever created."""
+        with self._lock:
+            rooms = list(self.rooms.values())
+        tracks = [track for room in rooms for track in room.tracks]
+        return {
+            "tracks": len(tracks),
+            "frames_due": sum(track.frames_due for track in tracks),
+            "frames_sent": sum(track.frames_sent for track in tracks),
+            "frames_dropped": sum(track.frames_dropped for track in tracks),
+            "frames_paused": sum(track.frames_paused for track in tracks),
+        }
+
+
+class FakeHuddle01Manager(AsyncIOEventEmitter):
+    """
+    Drop-in replacement for `Huddle01Manager` that joins `FakeHuddle01` rooms.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        api_key: str,
+        loop=None,
+        recording_options: RecordingOptions | None = None,
+        session=None,
+    ):
+        super(FakeHuddle01Manager, self).__init__(loop=loop)
+        self.project_id = project_id
+        self.api_key = api_key
+        self.loop = loop or asyncio.get_event_loop()
+        self.recording_options = recording_options or RecordingOptions()
+        self.session = session
+        self.room: FakeRoom | None = None
+        self.consumers: List[FakeConsumer] = []
+        self.mixer = None
+        self.mix_recorder = None
+        self.manifest = None
+        self.peers = {}
+        self.activity = None
+
+    async def join_room(self, room_id: str) -> FakeRoom:
+        room = FakeHuddle01().rooms.get(room_id)
+        if room is None or room.closed:
+            raise Exception(f"Room {room_id} does not exist")
+
+        await asyncio.sleep(room.join_delay)
+        self.room = room
+        room.managers.append(self)
+        self.activity = start_consumer_activity(self.recording_options)
+        self.manifest = start_room_manifest(
+            self.recording_options, room_id=room_id, session=self.session
+        )
+        self.mixer, self.mix_recorder = await start_room_mix(
+            self.recording_options,
+            room_id=room_id,
+            session=self.session,
+            manifest=self.manifest,
+        )
+        for peer_id in list(room.peers):
+            await self.consume(peer_id)
+        return room
+
+    async def consume(self, peer_id: str):
+        if self.room is None:
+            return
+        consumer = FakeConsumer(self.room.track_for(peer_id), peer_id)
+        self.consumers.append(consumer)
+        await on_new_consumer(
+            {"consumer": consumer, "remote_peer_id": peer_id},
+            recording_options=self.recording_options,
+            room_id=self.room.room_id,
+            session=self.session,
+            mixer=self.mixer,
+            manifest=self.manifest,
+            peers=self.peers,
+            activity=self.activity,
+        )
+
+    async def reconnect(self, peer_id: str, away: float):
+        dropped = [
+            consumer for consumer in self.consumers if consumer.peer_id == peer_id
+        ]
+        self.consumers = [
+            consumer for consumer in self.consumers if consumer.peer_id != peer_id
+        ]
+        for consumer in dropped:
+            await consumer.close()
+        await asyncio.sleep(away)
+        await self.consume(peer_id)
+
+    async def leave_room(self):
+        consumers, self.consumers = self.consumers, []
+        for consumer in consumers:
+            await consumer.close()
+        mixer, self.mixer = self.mixer, None
+        activity, self.activity = self.activity, None
+        await stop_consumer_activity(activity)
+        await stop_peer_recordings(self.peers)
+        await stop_room_mix(mixer, self.mix_recorder)
+        manifest, self.manifest = self.manifest, None
+        finish_room_manifest(manifest, self.session)
+        if self.room and self in self.room.managers:
+            self.room.managers.remove(self)
+        self.room = None
@@ -0,0 +1,185 @@
+"""
+Local stand-ins for R2/S3 and the webhook endpoint.
+
+Both run a threaded HTTP server on a free loopback port, keep counters instead of
+data and can be made slow or flaky with `latency` and `fail_rate`.
+`FakeS3Server` understands the requests chatot makes: PutObject and the multipart
+upload calls, with path-style addressing (`S3_ENDPOINT_URL`).
+"""
+
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeServer:
+    """
+    Base class: a background HTTP server with counters.
+
+    Args:
+        latency: Seconds every request is held before it is answered.
+        fail_rate: Share of requests answered with a 503.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.requests = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name=type(self).__name__, daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> tuple:
+        """Answer a request with (status, headers, body)."""
+        raise NotImplementedError
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _read_body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                    body = bytearray()
+                    while True:
+                        size = int(self.rfile.readline().split(b";")[0], 16)
+                        if size == 0:
+                            # Trailers end with an empty line
+                            while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                                pass
+                            return bytes(body)
+                        body += self.rfile.read(size)
+                        self.rfile.readline()
+                return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+            def _serve(self):
+                body = self._read_body()
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                with server._lock:
+                    server.requests += 1
+                    failed = random.random() < server.fail_rate
+                    if failed:
+                        server.failures += 1
+                if failed:
+                    status, headers, payload = 503, {}, b"Slow Down"
+                else:
+                    status, headers, payload = server.handle(
+                        self.command,
+                        url.path,
+                        parse_qs(url.query, keep_blank_values=True),
+                        self.headers,
+                        body,
+                    )
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class FakeS3Server(FakeServer):
+    """
+    Accepts uploads and remembers the size of every object.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        super(FakeS3Server, self).__init__(latency, fail_rate)
+        self.objects = {}
+        self.bytes_received = 0
+        self._uploads = {}
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> tuple:
+        key = path.lstrip("/").split("/", 1)[-1]
+        # aws-chunked bodies carry signatures around the data, the decoded length is the object size
+        size = int(headers.get("x-amz-decoded-content-length") or len(body))
+        etag = {"ETag": f'"{uuid.uuid4().hex}"'}
+
+        with self._lock:
+            if method == "POST" and "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                self._uploads[upload_id] = 0
+                return (
+                    200,
+                    {"Content-Type": "application/xml"},
+                    (
+                        f"<InitiateMultipartUploadResult><Key>{key}</Key>"
+                        f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                    ).encode(),
+                )
+            if method == "PUT" and "uploadId" in query:
+                self._uploads[query["uploadId"][0]] += size
+                self.bytes_received += size
+                return 200, etag, b""
+            if method == "POST" and "uploadId" in query:
+                self.objects[key] = self._uploads.pop(query["uploadId"][0], 0)
+                return (
+                    200,
+                    {"Content-Type": "application/xml"},
+                    (
+                        f"<CompleteMultipartUploadResult><Key>{key}</Key>"
+                        f"<ETag>{etag['ETag']}</ETag></CompleteMultipartUploadResult>"
+                    ).encode(),
+                )
+            if method == "DELETE" and "uploadId" in query:
+                self._uploads.pop(query["uploadId"][0], None)
+                return 204, {}, b""
+            if method == "PUT":
+                self.objects[key] = size
+                self.bytes_received += size
+                return 200, etag, b""
+        return 404, {}, b""
+
+
+class FakeWebhookServer(FakeServer):
+    """
+    Accepts webhooks and keeps their payloads.
+    """
+
+    def __init__(self, latency: float = 0.0, fail_rate: float = 0.0):
+        super(FakeWebhookServer, self).__init__(latency, fail_rate)
+        self.payloads = []
+
+    def handle(
+        self, method: str, path: str, query: dict, headers, body: bytes
+    ) -> tuple:
+        if method != "POST":
+            return 405, {}, b""
+        with self._lock:
+            self.payloads.append(json.loads(body or b"null"))
+        return 200, {"Content-Type": "application/json"}, b'{"status": "ok"}'
@@ -0,0 +1,133 @@
+"""
+Synthetic audio tracks that behave like aiortc's `RemoteStreamTrack`.
+
+`recv()` hands out 20 ms stereo `av.AudioFrame`s at real-time pace, the way decoded
+Opus comes out of a WebRTC receiver. A consumer that falls more than `max_delay`
+seconds behind loses the frames in between, like a jitter buffer that overflows,
+and they are counted in `frames_dropped`. A muted track sends silence, and a
+paused one (its consumer paused on the SFU) sends nothing; the frames produced
+while paused are counted in `frames_paused`.
+"""
+
+import asyncio
+import fractions
+import functools
+import time
+import uuid
+
+import av
+import numpy as np
+from aiortc.mediastreams import MediaStreamError
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960
+FRAME_SECONDS = FRAME_SAMPLES / SAMPLE_RATE
+TIME_BASE = fractions.Fraction(1, SAMPLE_RATE)
+
+
+@functools.lru_cache(maxsize=None)
+def speech_pattern(
+    seconds: float = 4.0, silence: float = 0.3, seed: int = 0
+) -> np.ndarray:
+    """
+    Speech-like stereo s16 frames, shape (frames, 1, FRAME_SAMPLES * 2).
+
+    A voiced tone with noise and a syllable envelope, muted for the `silence` share of
+    each second so silence handling is exercised too. Patterns are cached and read-only,
+    so tracks sharing one do not add to the memory measured per room.
+    """
+    rng = np.random.default_rng(seed)
+    frames = int(seconds / FRAME_SECONDS)
+    t = np.arange(frames * FRAME_SAMPLES) / SAMPLE_RATE
+    pitch = 120 + 80 * rng.random()
+    envelope = 0.5 + 0.5 * np.sin(t * 2 * np.pi * 3)
+    voice = np.sin(t * 2 * np.pi * pitch) + 0.3 * rng.standard_normal(t.size)
+    voice *= (t % 1.0) >= silence
+    mono = (voice * envelope * 6000).astype(np.int16)
+    pattern = np.repeat(mono, 2).reshape(frames, 1, FRAME_SAMPLES * 2)
+    pattern.flags.writeable = False
+    return pattern
+
+
+class SyntheticAudioTrack:
+    """
+    A remote audio track producing `pattern` in a loop.
+
+    Args:
+        pattern: Frames from `speech_pattern`.
+        max_delay: Seconds a consumer may lag behind before frames are dropped.
+        peer_id: The participant producing the track.
+    """
+
+    kind = "audio"
+
+    def __init__(self, pattern: np.ndarray, max_delay: float = 0.2, peer_id: str = ""):
+        self.id = uuid.uuid4().hex
+        self.pattern = pattern
+        self.max_delay = max_delay
+        self.peer_id = peer_id
+        self.readyState = "live"
+        self.muted = False
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.frames_paused = 0
+        self._started = None
+        self._index = 0
+        self._resumed = asyncio.Event()
+        self._resumed.set()
+
+    @property
+    def frames_due(self) -> int:
+        """Frames the remote peer has produced so far."""
+        return self.frames_sent + self.frames_dropped + self.frames_paused
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        if self._resumed.is_set():
+            return
+        if self._started is not None:
+            # Nothing was forwarded meanwhile, carry on with what is produced now
+            current = int((time.monotonic() - self._started) / FRAME_SECONDS)
+            if current > self._index:
+                self.frames_paused += current - self._index
+                self._index = current
+        self._resumed.set()
+
+    async def recv(self) -> av.AudioFrame:
+        if self.readyState != "live":
+            raise MediaStreamError
+        await self._resumed.wait()
+
+        now = time.monotonic()
+        if self._started is None:
+            self._started = now
+
+        due = self._started + self._index * FRAME_SECONDS
+        if now < due:
+            await asyncio.sleep(due - now)
+        elif now - due > self.max_delay:
+            # Everything older than the buffer is gone
+            skipped = int((now - due - self.max_delay) / FRAME_SECONDS) + 1
+            self._index += skipped
+            self.frames_dropped += skipped
+
+        if self.readyState != "live":
+            raise MediaStreamError
+
+        samples = self.pattern[self._index % len(self.pattern)]
+        if self.muted:
+            samples = np.zeros_like(samples)
+        frame = av.AudioFrame.from_ndarray(samples, format="s16", layout="stereo")
+        frame.sample_rate = SAMPLE_RATE
+        frame.time_base = TIME_BASE
+        frame.pts = self._index * FRAME_SAMPLES
+        self._index += 1
+        self.frames_sent += 1
+        return frame
+
+    def stop(self):
+        self.readyState = "ended"
+        # A paused track ends too
+        self._resumed.set()
@@ -0,0 +1,352 @@
+"""
+Load test: add rooms of synthetic participants until the node stops keeping up.
+
+Runs offline in one process. Rooms come from the fake Huddle01 side in
+`benchmarks.harness`, recordings go to a local S3 stand-in and webhooks to a
+local endpoint. Rooms are started and stopped through the Flask app, so the
+control plane, loop pool, recorders, encoder pool, upload service and webhook
+outbox all do their real work.
+
+Every step adds `--step` rooms of `--participants` tracks, lets them settle and
+measures the next `--hold` seconds:
+    drop rate:       frames lost over frames produced. A frame is lost when a track's
+                     consumer falls more than `--max-delay` behind, or when the encoder
+                     drops it.
+    CPU per track:   process CPU over the window, in percent of one core
+    memory per room: resident memory growth since the first room, per room
+    loop lag p95:    how late timers fire on the worst event loop
+A step is sustainable while the drop rate stays at or under `--max-drop-rate`. The
+run stops at the first step that is not. All rooms are then stopped, and the run
+checks that every track was uploaded and its webhook delivered.
+
+The exit status is 1 if a recording was lost or fewer than `--min-rooms` rooms were
+sustainable, so the run can gate CI.
+
+Usage:
+    python -m benchmarks.load --participants 4 --step 5 --max-rooms 100 --hold 10
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import psutil
+
+from benchmarks.harness.servers import FakeS3Server, FakeWebhookServer
+
+MB = 1024 * 1024
+
+
+def configure(
+    s3: FakeS3Server, webhook: FakeWebhookServer, workdir: str, admission: bool
+):
+    """
+    Point chatot at the local stand-ins. Has to run before chatot's subsystems are
+    created, they read their settings then; `get_settings()` is reloaded here.
+    """
+    os.environ.update(
+        {
+            "HUDDLE01_PROJECT_ID": "load-test",
+            "HUDDLE01_API_KEY": "load-test",
+            "ACCOUNT_ID": "load-test",
+            "ACCESS_KEY_ID": "load-test",
+            "ACCESS_KEY_SECRET": "load-test",
+            "BUCKET_NAME": "recordings",
+            "S3_ENDPOINT_URL": s3.url,
+            "CUSTOM_DOMAIN": "",
+            "WEBHOOK_URL": webhook.url,
+            "WEBHOOK_API_KEY": "load-test",
+            "WEBHOOK_OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+            "CLUSTER_STORE": "memory://",
+        }
+    )
+    if not admission:
+        # Measure what the node can do, not what admission control lets in
+        os.environ.update(
+            {
+                "ADMISSION_CPU_BUDGET": "1000",
+                "ADMISSION_LAG_BUDGET": "1000",
+                "ADMISSION_RSS_BUDGET_MB": str(1024 * 1024),
+            }
+        )
+    # Recordings are written under ./recordings
+    os.chdir(workdir)
+    from chatot.settings import reload_settings
+
+    reload_settings()
+
+
+def percentile(values: list, share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+class LoadDriver:
+    """Starts rooms through the API and measures each step."""
+
+    def __init__(self, args):
+        # Imported here, after `configure`
+        from chatot.api import apiHandler
+        from chatot.api.huddle_service import set_manager_factory
+        from chatot.utils.webhook_sender import WebhookSender
+        from benchmarks.harness.huddle import FakeHuddle01, FakeHuddle01Manager
+
+        self.args = args
+        self.hub = FakeHuddle01()
+        set_manager_factory(FakeHuddle01Manager)
+        WebhookSender(
+            endpoint_url=os.environ["WEBHOOK_URL"],
+            webhook_secret=os.environ["WEBHOOK_API_KEY"],
+        )
+        self.client = apiHandler.test_client()
+        self.process = psutil.Process(os.getpid())
+        self.rooms = []
+        self.baseline_rss = self.process.memory_info().rss
+
+    def start_room(self):
+        room_id = f"load-{len(self.rooms)}"
+        self.hub.create_room(
+            room_id, self.args.participants, max_delay=self.args.max_delay
+        )
+        response = self.client.get(
+            "/start", query_string={"room_id": room_id, **self.args.params}
+        )
+        if response.status_code != 202:
+            raise Exception(
+                f"/start {room_id} answered {response.status_code}: {response.get_data(as_text=True)}"
+            )
+        self.rooms.append(response.get_json()["session_id"])
+
+    def wait_recording(self, timeout: float = 30.0):
+        from chatot.utils.sessions import SESSION_RECORDING
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            states = [
+                self.client.get(
+                    "/status", query_string={"session_id": session_id}
+                ).get_json()["state"]
+                for session_id in self.rooms
+            ]
+            if all(state == SESSION_RECORDING for state in states):
+                return
+            time.sleep(0.1)
+        raise Exception(f"Rooms did not start recording within {timeout}s: {states}")
+
+    def counters(self) -> dict:
+        from chatot.recorder.metrics import recorders
+
+        live = recorders()
+        cpu = self.process.cpu_times()
+        return {
+            **self.hub.track_stats(),
+            "encoder_dropped": sum(
+                recorder.pipeline.dropped_frames
+                for recorder in live
+                if recorder.pipeline
+            ),
+            "cpu_seconds": cpu.user + cpu.system,
+            "at": time.monotonic(),
+        }
+
+    def measure(self) -> dict:
+        from chatot.recorder.metrics import encoder_lag, live_recorders
+        from chatot.utils.loop_pool import LoopPool
+
+        time.sleep(self.args.settle)
+        before = self.counters()
+        lags, queued = [], []
+        deadline = time.monotonic() + self.args.hold
+        while time.monotonic() < deadline:
+            time.sleep(0.1)
+            lags.append(max((worker.lag for worker in LoopPool().workers), default=0.0))
+            queued.append(encoder_lag())
+        after = self.counters()
+
+        tracks = live_recorders()
+        due = after["frames_due"] - before["frames_due"]
+        dropped = (after["frames_dropped"] - before["frames_dropped"]) + (
+            after["encoder_dropped"] - before["encoder_dropped"]
+        )
+        cpu = (after["cpu_seconds"] - before["cpu_seconds"]) / (
+            after["at"] - before["at"]
+        )
+        rss = self.process.memory_info().rss
+        return {
+            "rooms": len(self.rooms),
+            "tracks": tracks,
+            "drop_rate": round(dropped / due, 5) if due else 0.0,
+            "cpu_percent_per_track": round(cpu * 100 / tracks, 3) if tracks else None,
+            "cpu_percent": round(cpu * 100, 1),
+            "rss_mb": round(rss / MB, 1),
+            "rss_mb_per_room": round(
+                (rss - self.baseline_rss) / MB / len(self.rooms), 3
+            ),
+            "loop_lag_p95_ms": round(percentile(lags, 0.95) * 1000, 3),
+            "encoder_lag_max_ms": round(max(queued, default=0.0) * 1000, 3),
+        }
+
+    def ramp(self) -> list:
+        steps = []
+        while len(self.rooms) + self.args.step <= self.args.max_rooms:
+            for _ in range(self.args.step):
+                self.start_room()
+            self.wait_recording()
+            step = self.measure()
+            step["sustainable"] = step["drop_rate"] <= self.args.max_drop_rate
+            steps.append(step)
+            print(json.dumps(step), file=sys.stderr)
+            if not step["sustainable"]:
+                break
+        return steps
+
+    def teardown(
+        self, s3: FakeS3Server, webhook: FakeWebhookServer, timeout: float = 60.0
+    ) -> dict:
+        """
+        Stop every room and wait for its uploads and webhooks. Only consumer tracks
+        are counted, the room mix and manifest come on top of them.
+        """
+        from chatot.huddle.handlers import MANIFEST_PEER_ID, MIX_PEER_ID
+
+        room_peers = (MIX_PEER_ID, MANIFEST_PEER_ID)
+
+        started = time.monotonic()
+        for session_id in self.rooms:
+            self.client.get("/stop", query_string={"session_id": session_id})
+
+        expected = self.hub.track_stats()["tracks"]
+        deadline = started + timeout
+        sessions = []
+        webhooks = []
+        while time.monotonic() < deadline:
+            sessions = [
+                self.client.get(
+                    "/status", query_string={"session_id": session_id}
+                ).get_json()
+                for session_id in self.rooms
+            ]
+            webhooks = [
+                payload
+                for payload in webhook.payloads
+                if payload.get("peerId") not in room_peers
+            ]
+            if (
+                all(session["state"] in ("done", "failed") for session in sessions)
+                and len(webhooks) >= expected
+            ):
+                break
+            time.sleep(0.2)
+
+        tracks = [
+            track
+            for session in sessions
+            for track in session["tracks"].values()
+            if track["peer_id"] not in room_peers
+        ]
+        return {
+            "seconds": round(time.monotonic() - started, 3),
+            "sessions_done": sum(session["state"] == "done" for session in sessions),
+            "sessions_failed": sum(
+                session["state"] == "failed" for session in sessions
+            ),
+            "tracks": expected,
+            "tracks_done": sum(track["state"] == "done" for track in tracks),
+            "objects_uploaded": len(s3.objects),
+            "bytes_uploaded": s3.bytes_received,
+            "s3_requests": s3.requests,
+            "webhooks_received": len(webhooks),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--participants", type=int, default=4, help="tracks per room")
+    parser.add_argument("--step", type=int, default=5, help="rooms added per step")
+    parser.add_argument("--max-rooms", type=int, default=100)
+    parser.add_argument(
+        "--hold", type=float, default=10.0, help="seconds measured per step"
+    )
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="seconds after a step starts recording before measuring",
+    )
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=0.2,
+        help="seconds a track may lag before frames are lost",
+    )
+    parser.add_argument("--max-drop-rate", type=float, default=0.001)
+    parser.add_argument(
+        "--min-rooms",
+        type=int,
+        default=0,
+        help="fail unless at least this many rooms are sustainable",
+    )
+    parser.add_argument(
+        "--s3-latency",
+        type=float,
+        default=0.0,
+        help="seconds added to every S3 request",
+    )
+    parser.add_argument("--s3-fail-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-latency", type=float, default=0.0)
+    parser.add_argument("--webhook-fail-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--admission",
+        action="store_true",
+        help="keep admission control at its configured budgets",
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="extra /start query param, e.g. --param codec=opus",
+    )
+    args = parser.parse_args()
+    args.params = dict(param.split("=", 1) for param in args.param)
+
+    s3 = FakeS3Server(latency=args.s3_latency, fail_rate=args.s3_fail_rate).start()
+    webhook = FakeWebhookServer(
+        latency=args.webhook_latency, fail_rate=args.webhook_fail_rate
+    ).start()
+    with tempfile.TemporaryDirectory(prefix="chatot-load-") as workdir:
+        configure(s3, webhook, workdir, args.admission)
+        driver = LoadDriver(args)
+        steps = driver.ramp()
+        teardown = driver.teardown(s3, webhook)
+        os.chdir("/")
+
+    sustainable = [step for step in steps if step["sustainable"]]
+    best = sustainable[-1] if sustainable else None
+    report = {
+        "participants_per_room": args.participants,
+        "max_sustainable_rooms": best["rooms"] if best else 0,
+        "max_sustainable_tracks": best["tracks"] if best else 0,
+        "cpu_percent_per_track": best["cpu_percent_per_track"] if best else None,
+        "rss_mb_per_room": best["rss_mb_per_room"] if best else None,
+        "steps": steps,
+        "teardown": teardown,
+    }
+    print(json.dumps(report, indent=2))
+
+    lost = (
+        teardown["tracks_done"] < teardown["tracks"]
+        or teardown["webhooks_received"] < teardown["tracks"]
+    )
+    if lost or report["max_sustainable_rooms"] < args.min_rooms:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
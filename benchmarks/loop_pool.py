@@ -0,0 +1,193 @@
+"""
+Rooms-per-core benchmark: shared loop pool vs one thread and loop per room.
+
+Every simulated room runs a few "tracks" that wake up every 20 ms, like
+`track.recv()` does, and burn a small amount of CPU for the per-frame work.
+Rooms are added in steps until the p95 wake-up lateness exceeds one frame,
+which is the point where a real recorder starts losing audio.
+
+Usage:
+    python -m benchmarks.loop_pool --tracks 4 --step 25 --max-rooms 1000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+
+import psutil
+
+from chatot.utils.loop_pool import LoopPool
+
+FRAME_INTERVAL = 0.02
+
+
+def busy(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def simulated_track(samples: list, work: float):
+    next_tick = time.perf_counter() + FRAME_INTERVAL
+    while True:
+        await asyncio.sleep(max(0.0, next_tick - time.perf_counter()))
+        samples.append(time.perf_counter() - next_tick)
+        busy(work)
+        next_tick += FRAME_INTERVAL
+
+
+async def simulated_room(tracks: int, samples: list, work: float):
+    await asyncio.gather(*[simulated_track(samples, work) for _ in range(tracks)])
+
+
+class ThreadPerRoomModel:
+    """The previous model: every room gets its own thread and event loop."""
+
+    name = "thread-per-room"
+
+    def __init__(self, tracks: int, work: float):
+        self.tracks = tracks
+        self.work = work
+        self.rooms = []
+        self.samples = []
+
+    def add_room(self):
+        loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(loop)
+            task = loop.create_task(
+                simulated_room(self.tracks, self.samples, self.work)
+            )
+            try:
+                loop.run_until_complete(task)
+            except asyncio.CancelledError:
+                pass
+            finally:
+                loop.close()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.rooms.append((loop, thread))
+
+    def close(self):
+        for loop, _ in self.rooms:
+            loop.call_soon_threadsafe(
+                lambda loop=loop: [t.cancel() for t in asyncio.all_tasks(loop)]
+            )
+        for _, thread in self.rooms:
+            thread.join(timeout=5.0)
+
+
+class LoopPoolModel:
+    """The new model: rooms share the process-wide loop pool."""
+
+    name = "loop-pool"
+
+    def __init__(self, tracks: int, work: float):
+        self.tracks = tracks
+        self.work = work
+        self.pool = LoopPool()
+        self.rooms = []
+        self.samples = []
+
+    def add_room(self):
+        worker = self.pool.acquire()
+        future = worker.submit(simulated_room(self.tracks, self.samples, self.work))
+        self.rooms.append((worker, future))
+
+    def close(self):
+        for worker, future in self.rooms:
+            future.cancel()
+            self.pool.release(worker)
+
+
+def p95(samples: list) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def run_model(model, args) -> dict:
+    process = psutil.Process()
+    steps = []
+    sustained = 0
+
+    rooms = 0
+    while rooms < args.max_rooms:
+        for _ in range(args.step):
+            model.add_room()
+        rooms += args.step
+
+        time.sleep(args.warmup)
+        model.samples.clear()
+        cpu_before = process.cpu_times()
+        time.sleep(args.window)
+        cpu_after = process.cpu_times()
+
+        lateness = p95(list(model.samples))
+        cpu = (
+            cpu_after.user + cpu_after.system - cpu_before.user - cpu_before.system
+        ) / args.window
+        step = {
+            "rooms": rooms,
+            "p95_lateness_ms": round(lateness * 1000, 2),
+            "cpu_cores": round(cpu, 2),
+            "threads": process.num_threads(),
+            "rss_mb": round(process.memory_info().rss / 1024 / 1024, 1),
+        }
+        steps.append(step)
+        print(f"[{model.name}] {json.dumps(step)}", flush=True)
+
+        if lateness > FRAME_INTERVAL:
+            break
+        sustained = rooms
+
+    model.close()
+    cores = os.cpu_count() or 1
+    return {
+        "model": model.name,
+        "sustained_rooms": sustained,
+        "rooms_per_core": round(sustained / cores, 1),
+        "steps": steps,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--tracks", type=int, default=4, help="audio tracks per room")
+    parser.add_argument(
+        "--work-us",
+        type=float,
+        default=100.0,
+        help="python-side CPU per frame in microseconds",
+    )
+    parser.add_argument("--step", type=int, default=25, help="rooms added per step")
+    parser.add_argument("--max-rooms", type=int, default=1000)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--window", type=float, default=3.0)
+    parser.add_argument("--model", choices=["both", "pool", "thread"], default="both")
+    args = parser.parse_args()
+
+    work = args.work_us / 1_000_000
+    results = []
+    if args.model in ("both", "thread"):
+        results.append(run_model(ThreadPerRoomModel(args.tracks, work), args))
+    if args.model in ("both", "pool"):
+        results.append(run_model(LoopPoolModel(args.tracks, work), args))
+
+    print(
+        json.dumps(
+            [{k: v for k, v in r.items() if k != "steps"} for r in results], indent=2
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+"""
+Microbenchmarks for the per-frame, upload and webhook paths, compared to a baseline.
+
+    recorder.<codec>     WebRTCMediaRecorder throughput, frames/s. The frames come from
+                         a track that never waits, so the numbers show encoding, muxing
+                         and the encoder pool hand-off, not real-time pacing.
+    mux.<container>      Muxing already encoded packets, microseconds per packet.
+    mixer.frame          Adding a received frame to a 4 track room mix, including
+                         reading the mix back, microseconds per received frame.
+    upload.file          upload_file to the local S3 stand-in, MB/s.
+    upload.bytes         upload_bytes of a small JSON object, ms per object.
+    webhook.latency      send_webhook until the endpoint has it, median ms.
+    session.join_leave   start_session until recording, plus stop_session until
+                         done, on an empty fake room, ms.
+    startup.import       `import chatot.main` in a fresh interpreter, ms.
+    startup.healthz      starting a node until `/healthz` answers, ms. See
+                         `benchmarks.startup` for the budgets.
+
+Every benchmark runs `--repeat` times and keeps its best result. The results are
+written to `--output` as JSON and compared to `--baseline`. The run fails (exit
+status 1) when a result is worse than the baseline by more than `--threshold`
+(BENCH_THRESHOLD, 0.15 by default), and (exit status 2) when there is no baseline,
+so a regression gate without one cannot pass by accident.
+
+Baselines only mean something on the machine that recorded them. Record one there
+with `--update-baseline`.
+
+Usage:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --only recorder --update-baseline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from fractions import Fraction
+from typing import Callable, Dict
+
+import av
+
+from benchmarks.harness import (
+    FakeS3Server,
+    FakeWebhookServer,
+    SyntheticAudioTrack,
+    speech_pattern,
+)
+from benchmarks.load import configure
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), "results.json")
+
+MB = 1024 * 1024
+
+
+@dataclass
+class Result:
+    """
+    One measured number.
+
+    Attributes:
+        value: The best result over the repeats.
+        unit: What `value` counts.
+        higher_is_better: Whether a larger value is an improvement.
+    """
+
+    value: float
+    unit: str
+    higher_is_better: bool
+
+
+# Benchmarks by name, in the order they run
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Result]] = {}
+
+
+def benchmark(name: str):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+
+    return register
+
+
+class NullWriter:
+    """Discards muxed output so disk speed does not show up in the numbers."""
+
+    def write(self, data):
+        return len(data)
+
+
+class FastTrack(SyntheticAudioTrack):
+    """Hands out `frames` frames without waiting, then ends."""
+
+    def __init__(self, frames: int):
+        super(FastTrack, self).__init__(speech_pattern())
+        self.remaining = frames
+
+    async def recv(self) -> av.AudioFrame:
+        if self.remaining <= 0:
+            self.stop()
+        self.remaining -= 1
+        # Never behind schedule, so no frame is dropped
+        self._started = time.monotonic() - self._index * 0.02
+        return await super(FastTrack, self).recv()
+
+
+def record(profile, frames: int, workdir: str) -> float:
+    """Seconds to record `frames` frames with `profile`, until the file is closed."""
+    from chatot.recorder import WebRTCMediaRecorder
+
+    async def run():
+        done = asyncio.Event()
+        recorder = WebRTCMediaRecorder(
+            track=FastTrack(frames),
+            output_path=os.path.join(workdir, f"bench.{profile.extension}"),
+            format=profile.container_format,
+            profile=profile,
+            loop=asyncio.get_running_loop(),
+        )
+        recorder.once("completed", done.set)
+        started = time.perf_counter()
+        await recorder.start()
+        await done.wait()
+        return time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def encoded_packets(codec: str, frames: int) -> tuple:
+    """(packets, stream settings) of `frames` frames encoded with `codec`."""
+    from chatot.recorder.profiles import CODECS
+
+    spec = CODECS[codec]
+    encoder = av.CodecContext.create(spec.encoder, "w")
+    encoder.sample_rate = 48000
+    encoder.layout = "stereo"
+    encoder.format = encoder.codec.audio_formats[0].name
+    resampler = av.AudioResampler(
+        format=encoder.format.name, layout="stereo", rate=48000
+    )
+    encoder.open()
+
+    track = FastTrack(frames)
+    packets = []
+    for index in range(frames):
+        frame = track.pattern[index % len(track.pattern)]
+        frame = av.AudioFrame.from_ndarray(frame, format="s16", layout="stereo")
+        frame.sample_rate = 48000
+        frame.pts = index * 960
+        for resampled in resampler.resample(frame):
+            packets += encoder.encode(resampled)
+    packets += encoder.encode(None)
+    return packets, spec.encoder
+
+
+def mux_cost(codec: str, container_format: str, frames: int) -> float:
+    """Microseconds spent in `container.mux` per packet."""
+    packets, encoder_name = encoded_packets(codec, frames)
+    container = av.open(NullWriter(), mode="w", format=container_format)
+    stream = container.add_stream(encoder_name, rate=48000, layout="stereo")
+
+    elapsed = 0.0
+    for packet in packets:
+        packet.stream = stream
+        started = time.perf_counter()
+        container.mux(packet)
+        elapsed += time.perf_counter() - started
+    container.close()
+    return elapsed / len(packets) * 1e6
+
+
+def register_codecs():
+    from chatot.recorder.profiles import CODECS, RecordingProfile
+
+    for codec, spec in CODECS.items():
+
+        @benchmark(f"recorder.{codec}")
+        def recorder_throughput(args, codec=codec):
+            seconds = min(
+                record(RecordingProfile(codec=codec), args.frames, args.workdir)
+                for _ in range(args.repeat)
+            )
+            return Result(round(args.frames / seconds, 1), "frames/s", True)
+
+        @benchmark(f"mux.{spec.container}.{codec}")
+        def mux(args, codec=codec, container=spec.container):
+            return Result(
+                round(
+                    min(
+                        mux_cost(codec, container, args.frames)
+                        for _ in range(args.repeat)
+                    ),
+                    3,
+                ),
+                "us/packet",
+                False,
+            )
+
+    # Opus passthrough also writes WebM
+    @benchmark("mux.webm.opus")
+    def mux_webm(args):
+        return Result(
+            round(
+                min(mux_cost("opus", "webm", args.frames) for _ in range(args.repeat)),
+                3,
+            ),
+            "us/packet",
+            False,
+        )
+
+
+def mix_cost(inputs: int, frames: int) -> float:
+    """Microseconds per received frame to mix `inputs` tracks of `frames` frames and read the mix."""
+    from chatot.recorder.mixer import MIX_FRAME_SAMPLES, RoomMixer
+
+    mixer = RoomMixer()
+    tracks = [
+        (mixer.add_input(f"peer-{index}", f"track-{index}"), FastTrack(frames))
+        for index in range(inputs)
+    ]
+    received = [
+        [
+            av.AudioFrame.from_ndarray(
+                track.pattern[index % len(track.pattern)], format="s16", layout="stereo"
+            )
+            for index in range(frames)
+        ]
+        for _, track in tracks
+    ]
+    for frame_list in received:
+        for index, frame in enumerate(frame_list):
+            frame.sample_rate = 48000
+            frame.time_base = Fraction(1, 48000)
+            frame.pts = index * MIX_FRAME_SAMPLES
+
+    elapsed = 0.0
+    for index in range(frames):
+        # The mix reads one frame per received frame of each track, as in real time
+        mixer.started = time.monotonic() - (index + 1) * MIX_FRAME_SAMPLES / 48000
+        started = time.perf_counter()
+        for (mix_input, _), frame_list in zip(tracks, received):
+            mix_input.write(frame_list[index])
+        if index:
+            mixer._read()
+        elapsed += time.perf_counter() - started
+    return elapsed / (frames * inputs) * 1e6
+
+
+@benchmark("mixer.frame")
+def mixer_frame(args):
+    return Result(
+        round(min(mix_cost(4, args.frames) for _ in range(args.repeat)), 3),
+        "us/frame",
+        False,
+    )
+
+
+@benchmark("upload.file")
+def upload_file_throughput(args):
+    from chatot.uploader import main as uploader
+
+    path = os.path.join(args.workdir, "upload.bin")
+    with open(path, "wb") as file:
+        file.write(os.urandom(args.upload_mb * MB))
+
+    best = None
+    for index in range(args.repeat):
+        started = time.perf_counter()
+        uploader.upload_file(path, f"bench/upload-{index}.bin")
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return Result(round(args.upload_mb / best, 2), "MB/s", True)
+
+
+@benchmark("upload.bytes")
+def upload_bytes_latency(args):
+    from chatot.uploader import main as uploader
+
+    data = json.dumps(
+        {"segments": [{"sequence": index, "duration": 60.0} for index in range(60)]}
+    ).encode()
+    timings = []
+    for index in range(args.repeat * 10):
+        started = time.perf_counter()
+        uploader.upload_bytes(
+            data, f"bench/index-{index}.json", content_type="application/json"
+        )
+        timings.append(time.perf_counter() - started)
+    return Result(round(statistics.median(timings) * 1000, 3), "ms", False)
+
+
+@benchmark("webhook.latency")
+def webhook_latency(args):
+    from chatot.utils.webhook_sender import WebhookSender
+
+    sender = WebhookSender()
+    webhook = args.webhook
+    timings = []
+    for index in range(args.repeat * 10):
+        expected = len(webhook.payloads) + 1
+        started = time.perf_counter()
+        sender.send_webhook(
+            peer_id="bench", audio_file_url=f"https://example.com/{index}.mp3"
+        )
+        while len(webhook.payloads) < expected:
+            time.sleep(0.0005)
+        timings.append(time.perf_counter() - started)
+    return Result(round(statistics.median(timings) * 1000, 3), "ms", False)
+
+
+@benchmark("session.join_leave")
+def join_leave(args):
+    from chatot.api.huddle_service import start_session, stop_session
+    from chatot.utils.sessions import SESSION_RECORDING, SessionRegistry
+    from benchmarks.harness.huddle import FakeHuddle01
+
+    def wait(condition):
+        while not condition():
+            time.sleep(0.0005)
+
+    timings = []
+    for index in range(args.repeat * 10):
+        room_id = f"bench-{index}"
+        FakeHuddle01().create_room(room_id, participants=0, join_delay=0)
+        session = SessionRegistry().create(room_id)
+        started = time.perf_counter()
+        start_session(session, "bench", "bench")
+        wait(lambda: session.state == SESSION_RECORDING or session.finished)
+        stop_session(session)
+        wait(lambda: session.finished)
+        timings.append(time.perf_counter() - started)
+    return Result(round(statistics.median(timings) * 1000, 3), "ms", False)
+
+
+@benchmark("startup.import")
+def startup_import(args):
+    from benchmarks.startup import measure_import
+
+    return Result(
+        round(min(measure_import()[0] for _ in range(args.repeat)) * 1000, 3),
+        "ms",
+        False,
+    )
+
+
+@benchmark("startup.healthz")
+def startup_healthz(args):
+    from benchmarks.startup import measure_serve
+
+    return Result(
+        round(min(measure_serve()[0] for _ in range(args.repeat)) * 1000, 3),
+        "ms",
+        False,
+    )
+
+
+def compare(results: Dict[str, Result], baseline: dict, threshold: float) -> list:
+    """Names and relative changes of the results worse than the baseline by more than `threshold`."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous["value"]:
+            continue
+        change = (result.value - previous["value"]) / previous["value"]
+        worse = -change if result.higher_is_better else change
+        if worse > threshold:
+            regressions.append((name, round(change, 4)))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--only",
+        action="append",
+        default=[],
+        help="run benchmarks whose name starts with this",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=1500,
+        help="frames per recorder and mux run (30 s of audio)",
+    )
+    parser.add_argument(
+        "--upload-mb", type=int, default=16, help="size of the uploaded file"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=float(os.getenv("BENCH_THRESHOLD") or 0.15)
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="write the results to --baseline as well",
+    )
+    args = parser.parse_args()
+    # Relative to where the command was run, before the working directory changes
+    args.baseline = os.path.abspath(args.baseline)
+    args.output = os.path.abspath(args.output)
+
+    s3 = FakeS3Server().start()
+    args.webhook = FakeWebhookServer().start()
+    results: Dict[str, Result] = {}
+    with tempfile.TemporaryDirectory(prefix="chatot-bench-") as workdir:
+        args.workdir = workdir
+        configure(s3, args.webhook, workdir, admission=False)
+
+        # Imported here, after `configure`
+        from chatot.api.huddle_service import set_manager_factory
+        from chatot.utils.webhook_sender import WebhookSender
+        from benchmarks.harness.huddle import FakeHuddle01Manager
+
+        set_manager_factory(FakeHuddle01Manager)
+        WebhookSender(
+            endpoint_url=os.environ["WEBHOOK_URL"],
+            webhook_secret=os.environ["WEBHOOK_API_KEY"],
+        )
+        register_codecs()
+
+        for name, fn in BENCHMARKS.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            results[name] = fn(args)
+            print(
+                f"{name:<24} {results[name].value:>12} {results[name].unit}",
+                file=sys.stderr,
+            )
+        os.chdir("/")
+
+    report = {
+        "machine": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "created_at": time.time(),
+        "results": {name: asdict(result) for name, result in results.items()},
+    }
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+
+    if args.update_baseline:
+        baseline = {"results": {}}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+        # Keep the baselines of benchmarks that did not run
+        baseline.update(machine=report["machine"], created_at=report["created_at"])
+        baseline["results"].update(report["results"])
+        with open(args.baseline, "w") as file:
+            json.dump(baseline, file, indent=2)
+        print(f"Baseline written to {args.baseline}", file=sys.stderr)
+        return
+
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline}, record one with --update-baseline",
+            file=sys.stderr,
+        )
+        sys.exit(2)
+
+    with open(args.baseline) as file:
+        regressions = compare(results, json.load(file), args.threshold)
+    for name, change in regressions:
+        print(
+            f"REGRESSION {name}: {change:+.1%} (threshold {args.threshold:.0%})",
+            file=sys.stderr,
+        )
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions over {args.threshold:.0%}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
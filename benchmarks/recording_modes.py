@@ -0,0 +1,136 @@
+"""
+CPU per participant: transcode (Opus -> PCM -> MP3) vs Opus passthrough.
+
+A few seconds of speech-like Opus packets are produced up front, then each mode
+processes them the way the live path does:
+    transcode:   aiortc's Opus decoder, then MP3 encode and mux (WebRTCMediaRecorder)
+    passthrough: wrap each payload in a packet and mux into Ogg (OpusPassthroughRecorder)
+
+CPU time is divided by the amount of audio processed, so the result reads as
+"cores used per participant" and its inverse as participants per core.
+
+Usage:
+    python -m benchmarks.recording_modes --seconds 60
+"""
+
+import argparse
+import fractions
+import json
+import time
+
+import av
+import numpy as np
+from aiortc.codecs.opus import OpusDecoder
+from aiortc.jitterbuffer import JitterFrame
+
+from chatot.recorder.opus_passthrough import OPUS_TIME_BASE, opus_packet_samples
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960
+
+
+class NullWriter:
+    """Discards muxed output so disk speed does not show up in the numbers."""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        return len(data)
+
+
+def speech_like_packets(seconds: float) -> list:
+    encoder = av.CodecContext.create("libopus", "w")
+    encoder.sample_rate = SAMPLE_RATE
+    encoder.layout = "stereo"
+    encoder.format = "s16"
+    encoder.open()
+
+    rng = np.random.default_rng(1)
+    packets = []
+    for index in range(int(seconds * SAMPLE_RATE / FRAME_SAMPLES)):
+        t = np.arange(FRAME_SAMPLES) + index * FRAME_SAMPLES
+        envelope = 0.5 + 0.5 * np.sin(t / SAMPLE_RATE * 2 * np.pi * 3)
+        voice = np.sin(t / SAMPLE_RATE * 2 * np.pi * 180) + 0.3 * rng.standard_normal(
+            FRAME_SAMPLES
+        )
+        mono = (voice * envelope * 6000).astype(np.int16)
+        frame = av.AudioFrame.from_ndarray(
+            np.repeat(mono, 2).reshape(1, -1), format="s16", layout="stereo"
+        )
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = index * FRAME_SAMPLES
+        packets += [
+            (bytes(packet), index * FRAME_SAMPLES) for packet in encoder.encode(frame)
+        ]
+    return packets
+
+
+def run_transcode(packets: list) -> int:
+    decoder = OpusDecoder()
+    writer = NullWriter()
+    container = av.open(writer, mode="w", format="mp3")
+    stream = container.add_stream("mp3")
+    for data, timestamp in packets:
+        for frame in decoder.decode(JitterFrame(data, timestamp)):
+            for packet in stream.encode(frame):
+                container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    return writer.size
+
+
+def run_passthrough(packets: list) -> int:
+    writer = NullWriter()
+    container = av.open(writer, mode="w", format="ogg")
+    stream = container.add_stream("libopus", rate=SAMPLE_RATE, layout="stereo")
+    stream.time_base = OPUS_TIME_BASE
+    for data, timestamp in packets:
+        packet = av.Packet(data)
+        packet.stream = stream
+        packet.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        packet.pts = timestamp
+        packet.dts = timestamp
+        packet.duration = opus_packet_samples(data)
+        container.mux(packet)
+    container.close()
+    return writer.size
+
+
+def measure(name: str, fn, packets: list, seconds: float) -> dict:
+    started = time.process_time()
+    size = fn(packets)
+    cpu = time.process_time() - started
+    cores_per_participant = cpu / seconds
+    return {
+        "mode": name,
+        "cpu_seconds": round(cpu, 3),
+        "cpu_ms_per_audio_second": round(cores_per_participant * 1000, 3),
+        "participants_per_core": int(1 / cores_per_participant)
+        if cores_per_participant
+        else None,
+        "output_kbps": round(size * 8 / seconds / 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=60.0, help="seconds of audio per run"
+    )
+    args = parser.parse_args()
+
+    packets = speech_like_packets(args.seconds)
+    results = [
+        measure("transcode", run_transcode, packets, args.seconds),
+        measure("passthrough", run_passthrough, packets, args.seconds),
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
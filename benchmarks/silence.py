@@ -0,0 +1,108 @@
+"""
+Cost of silence detection and encoder time saved by each silence policy.
+
+A synthetic track alternating 2 s of speech-like noise with 4 s of near silence
+is recorded with every policy. Detection cost is reported per frame and as the
+number of tracks one core could classify in real time.
+
+Usage:
+    python -m benchmarks.silence --seconds 60 --codec mp3
+"""
+
+import argparse
+import fractions
+import json
+import time
+
+import av
+import numpy as np
+
+from chatot.recorder.profiles import CODECS
+from chatot.recorder.silence import (
+    SILENCE_POLICIES,
+    TIMESTAMPED_CONTAINERS,
+    SilenceFilter,
+    SilentFrame,
+)
+
+from .recording_modes import NullWriter
+
+SAMPLE_RATE = 48000
+FRAME_SAMPLES = 960
+
+
+def synthetic_frames(seconds: float) -> list:
+    rng = np.random.default_rng(1)
+    frames = []
+    for index in range(int(seconds * SAMPLE_RATE / FRAME_SAMPLES)):
+        speaking = (index // 100) % 3 == 0
+        mono = (rng.standard_normal(FRAME_SAMPLES) * (3000 if speaking else 3)).astype(
+            np.int16
+        )
+        frame = av.AudioFrame.from_ndarray(
+            np.repeat(mono, 2).reshape(1, -1), format="s16", layout="stereo"
+        )
+        frame.sample_rate = SAMPLE_RATE
+        frame.pts = index * FRAME_SAMPLES
+        frame.time_base = fractions.Fraction(1, SAMPLE_RATE)
+        frames.append(frame)
+    return frames
+
+
+def run(policy: str, codec: str, frames: list, seconds: float) -> dict:
+    spec = CODECS[codec]
+    silence = SilenceFilter(
+        policy=policy, timestamped=spec.container in TIMESTAMPED_CONTAINERS
+    )
+    container = av.open(NullWriter(), mode="w", format=spec.container)
+    stream = container.add_stream(spec.encoder, rate=SAMPLE_RATE, layout="stereo")
+
+    started = time.process_time()
+    for frame in frames:
+        frame = silence.process(frame)
+        if frame is None:
+            continue
+        if isinstance(frame, SilentFrame):
+            frame = frame.to_frame()
+        for packet in stream.encode(frame):
+            container.mux(packet)
+    for packet in stream.encode(None):
+        container.mux(packet)
+    container.close()
+    cpu = time.process_time() - started
+
+    stats = silence.stats()
+    detect_per_frame = stats["detect_seconds"] / max(1, stats["frames"])
+    return {
+        "policy": policy,
+        "codec": codec,
+        "cpu_ms_per_audio_second": round(cpu / seconds * 1000, 3),
+        "detect_us_per_frame": round(detect_per_frame * 1e6, 2),
+        "tracks_per_core_detection": int(FRAME_SAMPLES / SAMPLE_RATE / detect_per_frame)
+        if detect_per_frame
+        else None,
+        "silent_frames": stats["silent_frames"],
+        "skipped_frames": stats["skipped_frames"],
+        "zeroed_frames": stats["zeroed_frames"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=60.0, help="seconds of audio per run"
+    )
+    parser.add_argument("--codec", default="mp3", choices=sorted(CODECS))
+    args = parser.parse_args()
+
+    results = [
+        run(policy, args.codec, synthetic_frames(args.seconds), args.seconds)
+        for policy in SILENCE_POLICIES
+    ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Memory soak: a steady number of recording rooms for a long time, checking that
+resident memory stays flat.
+
+Runs offline like `benchmarks.load`. `--rooms` rooms of `--participants` tracks are
+kept recording for `--duration` seconds. Every `--churn` seconds the oldest room is
+stopped and replaced by a new one, so joining, leaving, uploads and webhooks keep
+running as well. Every `--interval` seconds the run samples:
+    rss_mb:      resident memory of the process
+    blocks:      memory blocks allocated by the Python allocator
+    gc_pause_ms: total time spent in the cyclic collector so far
+    gc_full:     full (generation 2) collections so far
+
+Finished sessions stay in memory for `/status` until `SESSION_HISTORY` newer ones
+finished. The run keeps `--session-history` of them (at least `--rooms`), so the
+history fills up during the warmup instead of looking like growth.
+
+After `--warmup` seconds, the growth of RSS is fitted with a line. The run fails (exit
+status 1) when it grows by more than `--max-growth` MB per track per hour. GC runs
+with the node's settings (`chatot.utils.memory.tune_gc`) unless `--default-gc` is given.
+
+Usage:
+    python -m benchmarks.soak --rooms 10 --participants 4 --duration 7200
+    python -m benchmarks.soak --duration 300 --warmup 60 --interval 5
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import deque
+
+from benchmarks.harness.servers import FakeS3Server, FakeWebhookServer
+from benchmarks.load import MB, LoadDriver, configure
+
+
+def slope(points: list) -> float:
+    """Least squares slope of (x, y) points, 0 with fewer than two."""
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    if not spread:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+class SoakDriver(LoadDriver):
+    """Keeps `--rooms` rooms recording, replacing the oldest one every `--churn` seconds."""
+
+    def __init__(self, args):
+        super(SoakDriver, self).__init__(args)
+        self.started = 0
+        self.active = deque()
+        self.webhooks = 0
+
+    def start_room(self):
+        room_id = f"soak-{self.started}"
+        self.started += 1
+        self.hub.create_room(
+            room_id, self.args.participants, max_delay=self.args.max_delay
+        )
+        response = self.client.get(
+            "/start", query_string={"room_id": room_id, **self.args.params}
+        )
+        if response.status_code != 202:
+            raise Exception(
+                f"/start {room_id} answered {response.status_code}: {response.get_data(as_text=True)}"
+            )
+        self.active.append((room_id, response.get_json()["session_id"]))
+
+    def churn(self):
+        room_id, session_id = self.active.popleft()
+        self.client.get("/stop", query_string={"session_id": session_id})
+        # The fake service would otherwise keep every track ever created
+        self.hub.remove_room(room_id)
+        self.start_room()
+
+    def drain_webhooks(self, webhook: FakeWebhookServer):
+        # Payloads are only counted, keeping them would show up as growth
+        received, webhook.payloads = webhook.payloads, []
+        self.webhooks += len(received)
+
+    def sample(self, started: float) -> dict:
+        from chatot.recorder.metrics import live_recorders
+        from chatot.utils.memory import gc_paused
+
+        return {
+            "at": round(time.monotonic() - started, 1),
+            "tracks": live_recorders(),
+            "rss_mb": round(self.process.memory_info().rss / MB, 2),
+            "blocks": sys.getallocatedblocks(),
+            "gc_pause_ms": round(gc_paused() * 1000, 3),
+            "gc_full": gc.get_stats()[2]["collections"],
+        }
+
+    def run(self, webhook: FakeWebhookServer) -> list:
+        for _ in range(self.args.rooms):
+            self.start_room()
+
+        samples = []
+        started = time.monotonic()
+        next_churn = started + self.args.churn
+        next_sample = started
+        while True:
+            now = time.monotonic()
+            if now >= started + self.args.duration:
+                break
+            if self.args.churn and now >= next_churn:
+                self.churn()
+                next_churn += self.args.churn
+            if now >= next_sample:
+                self.drain_webhooks(webhook)
+                samples.append(self.sample(started))
+                print(json.dumps(samples[-1]), file=sys.stderr)
+                next_sample += self.args.interval
+            time.sleep(0.1)
+        return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--rooms", type=int, default=5)
+    parser.add_argument("--participants", type=int, default=4, help="tracks per room")
+    parser.add_argument("--duration", type=float, default=3600.0, help="seconds to run")
+    parser.add_argument(
+        "--warmup", type=float, default=300.0, help="seconds left out of the growth fit"
+    )
+    parser.add_argument(
+        "--interval", type=float, default=10.0, help="seconds between samples"
+    )
+    parser.add_argument(
+        "--churn",
+        type=float,
+        default=60.0,
+        help="seconds between replacing the oldest room, 0 to keep them",
+    )
+    parser.add_argument(
+        "--max-delay",
+        type=float,
+        default=0.2,
+        help="seconds a track may lag before frames are lost",
+    )
+    parser.add_argument(
+        "--max-growth",
+        type=float,
+        default=1.0,
+        help="fail above this many MB per track per hour",
+    )
+    parser.add_argument(
+        "--session-history",
+        type=int,
+        default=10,
+        help="finished sessions kept, see SESSION_HISTORY",
+    )
+    parser.add_argument(
+        "--default-gc",
+        action="store_true",
+        help="keep Python's GC thresholds instead of the node's",
+    )
+    parser.add_argument(
+        "--param",
+        action="append",
+        default=[],
+        help="extra /start query param, e.g. --param silence=gap",
+    )
+    args = parser.parse_args()
+    args.params = dict(param.split("=", 1) for param in args.param)
+
+    s3 = FakeS3Server().start()
+    webhook = FakeWebhookServer().start()
+    with tempfile.TemporaryDirectory(prefix="chatot-soak-") as workdir:
+        configure(s3, webhook, workdir, admission=False)
+        os.environ["SESSION_HISTORY"] = str(max(args.session_history, args.rooms))
+        driver = SoakDriver(args)
+        if not args.default_gc:
+            from chatot.utils.memory import tune_gc
+
+            tune_gc()
+        samples = driver.run(webhook)
+        driver.rooms = [session_id for _, session_id in driver.active]
+        teardown = driver.teardown(s3, webhook)
+        driver.drain_webhooks(webhook)
+        os.chdir("/")
+
+    tracks = args.rooms * args.participants
+    settled = [sample for sample in samples if sample["at"] >= args.warmup]
+    # MB per second, over the samples after the warmup
+    growth = slope([(sample["at"], sample["rss_mb"]) for sample in settled]) * 3600
+    report = {
+        "rooms": args.rooms,
+        "tracks": tracks,
+        "rooms_started": driver.started,
+        "webhooks_received": driver.webhooks,
+        "rss_mb_start": settled[0]["rss_mb"] if settled else None,
+        "rss_mb_end": settled[-1]["rss_mb"] if settled else None,
+        "rss_mb_per_hour": round(growth, 3),
+        "rss_mb_per_track_hour": round(growth / tracks, 4),
+        "blocks_per_hour": round(
+            slope([(sample["at"], sample["blocks"]) for sample in settled]) * 3600
+        ),
+        "gc_pause_ms": samples[-1]["gc_pause_ms"] if samples else 0.0,
+        "gc_full_collections": samples[-1]["gc_full"] if samples else 0,
+        "teardown": teardown,
+        "samples": samples,
+    }
+    print(json.dumps(report, indent=2))
+
+    if len(settled) < 2:
+        print("Not enough samples after the warmup to measure growth", file=sys.stderr)
+        sys.exit(1)
+    if report["rss_mb_per_track_hour"] > args.max_growth:
+        print(
+            f"RSS grows {report['rss_mb_per_track_hour']} MB per track per hour (limit {args.max_growth})",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Startup budget: how long a fresh process takes to import chatot and to answer
+`/healthz`.
+
+    import_ms      `import chatot.main` in a fresh interpreter
+    healthz_ms     starting `python -m chatot.main` until `/healthz` answers 204
+    warm_ms        starting it until `/load` reports the media stack warm
+
+Each is measured `--repeat` times and the best result is kept. Importing
+`chatot.main` must not import any of the heavy modules (PyAV, aiortc, huddle01,
+boto3, numpy); they are loaded in the background once the API is up.
+
+The run fails (exit status 1) when a heavy module is imported eagerly, or when
+`import_ms` exceeds `--import-budget` (STARTUP_IMPORT_BUDGET_MS, 300 by default)
+or `healthz_ms` exceeds `--healthz-budget` (STARTUP_HEALTHZ_BUDGET_MS, 2000 by
+default). The media stack warming up is reported but not budgeted.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 10 --import-budget 150
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("av", "aiortc", "huddle01", "boto3", "numpy")
+
+IMPORT_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import chatot.main
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "heavy": [name for name in %r if name in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def node_env(workdir: str, port: int) -> dict:
+    """Environment of a standalone node that needs nothing outside this host."""
+    return {
+        **os.environ,
+        # The node runs in `workdir`, where it writes its recordings
+        "PYTHONPATH": os.pathsep.join(filter(None, (ROOT, os.getenv("PYTHONPATH")))),
+        "HUDDLE01_PROJECT_ID": os.getenv("HUDDLE01_PROJECT_ID") or "startup",
+        "HUDDLE01_API_KEY": os.getenv("HUDDLE01_API_KEY") or "startup",
+        "PORT": str(port),
+        "WORKERS": "1",
+        "CLUSTER_STORE": "memory://",
+        "WEBHOOK_URL": "",
+        "WEBHOOK_OUTBOX_PATH": os.path.join(workdir, "outbox.sqlite3"),
+    }
+
+
+def measure_import() -> tuple:
+    """(seconds, heavy modules imported) for `import chatot.main` in a fresh interpreter."""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_PROBE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    probe = json.loads(output.strip().splitlines()[-1])
+    return probe["seconds"], probe["heavy"]
+
+
+def measure_serve(timeout: float = 60.0) -> tuple:
+    """(seconds until /healthz, seconds until the media stack is warm) for a fresh node."""
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory(prefix="chatot-startup-") as workdir:
+        started = time.perf_counter()
+        node = subprocess.Popen(
+            [sys.executable, "-m", "chatot.main"],
+            env=node_env(workdir, port),
+            cwd=workdir,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            healthz = warm = None
+            deadline = started + timeout
+            while warm is None:
+                if node.poll() is not None:
+                    raise Exception(
+                        f"The node exited with status {node.returncode} while starting"
+                    )
+                if time.perf_counter() > deadline:
+                    raise Exception(f"The node did not start within {timeout}s")
+                try:
+                    if healthz is None:
+                        if requests.get(f"{url}/healthz", timeout=1).status_code == 204:
+                            healthz = time.perf_counter() - started
+                    elif requests.get(f"{url}/load", timeout=1).json().get("warm"):
+                        warm = time.perf_counter() - started
+                except requests.RequestException:
+                    pass
+                time.sleep(0.005)
+        finally:
+            node.terminate()
+            node.wait(timeout=10)
+    return healthz, warm
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=float(os.getenv("STARTUP_IMPORT_BUDGET_MS") or 300),
+        help="ms",
+    )
+    parser.add_argument(
+        "--healthz-budget",
+        type=float,
+        default=float(os.getenv("STARTUP_HEALTHZ_BUDGET_MS") or 2000),
+        help="ms",
+    )
+    args = parser.parse_args()
+
+    imports, heavy = [], set()
+    for _ in range(args.repeat):
+        seconds, modules = measure_import()
+        imports.append(seconds)
+        heavy.update(modules)
+    serves = [measure_serve() for _ in range(args.repeat)]
+
+    report = {
+        "import_ms": round(min(imports) * 1000, 1),
+        "healthz_ms": round(min(healthz for healthz, _ in serves) * 1000, 1),
+        "warm_ms": round(min(warm for _, warm in serves) * 1000, 1),
+        "heavy_modules": sorted(heavy),
+        "import_budget_ms": args.import_budget,
+        "healthz_budget_ms": args.healthz_budget,
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if heavy:
+        failures.append(f"Importing chatot.main imports {', '.join(sorted(heavy))}")
+    if report["import_ms"] > args.import_budget:
+        failures.append(
+            f"Importing chatot.main took {report['import_ms']} ms (budget {args.import_budget} ms)"
+        )
+    if report["healthz_ms"] > args.healthz_budget:
+        failures.append(
+            f"/healthz answered after {report['healthz_ms']} ms (budget {args.healthz_budget} ms)"
+        )
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
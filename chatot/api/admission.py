@@ -0,0 +1,473 @@
+"""
+Admission control for `/start`.
+
+An overloaded node does not fail loudly: every room on it starts dropping frames.
+So before a room is joined, the node estimates what it would cost and refuses it
+(or holds it in a queue) when that would push the host past its budgets.
+
+The cost of a track is learnt from the node itself. Every `ADMISSION_INTERVAL`
+seconds the controller samples host CPU, this process' CPU and resident memory and
+the encoder and event loop lag, and divides the process' share by the tracks being
+recorded. Until there is a track to learn from, `ADMISSION_TRACK_CPU` and
+`ADMISSION_TRACK_RSS_MB` are used.
+
+Under sustained pressure the lowest priority room is stopped like a `/stop` would,
+so its recordings are still uploaded.
+"""
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Tuple
+
+import psutil
+
+from chatot.log import base_logger
+from chatot.recorder.metrics import encoder_lag, live_recorders
+from chatot.utils.loop_pool import LoopPool
+from chatot.utils.metrics import Counter, Gauge, MetricsRegistry
+from chatot.utils.sessions import (
+    SESSION_FAILED,
+    SESSION_JOINING,
+    SESSION_QUEUED,
+    SESSION_RECORDING,
+    Session,
+    SessionRegistry,
+)
+
+
+logger = base_logger.getChild(__name__)
+
+ADMISSION_REJECT = "reject"
+ADMISSION_QUEUE = "queue"
+ADMISSION_MODES = (ADMISSION_REJECT, ADMISSION_QUEUE)
+
+MB = 1024 * 1024
+
+# Weight of the newest sample in the per-track cost estimates
+COST_SMOOTHING = 0.2
+
+ADMISSIONS = Counter(
+    "chatot_admission_decisions_total",
+    "Admission decisions for new rooms: admitted, rejected, queued, dequeued or expired.",
+    ("decision",),
+)
+ROOMS_SHED = Counter(
+    "chatot_rooms_shed_total", "Rooms stopped to relieve an overloaded node."
+)
+
+
+@dataclass
+class LoadSample:
+    """
+    The node's load at one point in time.
+
+    Attributes:
+        cpu_percent: Host CPU use, 0-100 across all cores.
+        process_cpu_percent: This process' CPU use as a share of the host, 0-100.
+        rss: Resident memory of this process in bytes.
+        tracks: Tracks being recorded.
+        joining: Sessions admitted but not recording yet, their tracks are still to come.
+        encoder_lag: Seconds of audio waiting for the encoder on the worst track.
+        loop_lag: How late the latest timer fired on the worst event loop, in seconds.
+    """
+
+    cpu_percent: float = 0.0
+    process_cpu_percent: float = 0.0
+    rss: int = 0
+    tracks: int = 0
+    joining: int = 0
+    encoder_lag: float = 0.0
+    loop_lag: float = 0.0
+    taken_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def lag(self) -> float:
+        return max(self.encoder_lag, self.loop_lag)
+
+
+@dataclass
+class Decision:
+    """
+    Whether a new room fits on the node.
+
+    Attributes:
+        admitted: The room can be started now.
+        reason: Which budget it would exceed, if it was not admitted.
+        retry_after: Seconds a client should wait before trying again.
+    """
+
+    admitted: bool
+    reason: str | None = None
+    retry_after: int = 0
+
+
+@dataclass
+class QueuedStart:
+    """A session waiting for admission and how to start it once admitted."""
+
+    session: Session
+    start: Callable[[], None] = field(repr=False)
+    expected_tracks: int
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class AdmissionController:
+    """
+    Decides whether this node takes another room, and sheds rooms when it is overloaded.
+
+    Implemented as a singleton. A room is admitted when the host CPU, the process'
+    resident memory and the encoder/loop lag would all stay within their budgets with
+    its expected tracks added, counting the tracks of rooms still joining. The tracks
+    of a room admitted by `decide` are reserved until a sample sees the room, so rooms
+    started between two samples are not all checked against the same load.
+
+    In "reject" mode (`ADMISSION_MODE`) a room that does not fit is refused with a
+    `Retry-After`. In "queue" mode its session waits, highest priority first, until it
+    fits or `ADMISSION_QUEUE_TIMEOUT` seconds pass.
+
+    When host CPU stays above `ADMISSION_SHED_CPU` or lag above `ADMISSION_SHED_LAG`
+    for `ADMISSION_SHED_AFTER` samples in a row, the recording room with the lowest
+    priority below `ADMISSION_SHED_BELOW_PRIORITY` (the newest one on a tie) is stopped,
+    at most once every `ADMISSION_SHED_COOLDOWN` seconds.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(AdmissionController, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, mode: str | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.mode = mode or os.getenv("ADMISSION_MODE") or ADMISSION_REJECT
+        if self.mode not in ADMISSION_MODES:
+            raise ValueError(f"Unsupported admission mode: {self.mode}")
+
+        self.cpu_budget = float(os.getenv("ADMISSION_CPU_BUDGET") or 80)
+        self.rss_budget = int(
+            float(os.getenv("ADMISSION_RSS_BUDGET_MB") or 0) * MB
+        ) or int(psutil.virtual_memory().total * 0.75)
+        self.lag_budget = float(os.getenv("ADMISSION_LAG_BUDGET") or 0.5)
+        self.tracks_per_room = int(os.getenv("ADMISSION_TRACKS_PER_ROOM") or 4)
+        self.interval = float(os.getenv("ADMISSION_INTERVAL") or 1)
+        self.retry_after = int(os.getenv("ADMISSION_RETRY_AFTER") or 10)
+        self.queue_size = int(os.getenv("ADMISSION_QUEUE_SIZE") or 100)
+        self.queue_timeout = float(os.getenv("ADMISSION_QUEUE_TIMEOUT") or 300)
+        self.shed_cpu = float(os.getenv("ADMISSION_SHED_CPU") or 95)
+        self.shed_lag = float(os.getenv("ADMISSION_SHED_LAG") or 2.0)
+        self.shed_after = int(os.getenv("ADMISSION_SHED_AFTER") or 3)
+        self.shed_below = int(os.getenv("ADMISSION_SHED_BELOW_PRIORITY") or 1)
+        self.shed_cooldown = float(os.getenv("ADMISSION_SHED_COOLDOWN") or 10)
+
+        # Per-track cost, refined from every sample taken while tracks are recorded
+        self.track_cpu = float(os.getenv("ADMISSION_TRACK_CPU") or 1.0)
+        self.track_rss = float(os.getenv("ADMISSION_TRACK_RSS_MB") or 16) * MB
+
+        self.sessions = SessionRegistry()
+        self.process = psutil.Process(os.getpid())
+        self.cpu_count = psutil.cpu_count() or 1
+        # Memory of the idle process, not attributed to tracks
+        self.baseline_rss = self.process.memory_info().rss
+
+        self._lock = threading.Lock()
+        self._queue: List[tuple] = []
+        # Room id -> (expected tracks, when they were reserved)
+        self._reserved: Dict[str, Tuple[int, float]] = {}
+        self._sequence = itertools.count()
+        self._pressured = 0
+        self._last_shed = 0.0
+
+        # The first cpu_percent calls only start the measurement
+        psutil.cpu_percent(interval=None)
+        self.process.cpu_percent(interval=None)
+        self.last_sample = LoadSample(rss=self.baseline_rss)
+
+        self._thread = threading.Thread(
+            target=self._run, name="chatot-admission", daemon=True
+        )
+        self._thread.start()
+        MetricsRegistry().add_collector(self.collect)
+
+        self._initialized = True
+        logger.info(
+            f"Admission control in {self.mode} mode: cpu {self.cpu_budget}%, "
+            f"rss {self.rss_budget // MB} MB, lag {self.lag_budget}s"
+        )
+
+    def sample(self) -> LoadSample:
+        """Measure the node's load and update the per-track cost estimates."""
+        started = time.monotonic()
+        sessions = self.sessions.sessions()
+        with self.process.oneshot():
+            process_cpu = self.process.cpu_percent(interval=None) / self.cpu_count
+            rss = self.process.memory_info().rss
+
+        sample = LoadSample(
+            cpu_percent=psutil.cpu_percent(interval=None),
+            process_cpu_percent=process_cpu,
+            rss=rss,
+            tracks=live_recorders(),
+            joining=sum(1 for session in sessions if session.state == SESSION_JOINING),
+            encoder_lag=encoder_lag(),
+            loop_lag=max((worker.lag for worker in LoopPool().workers), default=0.0),
+        )
+
+        if sample.tracks:
+            track_cpu = sample.process_cpu_percent / sample.tracks
+            track_rss = max(0, sample.rss - self.baseline_rss) / sample.tracks
+            self.track_cpu += COST_SMOOTHING * (track_cpu - self.track_cpu)
+            self.track_rss += COST_SMOOTHING * (track_rss - self.track_rss)
+
+        # The sample now counts these rooms, or they never started
+        seen = {
+            session.room_id
+            for session in sessions
+            if session.state in (SESSION_JOINING, SESSION_RECORDING)
+        }
+        with self._lock:
+            self.last_sample = sample
+            self._reserved = {
+                room_id: (tracks, reserved_at)
+                for room_id, (tracks, reserved_at) in self._reserved.items()
+                if room_id not in seen and reserved_at > started - self.interval
+            }
+        return sample
+
+    def reserved(self) -> int:
+        """Tracks of rooms admitted since they were last sampled."""
+        return sum(tracks for tracks, _ in list(self._reserved.values()))
+
+    def check(self, expected_tracks: int | None = None) -> Decision:
+        """
+        Whether a room with `expected_tracks` tracks (`ADMISSION_TRACKS_PER_ROOM` by
+        default) fits within the budgets right now.
+        """
+        if expected_tracks is None:
+            expected_tracks = self.tracks_per_room
+
+        sample = self.last_sample
+        tracks = (
+            expected_tracks + sample.joining * self.tracks_per_room + self.reserved()
+        )
+        cpu = sample.cpu_percent + tracks * self.track_cpu
+        rss = sample.rss + tracks * self.track_rss
+
+        if sample.lag > self.lag_budget:
+            reason = (
+                f"Node is lagging {sample.lag:.2f}s behind (budget {self.lag_budget}s)"
+            )
+        elif cpu > self.cpu_budget:
+            reason = (
+                f"Room would take CPU to {cpu:.0f}% (budget {self.cpu_budget:.0f}%)"
+            )
+        elif rss > self.rss_budget:
+            reason = f"Room would take memory to {rss // MB} MB (budget {self.rss_budget // MB} MB)"
+        else:
+            return Decision(admitted=True)
+        return Decision(admitted=False, reason=reason, retry_after=self.retry_after)
+
+    def decide(self, room_id: str, expected_tracks: int | None = None) -> Decision:
+        """
+        `check` a new room, except that it never overtakes rooms already queued.
+        The tracks of an admitted room are reserved until the next sample sees it.
+        """
+        with self._lock:
+            decision = self.check(expected_tracks)
+            if decision.admitted and self._queue:
+                decision = Decision(
+                    admitted=False,
+                    reason="Rooms are waiting for capacity",
+                    retry_after=self.retry_after,
+                )
+            if decision.admitted:
+                tracks = (
+                    self.tracks_per_room if expected_tracks is None else expected_tracks
+                )
+                self._reserved[room_id] = (tracks, time.monotonic())
+
+        if decision.admitted:
+            ADMISSIONS.inc(decision="admitted")
+        elif self.mode == ADMISSION_REJECT:
+            ADMISSIONS.inc(decision="rejected")
+        return decision
+
+    def enqueue(
+        self,
+        session: Session,
+        start: Callable[[], None],
+        expected_tracks: int | None = None,
+    ) -> bool:
+        """
+        Hold a queued session until it is admitted, then call `start`.
+
+        Returns:
+            bool: False if the queue is full
+        """
+        entry = QueuedStart(
+            session=session,
+            start=start,
+            expected_tracks=self.tracks_per_room
+            if expected_tracks is None
+            else expected_tracks,
+        )
+        with self._lock:
+            if len(self._queue) >= self.queue_size:
+                ADMISSIONS.inc(decision="rejected")
+                return False
+            heapq.heappush(
+                self._queue, (-session.priority, next(self._sequence), entry)
+            )
+        ADMISSIONS.inc(decision="queued")
+        return True
+
+    def queued(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def headroom(self) -> int:
+        """How many more tracks the budgets allow, by the current estimates."""
+        sample = self.last_sample
+        if sample.lag > self.lag_budget:
+            return 0
+        free = (self.cpu_budget - sample.cpu_percent) / max(self.track_cpu, 0.001)
+        if self.track_rss > 0:
+            free = min(free, (self.rss_budget - sample.rss) / self.track_rss)
+        return max(
+            0, int(free) - sample.joining * self.tracks_per_room - self.reserved()
+        )
+
+    def stats(self) -> dict:
+        sample = self.last_sample
+        return {
+            "mode": self.mode,
+            "cpu_percent": round(sample.cpu_percent, 1),
+            "process_cpu_percent": round(sample.process_cpu_percent, 1),
+            "rss_mb": round(sample.rss / MB, 1),
+            "lag_ms": round(sample.lag * 1000, 3),
+            "track_cpu_percent": round(self.track_cpu, 3),
+            "track_rss_mb": round(self.track_rss / MB, 3),
+            "headroom_tracks": self.headroom(),
+            "queued": self.queued(),
+        }
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                sample = self.sample()
+                self._admit_queued()
+                self._shed(sample)
+            except Exception as e:
+                logger.error(f"Admission control failed: {e}")
+
+    def _admit_queued(self):
+        """Start queued sessions in priority order while they fit."""
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return
+                entry: QueuedStart = self._queue[0][2]
+                session = entry.session
+                if session.state != SESSION_QUEUED:
+                    # Stopped while waiting
+                    heapq.heappop(self._queue)
+                    continue
+                if time.monotonic() - entry.queued_at > self.queue_timeout:
+                    heapq.heappop(self._queue)
+                    expired = True
+                elif self.check(entry.expected_tracks).admitted:
+                    heapq.heappop(self._queue)
+                    expired = False
+                else:
+                    # Lower priority rooms wait behind the head of the queue
+                    return
+
+            if expired:
+                ADMISSIONS.inc(decision="expired")
+                session.set_state(
+                    SESSION_FAILED, error="Timed out waiting for capacity"
+                )
+                continue
+
+            ADMISSIONS.inc(decision="dequeued")
+            session.set_state(SESSION_JOINING)
+            # Count the new room before the next check
+            self.last_sample.joining += 1
+            try:
+                entry.start()
+            except Exception as e:
+                logger.error(f"Exception starting queued room {session.room_id}: {e}")
+                session.set_state(
+                    SESSION_FAILED, error=f"Exception during setup: {str(e)}"
+                )
+
+    def _shed(self, sample: LoadSample):
+        """Stop the least important room if the node has been overloaded for a while."""
+        if sample.cpu_percent > self.shed_cpu or sample.lag > self.shed_lag:
+            self._pressured += 1
+        else:
+            self._pressured = 0
+
+        if (
+            self._pressured < self.shed_after
+            or time.monotonic() - self._last_shed < self.shed_cooldown
+        ):
+            return
+
+        candidates = [
+            session
+            for session in self.sessions.sessions()
+            if session.state == SESSION_RECORDING and session.priority < self.shed_below
+        ]
+        if not candidates:
+            return
+
+        victim = min(
+            candidates, key=lambda session: (session.priority, -session.created_at)
+        )
+        logger.warning(
+            f"Shedding room {victim.room_id} (priority {victim.priority}): "
+            f"cpu {sample.cpu_percent:.0f}%, lag {sample.lag:.2f}s"
+        )
+        self._last_shed = time.monotonic()
+        self._pressured = 0
+        ROOMS_SHED.inc()
+        from .huddle_service import stop_session
+
+        stop_session(victim, reason="shed")
+
+    def collect(self) -> list:
+        """Queue length, per-track cost estimates and headroom, for `/metrics`."""
+        queued = Gauge(
+            "chatot_admission_queue_length",
+            "Rooms waiting for admission.",
+            register=False,
+        )
+        queued.set(self.queued())
+        track_cpu = Gauge(
+            "chatot_admission_track_cpu_percent",
+            "Estimated host CPU share of one track.",
+            register=False,
+        )
+        track_cpu.set(self.track_cpu)
+        track_rss = Gauge(
+            "chatot_admission_track_rss_bytes",
+            "Estimated resident memory of one track.",
+            register=False,
+        )
+        track_rss.set(self.track_rss)
+        headroom = Gauge(
+            "chatot_admission_headroom_tracks",
+            "Tracks the node can still take within its budgets.",
+            register=False,
+        )
+        headroom.set(self.headroom())
+        return [queued, track_cpu, track_rss, headroom]
@@ -0,0 +1,290 @@
+"""
+Draining the node before it exits, for rolling deploys.
+
+On SIGTERM or SIGINT (see `chatot.main`), or `POST /drain`, the node:
+
+1. stops taking rooms: `/healthz` answers 503 so load balancers take it out of
+   rotation, `/start` answers 503 (or, in a cluster, forwards to a node that is not
+   draining), the heartbeat publishes the node as full, and rooms still waiting for
+   admission fail so their clients can start them elsewhere;
+2. leaves every room at once, which stops the recorders and flushes their encoders,
+   and retries failed webhooks right away instead of after their backoff;
+3. waits until every session has uploaded its recordings, the upload queue is empty
+   and the webhook outbox is delivered, or `DRAIN_DEADLINE` seconds (25 by default)
+   have passed. Uploads and webhooks go out while other rooms are still leaving;
+4. logs a report and stops the server, so the process exits.
+
+The report (`GET /drain`, and the log) says how long it took to leave the rooms,
+finish the uploads and deliver the webhooks, and what was left behind: sessions
+with the tracks they had not uploaded, upload jobs and webhooks. Webhooks left
+behind stay in the outbox and are sent by the next process that opens it.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, List
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Gauge
+from chatot.utils.sessions import (
+    FINISHED_TRACK_STATES,
+    SESSION_FAILED,
+    SESSION_JOINING,
+    SESSION_LEAVING,
+    SESSION_QUEUED,
+    SESSION_RECORDING,
+    SessionRegistry,
+)
+from chatot.utils.types import DrainedSession, DrainReport
+
+logger = base_logger.getChild(__name__)
+
+POLL_SECONDS = 0.1
+# Phases of a drain, each is only reached once the previous ones are
+DRAIN_PHASES = ("rooms", "uploads", "webhooks")
+
+DRAINING = Gauge("chatot_draining", "1 while the node drains before exiting.")
+DRAIN_PENDING = Gauge(
+    "chatot_drain_pending",
+    "What the drain still waits for: sessions, uploads or webhooks.",
+    ("kind",),
+)
+
+
+class Drainer:
+    """
+    Drains this process, see the module docstring.
+
+    Implemented as a singleton: a process drains once, and every part of it asks the
+    same instance whether it is draining.
+
+    Args:
+        deadline: Seconds a drain may take (DRAIN_DEADLINE if None).
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(Drainer, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, deadline: float | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.deadline = (
+            deadline
+            if deadline is not None
+            else float(os.getenv("DRAIN_DEADLINE") or 25)
+        )
+        self.sessions = SessionRegistry()
+        self.reason = None
+        self.started_at = None
+        self.finished_at = None
+        self.rooms_stopped = 0
+        self.queued_failed = 0
+        self.phases = dict.fromkeys(DRAIN_PHASES)
+        self._started = 0.0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._report: DrainReport | None = None
+
+        self._initialized = True
+
+    @property
+    def draining(self) -> bool:
+        return self.started_at is not None
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def start(
+        self, reason: str, on_done: Callable[[DrainReport], None] | None = None
+    ) -> bool:
+        """
+        Start draining in the background, then call `on_done(report)` from the drain's thread.
+        Safe to call from a signal handler.
+
+        Returns:
+            bool: False if the process was already draining, `on_done` is then ignored
+        """
+        with self._lock:
+            if self.started_at is not None:
+                return False
+            self.started_at = time.time()
+            self._started = time.monotonic()
+            self.reason = reason
+        DRAINING.set(1)
+        threading.Thread(
+            target=self._run, args=(on_done,), name="chatot-drain", daemon=True
+        ).start()
+        return True
+
+    def wait(self, timeout: float | None = None) -> DrainReport | None:
+        """The final report once the drain ended, None if it did not within `timeout`."""
+        if not self._done.wait(timeout):
+            return None
+        return self._report
+
+    def report(self) -> DrainReport | None:
+        """The final report, or the progress of a running drain; None before one started."""
+        if self._report is not None:
+            return self._report
+        if not self.draining:
+            return None
+        return self._build_report(*self._pending())
+
+    def _run(self, on_done: Callable[[DrainReport], None] | None):
+        try:
+            self._drain()
+        except Exception as e:
+            logger.error(f"Drain failed: {e}")
+
+        self.finished_at = time.time()
+        report = self._report = self._build_report(*self._pending())
+        DRAINING.set(0)
+        self._done.set()
+
+        left = f"{len(report['sessions'])} sessions, {report['uploads']} uploads and {report['webhooks']} webhooks"
+        if report["complete"]:
+            logger.info(f"Drained in {report['duration']}s: {report}")
+        else:
+            logger.error(
+                f"Drain left {left} behind after {report['duration']}s: {report}"
+            )
+
+        if on_done:
+            try:
+                on_done(report)
+            except Exception as e:
+                logger.error(f"Error after drain: {e}")
+
+    def _drain(self):
+        logger.warning(f"Draining ({self.reason}) within {self.deadline}s")
+
+        from chatot.cluster import ClusterNode
+
+        cluster = ClusterNode()
+        cluster.draining = True
+        try:
+            # Tell the other nodes now rather than at the next heartbeat
+            cluster.beat()
+        except Exception as e:
+            logger.error(f"Could not publish the drain to the cluster: {e}")
+
+        for session in self.sessions.sessions():
+            if session.finished:
+                continue
+            if session.state == SESSION_QUEUED:
+                # Never joined: failing it lets the client start it on another node
+                if session.set_state(
+                    SESSION_FAILED, error="Node drained before the room was admitted"
+                ):
+                    self.queued_failed += 1
+                continue
+            from .huddle_service import stop_session
+
+            try:
+                stop_session(session, reason="drain")
+                self.rooms_stopped += 1
+            except Exception as e:
+                logger.error(
+                    f"Error stopping room {session.room_id} for the drain: {e}"
+                )
+
+        webhooks = _webhook_sender()
+        if webhooks is not None:
+            webhooks.flush()
+
+        while True:
+            # Sessions too: a track upload leaves the queue before its webhook is queued
+            if (
+                not any(self._pending())
+                or time.monotonic() - self._started >= self.deadline
+            ):
+                return
+            time.sleep(POLL_SECONDS)
+
+    def _pending(self) -> tuple:
+        """
+        Returns:
+            tuple: (sessions not finished, rooms not left, upload jobs, webhooks not delivered)
+        """
+        unfinished = [
+            session for session in self.sessions.sessions() if not session.finished
+        ]
+        in_room = sum(
+            session.state in (SESSION_JOINING, SESSION_RECORDING, SESSION_LEAVING)
+            for session in unfinished
+        )
+        uploads = _pending_uploads()
+        webhooks = _webhook_sender()
+        undelivered = webhooks.outbox.backlog()[0] if webhooks is not None else 0
+
+        DRAIN_PENDING.set(len(unfinished), kind="sessions")
+        DRAIN_PENDING.set(uploads, kind="uploads")
+        DRAIN_PENDING.set(undelivered, kind="webhooks")
+
+        # Track uploads end a session, so they count with the upload queue
+        elapsed = round(time.monotonic() - self._started, 3)
+        for phase, waiting in zip(
+            DRAIN_PHASES, (in_room, len(unfinished) + uploads, undelivered)
+        ):
+            if waiting:
+                break
+            if self.phases[phase] is None:
+                self.phases[phase] = elapsed
+        return unfinished, in_room, uploads, undelivered
+
+    def _build_report(
+        self, unfinished: List, in_room: int, uploads: int, undelivered: int
+    ) -> DrainReport:
+        sessions = []
+        for session in unfinished:
+            status = session.to_dict()
+            sessions.append(
+                DrainedSession(
+                    session_id=status["session_id"],
+                    room_id=status["room_id"],
+                    state=status["state"],
+                    pending_tracks=[
+                        track["object_name"]
+                        for track in status["tracks"].values()
+                        if track["state"] not in FINISHED_TRACK_STATES
+                    ],
+                )
+            )
+        return DrainReport(
+            reason=self.reason,
+            started_at=self.started_at,
+            finished_at=self.finished_at,
+            duration=round((self.finished_at or time.time()) - self.started_at, 3),
+            deadline=self.deadline,
+            complete=not (sessions or uploads or undelivered),
+            rooms_stopped=self.rooms_stopped,
+            queued_failed=self.queued_failed,
+            phases=dict(self.phases),
+            sessions=sessions,
+            uploads=uploads,
+            webhooks=undelivered,
+        )
+
+
+def _pending_uploads() -> int:
+    from chatot.uploader.service import UploadService
+
+    service = UploadService._instance
+    if not getattr(service, "_initialized", False):
+        return 0
+    return service.queue_depth + service.in_flight
+
+
+def _webhook_sender():
+    from chatot.utils.webhook_sender import WebhookSender
+
+    sender = WebhookSender._instance
+    return sender if getattr(sender, "_initialized", False) else None
@@ -1,106 +1,256 @@
 import os
 
-from flask import Flask, make_response, request, jsonify
-from typing import Dict
+import psutil
+from flask import Flask, Response, make_response, request, jsonify
 
-from .huddle_service import setup_room_manager_thread
-from .types import SessionInfo
+from .admission import ADMISSION_QUEUE, AdmissionController
+from .drain import Drainer
+from .warmup import media_stack_ready
+from chatot.cluster import ClusterNode, FORWARDED_HEADER
 from chatot.log import base_logger
+from chatot.recorder import RecordingOptions
+from chatot.recorder.metrics import live_recorders
+from chatot.settings import get_settings
+from chatot.utils.metrics import MetricsRegistry
+from chatot.utils.sessions import DEFAULT_PRIORITY, SESSION_FAILED, SESSION_QUEUED, SessionRegistry
 
 logger = base_logger.getChild(__name__)
 
 app = Flask(__name__)
 
-# Store active room managers
-active_sessions: Dict[str, SessionInfo] = {}
+# Sessions by id and active sessions by room, shared with the room event loops
+sessions = SessionRegistry()
 
 @app.route("/healthz", methods=['GET'])
 async def hello_world():
-    response = make_response('', 204)
+    # Not ready while draining, so load balancers stop sending rooms here
+    response = make_response('', 503 if Drainer().draining else 204)
     return response
 
+@app.route("/metrics", methods=['GET'])
+async def metrics():
+    return Response(MetricsRegistry().render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+# Kept around so cpu_percent measures the time since the previous call
+process = psutil.Process(os.getpid())
+
+@app.route("/load", methods=['GET'])
+async def load():
+    """
+    Active rooms, tracks and CPU of this process, used by the supervisor for placement,
+    and the admission controller's view of the node.
+    """
+    rooms = sessions.active_rooms()
+    return jsonify({
+        "sessions": len(rooms),
+        "tracks": live_recorders(),
+        "cpu_percent": process.cpu_percent(interval=None),
+        "rooms": rooms,
+        "warm": media_stack_ready(),
+        "admission": AdmissionController().stats()
+    }), 200
+
+@app.route("/taps", methods=['GET'])
+async def list_taps():
+    """
+    Live PCM taps of this process, optionally only those of `room_id`.
+    Readers on this host attach to them by name with `PcmTapReader`.
+    """
+    from chatot.recorder.tap import taps
+
+    room_id = request.args.get('room_id')
+    open_taps = [tap for tap in taps() if not room_id or tap["room_id"] == room_id]
+    return jsonify({"node_id": ClusterNode().node_id, "pid": os.getpid(), "taps": open_taps}), 200
+
 @app.route("/start", methods=['GET'])
 async def start_recording():
+    """
+    Queue joining a room and return its session id right away.
+    Progress is reported by `/status`.
+
+    In a cluster the room goes to the node that already records it, or else to the
+    least loaded node, and is only started once this node holds the room's lease.
+
+    A room that would overload the node is refused with `503` and `Retry-After`, or
+    queued (state "queued") when `ADMISSION_MODE=queue`. `priority` (default 1) orders
+    the queue; rooms below `ADMISSION_SHED_BELOW_PRIORITY` may be stopped under load.
+    `expected_tracks` overrides the number of tracks the room is assumed to bring.
+    """
     room_id = request.args.get('room_id')
     if not room_id:
         return jsonify({"error": "Missing room_id parameter"}), 400
 
-    if room_id in active_sessions:
-        logger.info(f"Room {room_id} already exists. Stopping it first.")
-        session = active_sessions[room_id]
-        try:
-            session['stop_callback']()
-            # Wait for the thread to complete
-            session['thread'].join(timeout=5.0)
-        except Exception as e:
-            logger.error(f"Error cleaning up existing session: {e}")
-        finally:
-            del active_sessions[room_id]
+    try:
+        recording_options = RecordingOptions.from_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
+    try:
+        priority = int(request.args.get('priority') or DEFAULT_PRIORITY)
+        expected_tracks = int(request.args.get('expected_tracks') or 0) or None
+    except ValueError:
+        return jsonify({"error": "priority and expected_tracks must be integers"}), 400
 
-    api_key = os.getenv("HUDDLE01_API_KEY")
-    project_id = os.getenv("HUDDLE01_PROJECT_ID")
+    settings = get_settings()
+    api_key = settings.huddle01_api_key
+    project_id = settings.huddle01_project_id
 
     if not api_key or not project_id:
         logger.error(
-            "Missing required environment variables. Please set HUDDLE01_API_KEY, HUDDLE01_PROJECT_ID and ROOM_ID"
+            f"Missing required environment variables. Please set {', '.join(settings.missing())}"
         )
         return jsonify({"error": "Invalid env setup"}), 500
 
-    # Log current number of active sessions
-    logger.info(f"Active sessions before adding new one: {len(active_sessions)}")
+    # Waits for the warm-up when it is still importing the media stack
+    from .huddle_service import start_session, stop_session
+
+    drainer = Drainer()
+    cluster = ClusterNode()
+    # A room this node records is restarted here, whatever the other nodes' load
+    if not request.headers.get(FORWARDED_HEADER) and not cluster.owns(room_id):
+        # A draining node takes no rooms, but may still hand them to another node
+        target = cluster.remote_owner(room_id=room_id) or cluster.place()
+        if target is None and not drainer.draining:
+            return jsonify({"status": "error", "message": "No node has capacity for another room"}), 503, {"Retry-After": str(int(cluster.interval))}
+        if target is not None and target.node_id != cluster.node_id:
+            return cluster.forward(target, "/start")
 
-    # Setup room manager thread and get results
-    result_container = setup_room_manager_thread(room_id, project_id, api_key)
+    if drainer.draining:
+        return jsonify({"status": "draining", "message": "Node is draining before it exits"}), 503, {"Retry-After": "1"}
 
-    status_code = result_container.get('status_code', 500)
-    message = result_container.get('message', "Unknown error or operation timed out")
+    admission = AdmissionController()
+    decision = admission.decide(room_id, expected_tracks)
+    if not decision.admitted and admission.mode != ADMISSION_QUEUE:
+        logger.warning(f"Refusing room {room_id}: {decision.reason}")
+        return jsonify({"status": "overloaded", "message": decision.reason}), 503, {"Retry-After": str(decision.retry_after)}
+
+    existing = sessions.active(room_id)
+    if existing:
+        logger.info(f"Room {room_id} already has session {existing.session_id}. Stopping it first.")
+        try:
+            stop_session(existing)
+        except Exception as e:
+            logger.error(f"Error cleaning up existing session: {e}")
 
-    if status_code == 200:
-        active_sessions[room_id] = {
-            'thread': result_container['manager_thread'],
-            'stop_callback': result_container['stop_callback'],
-            'manager': result_container['manager'],
-            'loop': result_container['loop']
-        }
+    session = sessions.create(room_id, recording_options, priority)
+    if not decision.admitted:
+        session.set_state(SESSION_QUEUED)
+    lease = cluster.claim(room_id, session.session_id)
+    if lease.node_id != cluster.node_id:
+        session.set_state(SESSION_FAILED, error=f"Room is recorded by node {lease.node_id}")
+        return jsonify({
+            "status": "conflict",
+            "message": f"Room {room_id} is recorded by node {lease.node_id}",
+            "node_id": lease.node_id,
+            "session_id": lease.session_id
+        }), 409
 
+    if not decision.admitted:
+        if not admission.enqueue(session, lambda: start_session(session, project_id, api_key), expected_tracks):
+            session.set_state(SESSION_FAILED, error="Admission queue is full")
+            return jsonify({
+                "status": "overloaded",
+                "session_id": session.session_id,
+                "message": "Admission queue is full"
+            }), 503, {"Retry-After": str(decision.retry_after)}
+        logger.info(f"Queued room {room_id}: {decision.reason}")
         return jsonify({
-            "status": "success",
-            "message": message
-        }), 200
-    else:
+            "status": "queued",
+            "session_id": session.session_id,
+            "state": session.state,
+            "message": decision.reason
+        }), 202
+
+    try:
+        start_session(session, project_id, api_key)
+    except Exception as e:
+        logger.error(f"Exception during room setup: {e}")
+        session.set_state(SESSION_FAILED, error=f"Exception during setup: {str(e)}")
         return jsonify({
             "status": "error",
-            "message": message
-        }), status_code
+            "session_id": session.session_id,
+            "message": f"Exception during setup: {str(e)}"
+        }), 500
+
+    return jsonify({
+        "status": "accepted",
+        "session_id": session.session_id,
+        "state": session.state
+    }), 202
 
 @app.route("/stop", methods=['GET'])
 async def stop_room():
+    """
+    Queue leaving a room, by `room_id` or `session_id`, and return right away.
+    """
     room_id = request.args.get('room_id')
-    if not room_id:
+    session_id = request.args.get('session_id')
+    if not room_id and not session_id:
         return jsonify({"error": "Missing room_id parameter"}), 400
 
-    if room_id not in active_sessions:
-        return jsonify({"status": "not_found", "message": f"No active session for room {room_id}"}), 404
-
-    session = active_sessions[room_id]
+    session = sessions.get(session_id) if session_id else sessions.active(room_id)
+    if session is None and not request.headers.get(FORWARDED_HEADER):
+        owner = ClusterNode().remote_owner(room_id=room_id, session_id=session_id)
+        if owner:
+            return ClusterNode().forward(owner, "/stop")
+    if session is None or session.finished:
+        return jsonify({"status": "not_found", "message": f"No active session for room {room_id or session_id}"}), 404
 
+    from .huddle_service import stop_session
     try:
-        session['stop_callback']()
-        # Wait for the thread to complete
-        session['thread'].join(timeout=5.0)
+        stop_session(session)
     except Exception as e:
-        logger.error(f"Error stopping room {room_id}: {e}")
+        logger.error(f"Error stopping room {session.room_id}: {e}")
         return jsonify({
             "status": "error",
+            "session_id": session.session_id,
             "message": f"Error stopping room: {str(e)}"
         }), 500
-    finally:
-        # Always remove from active sessions, even if there was an error
-        del active_sessions[room_id]
-        logger.info(f"Room {room_id} removed from active sessions. Active count: {len(active_sessions)}")
 
     return jsonify({
-        "status": "success",
-        "message": f"Room {room_id} stopped successfully"
-    }), 200
+        "status": "accepted",
+        "session_id": session.session_id,
+        "state": session.state
+    }), 202
+
+@app.route("/drain", methods=['GET', 'POST'])
+async def drain():
+    """
+    `POST` starts draining the node like SIGTERM does: stop taking rooms, leave every
+    room, finish the uploads and webhooks within `DRAIN_DEADLINE` seconds, then exit.
+    `GET` reports the progress of the drain, or its outcome.
+    """
+    drainer = Drainer()
+    if request.method == 'POST':
+        from chatot.utils.shutdown import stop_serving
+        started = drainer.start("api", on_done=lambda report: stop_serving())
+        return jsonify({"status": "draining" if started else "already_draining", **drainer.report()}), 202
+
+    report = drainer.report()
+    if report is None:
+        return jsonify({"status": "serving"}), 200
+    return jsonify({"status": "drained" if drainer.done else "draining", **report}), 200
+
+@app.route("/status", methods=['GET'])
+async def status():
+    """
+    State and tracks of one session (`session_id` or `room_id`), or of every known session.
+    """
+    room_id = request.args.get('room_id')
+    session_id = request.args.get('session_id')
+
+    if room_id or session_id:
+        session = sessions.get(session_id) if session_id else sessions.active(room_id)
+        if session is None and not request.headers.get(FORWARDED_HEADER):
+            owner = ClusterNode().remote_owner(room_id=room_id, session_id=session_id)
+            if owner:
+                return ClusterNode().forward(owner, "/status")
+        if session is None:
+            return jsonify({"status": "not_found", "message": f"No session for {room_id or session_id}"}), 404
+        return jsonify(session.to_dict()), 200
+
+    all_sessions = [session.to_dict() for session in sessions.sessions()]
+    counts = {}
+    for session in all_sessions:
+        counts[session["state"]] = counts.get(session["state"], 0) + 1
+    return jsonify({"node_id": ClusterNode().node_id, "counts": counts, "sessions": all_sessions}), 200
@@ -1,13 +1,29 @@
 import asyncio
-import threading
+import os
+from typing import Callable
+
 from chatot.huddle import Huddle01Manager
-import gc
+from chatot.utils.loop_pool import LoopPool
+from chatot.utils.sessions import Session, SESSION_DONE, SESSION_FAILED, SESSION_LEAVING, SESSION_QUEUED, SESSION_RECORDING
 
 # Configure logging
 from chatot.log import base_logger
 logger = base_logger.getChild(__name__)
 
-async def join_huddle_room(project_id, api_key, room_id, loop):
+# Builds the manager of every room joined, see `set_manager_factory`
+_manager_factory: Callable[..., Huddle01Manager] = Huddle01Manager
+
+
+def set_manager_factory(factory: Callable[..., Huddle01Manager] | None):
+    """
+    Replace the class used to join rooms, e.g. with a local fake room for load tests.
+    It is called with the arguments of `Huddle01Manager`; None restores the real one.
+    """
+    global _manager_factory
+    _manager_factory = factory or Huddle01Manager
+
+
+async def join_huddle_room(project_id, api_key, room_id, loop, recording_options=None, session=None):
     """
     Join a Huddle01 room and return the manager and success status.
 
@@ -15,7 +31,13 @@ async def join_huddle_room(project_id, api_key, room_id, loop):
         tuple: (huddle_manager, success_flag, error_message)
     """
     try:
-        huddle_manager = Huddle01Manager(project_id=project_id, api_key=api_key, loop=loop)
+        huddle_manager = _manager_factory(
+            project_id=project_id,
+            api_key=api_key,
+            loop=loop,
+            recording_options=recording_options,
+            session=session
+        )
         try:
             result = await huddle_manager.join_room(room_id=room_id)
         except Exception as e:
@@ -38,110 +60,97 @@ async def join_huddle_room(project_id, api_key, room_id, loop):
         return None, False, str(e)
 
 
-def setup_room_manager_thread(room_id, project_id, api_key):
-    """
-    Sets up a thread to manage a Huddle01 room session with improved resource management.
+def start_session(session: Session, project_id, api_key):
     """
-    result_container = {}
-
-    def run_room_manager(room_id, result_dict):
-        threading.current_thread().name = f"huddle-{room_id[:8]}"
-
-        loop = asyncio.new_event_loop()
-
-        def custom_exception_handler(loop, context):
-            exception = context.get('exception')
-            message = context.get('message')
-            logger.error(f"Unhandled exception in event loop for room {room_id}: {message}")
-            if exception:
-                logger.exception("Exception details:", exc_info=exception)
-
-        loop.set_exception_handler(custom_exception_handler)
-        asyncio.set_event_loop(loop)
-
-        huddle_manager = None
-        join_result = None
-
-        try:
-            join_result = loop.run_until_complete(join_huddle_room(project_id, api_key, room_id, loop))
-            huddle_manager, success, message = join_result
+    Places a room session on the shared loop pool and starts joining, without waiting for it.
 
-            if not success:
-                result_dict['status_code'] = 500
-                result_dict['message'] = message
-                return
-        except Exception as e:
-            logger.error(f"Exception during room setup: {e}")
-            result_dict['status_code'] = 500
-            result_dict['message'] = f"Exception during setup: {str(e)}"
-            loop.close()
+    The session runs on the least-loaded event loop of the pool. Its state moves to
+    "recording" once joined, or "failed" if joining fails or takes longer than
+    `ROOM_JOIN_TIMEOUT` seconds; a join that completes after that is left right away.
+    """
+    pool = LoopPool()
+    worker = pool.acquire()
+    session.worker = worker
+    released = False
+
+    def release_worker():
+        nonlocal released
+        if not released:
+            released = True
+            pool.release(worker)
+
+    async def leave_room_async():
+        # Only the first call (stop, room closed or late join) gets the manager
+        manager, session.manager = session.manager, None
+        if manager is None:
             return
-
-        logger.info("Room start successful")
-        result_dict['status_code'] = 200
-        result_dict['message'] = message
-        result_dict['manager_thread'] = threading.current_thread()
-        result_dict['loop'] = loop
-        result_dict['manager'] = huddle_manager
-
-        async def leave_room_async():
-            try:
-                if huddle_manager:
-                    logger.info(f"Leaving room {room_id}...")
-                    await huddle_manager.leave_room()
-                    logger.info(f"Room {room_id} left successfully")
-                    result_dict['leave_status'] = 200
-                    result_dict['leave_message'] = "Room left successfully"
-            except Exception as e:
-                logger.error(f"Error leaving room: {e}")
-                result_dict['leave_status'] = 500
-                result_dict['leave_message'] = str(e)
-            finally:
-                gc.collect()
-                loop.stop()
-
-        def stop_callback():
-            try:
-                future = asyncio.run_coroutine_threadsafe(leave_room_async(), loop)
-                # Add a timeout to avoid hanging
-                future.result(timeout=10.0)
-            except Exception as e:
-                logger.error(f"Error in stop callback: {e}")
-                # If the callback fails, try to forcibly close the loop
-                try:
-                    loop.stop()
-                except:
-                    pass
-
-        if huddle_manager:
-            huddle_manager.once("completed", leave_room_async)
-
-        result_dict['stop_callback'] = stop_callback
-
+        session.set_state(SESSION_LEAVING)
+        span = session.trace.start_span("room.leave")
         try:
-            loop.run_forever()
+            logger.info(f"Leaving room {session.room_id}...")
+            await manager.leave_room()
+            logger.info(f"Room {session.room_id} left successfully")
+            session.left()
         except Exception as e:
-            logger.error(f"Error in event loop for room {room_id}: {e}")
+            logger.error(f"Error leaving room: {e}")
+            session.set_state(SESSION_FAILED, error=f"Error leaving room: {e}")
         finally:
-            try:
-                pending = asyncio.all_tasks(loop)
-                for task in pending:
-                    task.cancel()
+            span.finish()
+            release_worker()
+
+    async def join():
+        join_task = asyncio.ensure_future(join_huddle_room(
+            project_id, api_key, session.room_id, worker.loop, session.recording_options, session
+        ))
+        done, _ = await asyncio.wait({join_task}, timeout=float(os.getenv("ROOM_JOIN_TIMEOUT") or 30))
+        if not done:
+            logger.error(f"Timed out joining room {session.room_id}, leaving once the join settles")
+            session.stop_requested = True
+            session.set_state(SESSION_FAILED, error="Timed out joining room")
+        return await join_task
+
+    def on_joined(future):
+        try:
+            huddle_manager, success, message = future.result()
+        except Exception as e:
+            huddle_manager, success, message = None, False, f"Exception during setup: {e}"
+
+        if not success:
+            logger.error(f"Room start failed for {session.room_id}: {message}")
+            session.set_state(SESSION_FAILED, error=message)
+            release_worker()
+            return
 
-                if pending:
-                    loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        logger.info(f"Room start successful on {worker.name}")
+        session.manager = huddle_manager
+        session.stop_callback = lambda: worker.submit(leave_room_async())
+        huddle_manager.once("completed", leave_room_async)
 
-                loop.close()
-            except Exception as close_err:
-                logger.error(f"Error closing event loop: {close_err}")
-            finally:
-                logger.info(f"Event loop for room {room_id} closed")
-                gc.collect()
+        if session.stop_requested:
+            session.stop_callback()
+        else:
+            session.set_state(SESSION_RECORDING)
 
-    thread = threading.Thread(target=run_room_manager, args=(room_id, result_container))
-    thread.daemon = True
-    thread.start()
+    worker.submit(join()).add_done_callback(on_joined)
 
-    thread.join(timeout=5.0)
 
-    return result_container
+def stop_session(session: Session, reason: str | None = None):
+    """
+    Ask a session to leave its room without waiting for it.
+    A session that is still joining leaves as soon as the join completes,
+    one still waiting for admission is simply never started.
+
+    Args:
+        session: The session to stop
+        reason: Why chatot stops it on its own, reported by `/status`
+    """
+    session.stop_requested = True
+    session.trace.mark("stop.requested", reason=reason or "stop")
+    if reason:
+        session.stop_reason = reason
+    if session.state == SESSION_QUEUED:
+        session.set_state(SESSION_DONE)
+    elif session.stop_callback:
+        session.stop_callback()
+    else:
+        session.set_state(SESSION_LEAVING)
@@ -0,0 +1,62 @@
+"""
+Background import of the media stack.
+
+The API answers `/healthz` as soon as waitress listens. Huddle01, aiortc, PyAV,
+numpy and boto3 are imported afterwards by `warm_up` on a daemon thread, so a
+restarted node rejoins its load balancer within a fraction of a second. A request
+that needs them before the warm-up is done simply waits for the import in progress.
+"""
+
+import gc
+import threading
+import time
+
+from chatot.log import base_logger
+from chatot.settings import get_settings
+from chatot.utils.metrics import Gauge
+
+logger = base_logger.getChild(__name__)
+
+WARMUP_SECONDS = Gauge(
+    "chatot_warmup_seconds",
+    "Time the media stack took to import after the API started.",
+)
+
+_ready = threading.Event()
+
+
+def media_stack_ready() -> bool:
+    """Whether `warm_up` finished, successfully or not."""
+    return _ready.is_set()
+
+
+def _warm_up():
+    started = time.perf_counter()
+    try:
+        from . import huddle_service  # noqa: F401  huddle01 and aiortc
+        from chatot.huddle.activity import log_pause_support
+        from chatot.recorder import audio_recorder, opus_passthrough, tap  # noqa: F401  PyAV and numpy
+        from chatot.uploader.main import get_s3_client
+
+        if get_settings().storage_configured:
+            get_s3_client()
+        log_pause_support()
+        if gc.get_freeze_count():
+            # Keep the modules out of the collector's reach, like `tune_gc` did for startup
+            gc.freeze()
+    except Exception as e:
+        logger.error(
+            f"Error warming up the media stack, it is imported on first use instead: {e}"
+        )
+    finally:
+        elapsed = time.perf_counter() - started
+        WARMUP_SECONDS.set(elapsed)
+        _ready.set()
+    logger.info(f"Media stack ready in {elapsed:.2f}s")
+
+
+def warm_up() -> threading.Thread:
+    """Start importing the media stack in the background."""
+    thread = threading.Thread(target=_warm_up, name="chatot-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,22 @@
+from .node import ClusterNode, FORWARDED_HEADER
+from .store import (
+    MemorySessionStore,
+    NodeInfo,
+    RedisSessionStore,
+    RoomLease,
+    SessionStore,
+    SQLiteSessionStore,
+    create_store,
+)
+
+__all__ = [
+    "ClusterNode",
+    "FORWARDED_HEADER",
+    "MemorySessionStore",
+    "NodeInfo",
+    "RedisSessionStore",
+    "RoomLease",
+    "SessionStore",
+    "SQLiteSessionStore",
+    "create_store",
+]
@@ -0,0 +1,222 @@
+import os
+import socket
+import threading
+import time
+from typing import Set
+
+import requests
+from flask import Response, request
+from requests.adapters import HTTPAdapter
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Gauge, MetricsRegistry
+from chatot.utils.sessions import SessionRegistry
+
+from .store import MemorySessionStore, NodeInfo, RoomLease, SessionStore, create_store
+
+logger = base_logger.getChild(__name__)
+
+# Set on requests forwarded between nodes so they are handled, never forwarded again
+FORWARDED_HEADER = "X-Chatot-Forwarded"
+
+# Headers that describe the other node's connection, not the response
+HOP_HEADERS = {
+    "connection",
+    "content-encoding",
+    "content-length",
+    "keep-alive",
+    "transfer-encoding",
+}
+
+
+class ClusterNode:
+    """
+    This process as a member of a chatot cluster.
+
+    Implemented as a singleton. Every `CLUSTER_HEARTBEAT_INTERVAL` seconds the node
+    publishes its URL, capacity and load to the session store, renews the leases of
+    the rooms it records and releases the ones that ended. Leases live
+    `CLUSTER_LEASE_TTL` seconds, so the rooms of a node that died can be started
+    elsewhere shortly after. A draining node (see `chatot.api.drain`) publishes a
+    negative capacity so no room is placed on it.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(ClusterNode, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(
+        self,
+        store: SessionStore | None = None,
+        node_id: str | None = None,
+        url: str | None = None,
+        capacity: int | None = None,
+    ):
+        if getattr(self, "_initialized", False):
+            return
+
+        hostname = socket.gethostname()
+        self.store = store or create_store()
+        self.node_id = (
+            node_id or os.getenv("CLUSTER_NODE_ID") or f"{hostname}-{os.getpid()}"
+        )
+        self.url = (
+            url
+            or os.getenv("CLUSTER_NODE_URL")
+            or f"http://{hostname}:{os.getenv('PORT') or 5000}"
+        ).rstrip("/")
+        self.capacity = (
+            capacity
+            if capacity is not None
+            else int(os.getenv("CLUSTER_CAPACITY") or 0)
+        )
+        self.interval = float(os.getenv("CLUSTER_HEARTBEAT_INTERVAL") or 5)
+        self.lease_ttl = float(os.getenv("CLUSTER_LEASE_TTL") or self.interval * 3)
+        self.draining = False
+        self.sessions = SessionRegistry()
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=16)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._held: Set[str] = set()
+        self._thread = threading.Thread(
+            target=self._run, name="chatot-cluster-heartbeat", daemon=True
+        )
+
+        self.beat()
+        self._thread.start()
+        MetricsRegistry().add_collector(self.collect)
+
+        self._initialized = True
+        logger.info(
+            f"Cluster node {self.node_id} ({self.url}) started with {type(self.store).__name__}"
+        )
+
+    @property
+    def clustered(self) -> bool:
+        """Whether other nodes can exist, i.e. the store is shared."""
+        return not isinstance(self.store, MemorySessionStore)
+
+    def info(self) -> NodeInfo:
+        return NodeInfo(
+            node_id=self.node_id,
+            url=self.url,
+            capacity=-1 if self.draining else self.capacity,
+            load=len(self.sessions.active_rooms()),
+            heartbeat_at=time.time(),
+        )
+
+    def beat(self):
+        """Publish this node and renew or release its room leases."""
+        active = set(self.sessions.active_rooms())
+        with self._lock:
+            ended = self._held - active
+            self._held &= active
+            held = set(self._held)
+
+        self.store.heartbeat(self.info(), self.interval * 3)
+        self.store.renew(self.node_id, held, self.lease_ttl)
+        for room_id in ended:
+            self.store.release(room_id, self.node_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.beat()
+            except Exception as e:
+                logger.error(f"Cluster heartbeat failed: {e}")
+
+    def place(self) -> NodeInfo | None:
+        """
+        The node that should record a new room: the least loaded relative to its
+        capacity, preferring this one on a tie. None when every node is full.
+        """
+        nodes = {node.node_id: node for node in self.store.nodes()}
+        nodes[self.node_id] = self.info()
+
+        candidates = [node for node in nodes.values() if node.free > 0]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda node: (
+                node.load / node.capacity if node.capacity else 0.0,
+                node.load,
+                node.node_id != self.node_id,
+            ),
+        )
+
+    def claim(self, room_id: str, session_id: str) -> RoomLease:
+        """Take the room's lease for this node, returning the lease in force."""
+        lease = self.store.claim(room_id, self.node_id, session_id, self.lease_ttl)
+        if lease.node_id == self.node_id:
+            with self._lock:
+                self._held.add(room_id)
+        return lease
+
+    def owns(self, room_id: str) -> bool:
+        """Whether this node records the room or holds its lease."""
+        if self.sessions.active(room_id):
+            return True
+        lease = self.store.owner(room_id)
+        return lease is not None and lease.node_id == self.node_id
+
+    def remote_owner(
+        self, room_id: str | None = None, session_id: str | None = None
+    ) -> NodeInfo | None:
+        """
+        The other live node that owns a room or started a session, if any.
+        """
+        if not self.clustered:
+            return None
+
+        if session_id:
+            node_id = self.store.session_node(session_id)
+        else:
+            lease = self.store.owner(room_id)
+            node_id = lease.node_id if lease else None
+
+        if node_id is None or node_id == self.node_id:
+            return None
+        return next(
+            (node for node in self.store.nodes() if node.node_id == node_id), None
+        )
+
+    def forward(self, node: NodeInfo, path: str) -> Response:
+        """Send the current Flask request to another node and relay its answer."""
+        response = self.http.get(
+            f"{node.url}{path}",
+            params=request.args,
+            headers={FORWARDED_HEADER: self.node_id},
+            timeout=30,
+        )
+        headers = [
+            (name, value)
+            for name, value in response.headers.items()
+            if name.lower() not in HOP_HEADERS
+        ]
+        headers.append(("X-Chatot-Node", node.node_id))
+        return Response(response.content, status=response.status_code, headers=headers)
+
+    def collect(self) -> list:
+        """Live nodes and leases held, for `/metrics`."""
+        nodes = Gauge(
+            "chatot_cluster_nodes", "Live nodes in the session store.", register=False
+        )
+        nodes.set(len(self.store.nodes()))
+        leases = Gauge(
+            "chatot_cluster_room_leases",
+            "Room leases held by this node.",
+            register=False,
+        )
+        with self._lock:
+            leases.set(len(self._held))
+        return [nodes, leases]
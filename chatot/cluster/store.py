@@ -0,0 +1,414 @@
+"""
+Session stores shared by chatot nodes.
+
+A store keeps two kinds of records, both with expiry:
+    nodes:  each node's URL, capacity and load, refreshed by its heartbeat.
+    rooms:  which node (and session) records a room. A node has to hold the room's
+            lease to record it and renews it with every heartbeat, so a room can
+            never be recorded twice and is free again shortly after its node dies.
+
+Backends are picked by URL, see `create_store`:
+    memory://              in-process, a single node (default)
+    sqlite:///path/to.db   a file shared by nodes on one host or a shared volume
+    redis://host:6379/0    any Redis compatible server (needs the `redis` package)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterable, List, Tuple
+
+
+@dataclass(frozen=True)
+class NodeInfo:
+    """
+    A chatot node as published by its heartbeat.
+
+    Attributes:
+        node_id: Unique id of the node.
+        url: Base URL other nodes forward requests to.
+        capacity: Rooms the node accepts, 0 for no limit, negative while it drains.
+        load: Rooms the node is recording.
+        heartbeat_at: When the node last reported (timestamp).
+    """
+
+    node_id: str
+    url: str
+    capacity: int = 0
+    load: int = 0
+    heartbeat_at: float = 0.0
+
+    @property
+    def free(self) -> float:
+        return float("inf") if not self.capacity else self.capacity - self.load
+
+
+@dataclass(frozen=True)
+class RoomLease:
+    """
+    Which node records a room, until `expires_at` unless renewed.
+    """
+
+    room_id: str
+    node_id: str
+    session_id: str | None
+    expires_at: float
+
+
+class SessionStore(ABC):
+    """
+    Interface of a session store. Every method may be called from any thread.
+    """
+
+    @abstractmethod
+    def heartbeat(self, node: NodeInfo, ttl: float):
+        """Publish a node, live for `ttl` seconds."""
+
+    @abstractmethod
+    def nodes(self) -> List[NodeInfo]:
+        """Nodes whose heartbeat has not expired."""
+
+    @abstractmethod
+    def claim(
+        self, room_id: str, node_id: str, session_id: str | None, ttl: float
+    ) -> RoomLease:
+        """
+        Take the lease of a room unless another node holds it.
+
+        Returns:
+            RoomLease: The lease now in force, held by `node_id` if the claim succeeded
+        """
+
+    @abstractmethod
+    def renew(self, node_id: str, room_ids: Iterable[str], ttl: float):
+        """Extend the leases `node_id` holds on `room_ids`."""
+
+    @abstractmethod
+    def release(self, room_id: str, node_id: str):
+        """Drop the lease of a room if `node_id` holds it."""
+
+    @abstractmethod
+    def owner(self, room_id: str) -> RoomLease | None:
+        """The live lease of a room, if any."""
+
+    @abstractmethod
+    def session_node(self, session_id: str) -> str | None:
+        """The node a session was started on."""
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps everything in this process; only useful for a single node."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nodes: Dict[str, Tuple[NodeInfo, float]] = {}
+        self._rooms: Dict[str, RoomLease] = {}
+        self._sessions: Dict[str, str] = {}
+
+    def heartbeat(self, node: NodeInfo, ttl: float):
+        with self._lock:
+            self._nodes[node.node_id] = (node, time.time() + ttl)
+
+    def nodes(self) -> List[NodeInfo]:
+        now = time.time()
+        with self._lock:
+            return [
+                node for node, expires_at in self._nodes.values() if expires_at > now
+            ]
+
+    def claim(self, room_id, node_id, session_id, ttl) -> RoomLease:
+        now = time.time()
+        with self._lock:
+            lease = self._rooms.get(room_id)
+            if lease is None or lease.expires_at <= now or lease.node_id == node_id:
+                lease = RoomLease(room_id, node_id, session_id, now + ttl)
+                self._rooms[room_id] = lease
+                if session_id:
+                    self._sessions[session_id] = node_id
+            return lease
+
+    def renew(self, node_id, room_ids, ttl):
+        expires_at = time.time() + ttl
+        with self._lock:
+            for room_id in room_ids:
+                lease = self._rooms.get(room_id)
+                if lease and lease.node_id == node_id:
+                    self._rooms[room_id] = RoomLease(
+                        room_id, node_id, lease.session_id, expires_at
+                    )
+
+    def release(self, room_id, node_id):
+        with self._lock:
+            lease = self._rooms.get(room_id)
+            if lease and lease.node_id == node_id:
+                del self._rooms[room_id]
+
+    def owner(self, room_id) -> RoomLease | None:
+        with self._lock:
+            lease = self._rooms.get(room_id)
+        return lease if lease and lease.expires_at > time.time() else None
+
+    def session_node(self, session_id) -> str | None:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Keeps the records in a SQLite file, so nodes sharing the file see each other.
+    Claims run in an immediate transaction, which makes them atomic across processes.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS nodes (
+                    node_id TEXT PRIMARY KEY,
+                    info TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS rooms (
+                    room_id TEXT PRIMARY KEY,
+                    node_id TEXT NOT NULL,
+                    session_id TEXT,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    node_id TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call keeps the store usable from any thread
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def heartbeat(self, node, ttl):
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO nodes (node_id, info, expires_at) VALUES (?, ?, ?)",
+                (node.node_id, json.dumps(asdict(node)), time.time() + ttl),
+            )
+
+    def nodes(self) -> List[NodeInfo]:
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT info FROM nodes WHERE expires_at > ?", (time.time(),)
+            ).fetchall()
+        return [NodeInfo(**json.loads(info)) for (info,) in rows]
+
+    def claim(self, room_id, node_id, session_id, ttl) -> RoomLease:
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT node_id, session_id, expires_at FROM rooms WHERE room_id = ?",
+                (room_id,),
+            ).fetchone()
+            if row and row[2] > now and row[0] != node_id:
+                connection.execute("COMMIT")
+                return RoomLease(room_id, row[0], row[1], row[2])
+
+            connection.execute(
+                "INSERT OR REPLACE INTO rooms (room_id, node_id, session_id, expires_at) VALUES (?, ?, ?, ?)",
+                (room_id, node_id, session_id, now + ttl),
+            )
+            if session_id:
+                connection.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, node_id, created_at) VALUES (?, ?, ?)",
+                    (session_id, node_id, now),
+                )
+            connection.execute("COMMIT")
+            return RoomLease(room_id, node_id, session_id, now + ttl)
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def renew(self, node_id, room_ids, ttl):
+        room_ids = list(room_ids)
+        if not room_ids:
+            return
+        expires_at = time.time() + ttl
+        with self._connect() as connection:
+            connection.executemany(
+                "UPDATE rooms SET expires_at = ? WHERE room_id = ? AND node_id = ?",
+                [(expires_at, room_id, node_id) for room_id in room_ids],
+            )
+
+    def release(self, room_id, node_id):
+        with self._connect() as connection:
+            connection.execute(
+                "DELETE FROM rooms WHERE room_id = ? AND node_id = ?",
+                (room_id, node_id),
+            )
+
+    def owner(self, room_id) -> RoomLease | None:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT node_id, session_id, expires_at FROM rooms WHERE room_id = ? AND expires_at > ?",
+                (room_id, time.time()),
+            ).fetchone()
+        return RoomLease(room_id, *row) if row else None
+
+    def session_node(self, session_id) -> str | None:
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT node_id FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+
+# KEYS[1] room key; ARGV node id, lease value, ttl in ms
+REDIS_CLAIM = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['node_id'] ~= ARGV[1] then
+    return current
+end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return ARGV[2]
+"""
+
+# KEYS room keys; ARGV node id, ttl in ms
+REDIS_RENEW = """
+for _, key in ipairs(KEYS) do
+    local current = redis.call('GET', key)
+    if current and cjson.decode(current)['node_id'] == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+    end
+end
+return 0
+"""
+
+# KEYS[1] room key; ARGV node id
+REDIS_RELEASE = """
+local current = redis.call('GET', KEYS[1])
+if current and cjson.decode(current)['node_id'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Keeps the records in a Redis compatible server. Leases are keys with a TTL and
+    are only changed by Lua scripts, so claims and renewals are atomic.
+    """
+
+    def __init__(self, url: str, prefix: str = "chatot"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "The redis session store needs the redis package, install it with `pip install redis`"
+            )
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.session_ttl = int(os.getenv("CLUSTER_SESSION_TTL") or 86400)
+        self._claim = self.client.register_script(REDIS_CLAIM)
+        self._renew = self.client.register_script(REDIS_RENEW)
+        self._release = self.client.register_script(REDIS_RELEASE)
+
+    def _key(self, kind: str, name: str) -> str:
+        return f"{self.prefix}:{kind}:{name}"
+
+    def heartbeat(self, node, ttl):
+        pipeline = self.client.pipeline()
+        pipeline.set(
+            self._key("node", node.node_id),
+            json.dumps(asdict(node)),
+            px=int(ttl * 1000),
+        )
+        pipeline.sadd(f"{self.prefix}:nodes", node.node_id)
+        pipeline.execute()
+
+    def nodes(self) -> List[NodeInfo]:
+        node_ids = sorted(self.client.smembers(f"{self.prefix}:nodes"))
+        if not node_ids:
+            return []
+        values = self.client.mget([self._key("node", node_id) for node_id in node_ids])
+        expired = [node_id for node_id, value in zip(node_ids, values) if value is None]
+        if expired:
+            self.client.srem(f"{self.prefix}:nodes", *expired)
+        return [NodeInfo(**json.loads(value)) for value in values if value is not None]
+
+    def claim(self, room_id, node_id, session_id, ttl) -> RoomLease:
+        expires_at = time.time() + ttl
+        value = json.dumps(
+            {"node_id": node_id, "session_id": session_id, "expires_at": expires_at}
+        )
+        current = json.loads(
+            self._claim(
+                keys=[self._key("room", room_id)],
+                args=[node_id, value, int(ttl * 1000)],
+            )
+        )
+        if current["node_id"] == node_id and session_id:
+            self.client.set(
+                self._key("session", session_id), node_id, ex=self.session_ttl
+            )
+        return RoomLease(
+            room_id, current["node_id"], current["session_id"], current["expires_at"]
+        )
+
+    def renew(self, node_id, room_ids, ttl):
+        keys = [self._key("room", room_id) for room_id in room_ids]
+        if keys:
+            self._renew(keys=keys, args=[node_id, int(ttl * 1000)])
+
+    def release(self, room_id, node_id):
+        self._release(keys=[self._key("room", room_id)], args=[node_id])
+
+    def owner(self, room_id) -> RoomLease | None:
+        pipeline = self.client.pipeline()
+        pipeline.get(self._key("room", room_id))
+        pipeline.pttl(self._key("room", room_id))
+        value, ttl = pipeline.execute()
+        if value is None:
+            return None
+        lease = json.loads(value)
+        return RoomLease(
+            room_id,
+            lease["node_id"],
+            lease["session_id"],
+            time.time() + max(0, ttl) / 1000,
+        )
+
+    def session_node(self, session_id) -> str | None:
+        return self.client.get(self._key("session", session_id))
+
+
+def create_store(url: str | None = None) -> SessionStore:
+    """
+    Build the store for `url` (CLUSTER_STORE if None, memory:// by default).
+
+    Raises:
+        ValueError: If the URL scheme is not supported
+    """
+    if url is None:
+        url = os.getenv("CLUSTER_STORE") or "memory://"
+
+    if url.startswith("memory://"):
+        return MemorySessionStore()
+    if url.startswith("sqlite://"):
+        # sqlite:///relative/path.db or sqlite:////absolute/path.db
+        return SQLiteSessionStore(url[len("sqlite:///") :])
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionStore(url)
+    raise ValueError(f"Unsupported session store: {url}")
@@ -0,0 +1,447 @@
+"""
+Pausing the consumers of peers that are not talking.
+
+Every audio producer of a room is consumed, decoded and recorded for the whole
+meeting, even when its peer is muted or only listening. With a pause policy
+(`pause=` on `/start`, or `CONSUMER_PAUSE`), `ConsumerActivity` pauses the
+consumers of such peers:
+
+    off        consumers are never paused (default)
+    muted      paused while the producer is muted, resumed as soon as it is unmuted
+    inactive   also paused once the received audio has been silent for
+               `CONSUMER_PAUSE_AFTER` seconds (30 by default), and resumed when the
+               peer unmutes or is reported speaking. A paused peer is also resumed
+               for `CONSUMER_PROBE_SECONDS` (1) every `CONSUMER_PROBE_INTERVAL`
+               seconds (10) in case it started talking without a signal; speech
+               during the probe keeps it resumed.
+
+How much a pause saves depends on the huddle01 SDK, see `log_pause_support`:
+consumers are paused on the SFU (`LocalPeer.pause_consumer`) when it can, so their
+packets stop and nothing is decoded for them. Otherwise the mediasoup consumer is
+paused and the recorder drops its frames, which only saves encoding them. Peers are
+known to be muted from `RoomEvents.RemoteProducerPaused`, and the producers they add
+while muted are not consumed until they unmute. Without those events "muted"
+pauses nothing and "inactive" goes by the received audio alone.
+
+Speech that starts while a peer is paused and is not signalled is only recorded
+from the next probe, so "inactive" trades up to `CONSUMER_PROBE_INTERVAL` seconds
+of it for the savings. Activity is measured on decoded audio, so "opus"
+(passthrough) tracks only follow the mute state.
+
+The time a consumer is paused is a gap in its recording's timeline, filled like
+any other (see `chatot.recorder.timeline`). Consolidated recordings place the
+resumed audio by wall clock, others by its RTP timestamps.
+
+Savings are exported as metrics: seconds paused, bytes the SFU did not send (at
+`CONSUMER_PAUSE_BITRATE`, 48 kbit/s by default: Opus voice and its RTP/UDP/IP
+headers, only counted for pauses on the SFU) and CPU seconds not spent (at the
+process' measured CPU time per active track).
+"""
+
+import asyncio
+import inspect
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, List, Set, Tuple
+
+from chatot.log import base_logger
+from chatot.recorder.metrics import live_recorders
+from chatot.recorder.options import PAUSE_INACTIVE, PAUSE_OFF
+from chatot.recorder.silence import SilenceDetector
+from chatot.utils.metrics import Counter, Gauge
+
+logger = base_logger.getChild(__name__)
+
+TICK_SECONDS = 0.25
+# What the huddle01 SDK needs to pause consumers on the SFU and to report muted producers
+SERVER_PAUSE_METHODS = ("pause_consumer", "resume_consumer")
+PRODUCER_PAUSE_EVENTS = ("RemoteProducerPaused", "RemoteProducerResumed")
+# Weight of the newest sample in the CPU cost estimate
+COST_SMOOTHING = 0.2
+
+PAUSES = Counter(
+    "chatot_consumer_pauses_total",
+    "Consumers paused, by reason: muted or inactive.",
+    ("reason",),
+)
+RESUMES = Counter(
+    "chatot_consumer_resumes_total",
+    "Consumers resumed, by reason: unmuted, speaking or probe.",
+    ("reason",),
+)
+PAUSED = Gauge("chatot_consumers_paused", "Consumers currently paused.")
+PAUSED_SECONDS = Counter(
+    "chatot_consumer_paused_seconds_total", "Time consumers spent paused."
+)
+SAVED_BYTES = Counter(
+    "chatot_consumer_pause_saved_bytes_total",
+    "Estimated bytes the SFU did not send to paused consumers.",
+)
+SAVED_CPU = Counter(
+    "chatot_consumer_pause_saved_cpu_seconds_total",
+    "Estimated CPU time not spent on paused consumers.",
+)
+
+
+class TrackCost:
+    """
+    CPU seconds one active track costs per second, learnt from the process' CPU time.
+    Starts from `ADMISSION_TRACK_CPU` like admission control does.
+    """
+
+    def __init__(self):
+        cpu_count = os.cpu_count() or 1
+        self.cost = float(os.getenv("ADMISSION_TRACK_CPU") or 1.0) / 100 * cpu_count
+        self.paused = 0
+        self._lock = threading.Lock()
+        self._sampled_at = time.monotonic()
+        self._cpu = time.process_time()
+
+    def update(self):
+        """Fold in the CPU time used since the last update, at most once a second."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._sampled_at < 1.0:
+                return
+            cpu = time.process_time()
+            active = live_recorders() - self.paused
+            if active > 0:
+                sample = (cpu - self._cpu) / (now - self._sampled_at) / active
+                self.cost += COST_SMOOTHING * (sample - self.cost)
+            self._sampled_at = now
+            self._cpu = cpu
+
+    def paused_changed(self, change: int):
+        """Paused consumers cost nothing, they are left out of the active tracks."""
+        with self._lock:
+            self.paused += change
+
+
+track_cost = TrackCost()
+
+
+def pause_support() -> Tuple[bool, bool]:
+    """
+    Returns:
+        tuple: (whether the installed huddle01 SDK pauses consumers on the SFU,
+                whether it reports producer pauses)
+    """
+    from huddle01.local_peer import LocalPeer
+    from huddle01.room import RoomEvents
+
+    return (
+        all(hasattr(LocalPeer, name) for name in SERVER_PAUSE_METHODS),
+        all(hasattr(RoomEvents, name) for name in PRODUCER_PAUSE_EVENTS),
+    )
+
+
+def log_pause_support():
+    """Warn about what the pause policies cannot do with the installed huddle01 SDK. Called once at startup."""
+    server_side, producer_events = pause_support()
+    if not server_side:
+        logger.warning(
+            "🔔 huddle01 cannot pause consumers on the SFU: paused consumers still receive "
+            "and decode their packets, only encoding them is saved"
+        )
+    if not producer_events:
+        logger.warning(
+            "🔔 huddle01 does not report producer pauses: pause=muted pauses nothing, "
+            "pause=inactive only goes by the received audio"
+        )
+
+
+class PeerActivity:
+    """
+    Pause state of a peer's current consumer. Its recorder feeds it the decoded frames.
+    """
+
+    __slots__ = (
+        "peer_id",
+        "consumer",
+        "on_resume",
+        "detector",
+        "decoded",
+        "muted",
+        "paused",
+        "reason",
+        "accounted_at",
+        "paused_seconds",
+        "last_voice",
+        "next_probe",
+        "probe_started",
+        "probe_until",
+    )
+
+    def __init__(self, peer_id: str, detector: SilenceDetector):
+        self.peer_id = peer_id
+        self.consumer = None
+        # Called once the consumer is resumed, so the recording can place what follows
+        self.on_resume: Callable[[], None] | None = None
+        self.detector = detector
+        self.decoded = False
+        self.muted = False
+        self.paused = False
+        self.reason = None
+        self.accounted_at = 0.0
+        self.paused_seconds = 0.0
+        self.last_voice = time.monotonic()
+        self.next_probe = 0.0
+        self.probe_started = 0.0
+        self.probe_until = 0.0
+
+    def observe(self, frame):
+        self.decoded = True
+        if not self.detector.is_silent(frame):
+            self.last_voice = time.monotonic()
+
+
+class ConsumerActivity:
+    """
+    Pauses and resumes the audio consumers of one room, see the module docstring.
+    Runs on the room's event loop.
+
+    Args:
+        policy: "off", "muted" or "inactive".
+        local_peer: The bot's local peer, asked to pause consumers on the SFU when it can (see `pause_support`).
+        pause_after: Seconds of silence before an "inactive" consumer is paused (CONSUMER_PAUSE_AFTER if None).
+        probe_interval: Seconds between probes of a paused consumer (CONSUMER_PROBE_INTERVAL if None).
+        probe_seconds: Seconds a probe lasts (CONSUMER_PROBE_SECONDS if None).
+        bitrate: Bits per second a consumer receives, for the savings (CONSUMER_PAUSE_BITRATE if None).
+    """
+
+    def __init__(
+        self,
+        policy: str = PAUSE_OFF,
+        local_peer=None,
+        pause_after: float | None = None,
+        probe_interval: float | None = None,
+        probe_seconds: float | None = None,
+        bitrate: float | None = None,
+    ):
+        self.policy = policy
+        self.local_peer = local_peer
+        self.pause_after = (
+            pause_after
+            if pause_after is not None
+            else float(os.getenv("CONSUMER_PAUSE_AFTER") or 30)
+        )
+        self.probe_interval = (
+            probe_interval
+            if probe_interval is not None
+            else float(os.getenv("CONSUMER_PROBE_INTERVAL") or 10)
+        )
+        self.probe_seconds = (
+            probe_seconds
+            if probe_seconds is not None
+            else float(os.getenv("CONSUMER_PROBE_SECONDS") or 1)
+        )
+        self.bitrate = (
+            bitrate
+            if bitrate is not None
+            else float(os.getenv("CONSUMER_PAUSE_BITRATE") or 48000)
+        )
+        self.server_side = local_peer is not None and all(
+            hasattr(local_peer, name) for name in SERVER_PAUSE_METHODS
+        )
+        self.peers: Dict[str, PeerActivity] = {}
+        # Peers reported muted, and how to consume the producers they added meanwhile
+        self.muted_peers: Set[str] = set()
+        self.deferred: Dict[str, List[Callable[[], Awaitable]]] = {}
+        self.pauses = 0
+        self.paused_seconds = 0.0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop pausing, and account for consumers still paused. Call once the room is left."""
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        for peer in self.peers.values():
+            self._release(peer)
+
+    def add(self, peer_id: str, consumer) -> PeerActivity:
+        """A new consumer of `peer_id`, it replaces the peer's previous one."""
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            peer = self.peers[peer_id] = PeerActivity(peer_id, SilenceDetector())
+        self._release(peer)
+        peer.consumer = consumer
+        peer.muted = peer_id in self.muted_peers
+        peer.last_voice = time.monotonic()
+        peer.probe_until = 0.0
+        return peer
+
+    def consume_later(self, peer_id: str, consume: Callable[[], Awaitable]) -> bool:
+        """
+        Hold the consumption of a new producer while its peer is muted, `consume()`
+        is awaited once the peer unmutes.
+
+        Returns:
+            bool: False if the peer is not muted, consume the producer now
+        """
+        if self.policy == PAUSE_OFF or peer_id not in self.muted_peers:
+            return False
+        self.deferred.setdefault(peer_id, []).append(consume)
+        logger.info(f"⏸️ Not consuming the new producer of {peer_id} while it is muted")
+        return True
+
+    def remove(self, consumer):
+        """The consumer closed."""
+        for peer in self.peers.values():
+            if peer.consumer is consumer:
+                self._release(peer)
+                peer.consumer = None
+
+    def producer_muted(self, peer_id: str):
+        self.muted_peers.add(peer_id)
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            return
+        peer.muted = True
+        asyncio.ensure_future(self._pause(peer, "muted"))
+
+    def producer_unmuted(self, peer_id: str):
+        self.muted_peers.discard(peer_id)
+        for consume in self.deferred.pop(peer_id, []):
+            asyncio.ensure_future(consume())
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            return
+        peer.muted = False
+        peer.last_voice = time.monotonic()
+        asyncio.ensure_future(self._resume(peer, "unmuted"))
+
+    def speaking(self, peer_id: str):
+        """The SFU reports the peer as speaking."""
+        peer = self.peers.get(peer_id)
+        if peer is None:
+            return
+        peer.last_voice = time.monotonic()
+        asyncio.ensure_future(self._resume(peer, "speaking"))
+
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "paused": sum(peer.paused for peer in self.peers.values()),
+            "pauses": self.pauses,
+            "paused_seconds": round(self.paused_seconds, 3),
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(TICK_SECONDS)
+            track_cost.update()
+            now = time.monotonic()
+            for peer in list(self.peers.values()):
+                self._account(peer, now)
+                if peer.consumer is None:
+                    continue
+                if peer.paused:
+                    if (
+                        peer.reason == "inactive"
+                        and not peer.muted
+                        and now >= peer.next_probe
+                    ):
+                        await self._resume(peer, "probe")
+                    continue
+                if peer.muted:
+                    await self._pause(peer, "muted")
+                elif self.policy == PAUSE_INACTIVE and peer.decoded:
+                    if peer.probe_until and now >= peer.probe_until:
+                        peer.probe_until = 0.0
+                        if peer.last_voice < peer.probe_started:
+                            await self._pause(peer, "inactive")
+                            continue
+                    if (
+                        not peer.probe_until
+                        and now - peer.last_voice >= self.pause_after
+                    ):
+                        await self._pause(peer, "inactive")
+
+    async def _pause(self, peer: PeerActivity, reason: str):
+        consumer = peer.consumer
+        if peer.paused or consumer is None or self.policy == PAUSE_OFF:
+            return
+        peer.paused = True
+        try:
+            await self._set_paused(consumer, True)
+        except Exception as e:
+            logger.warning(f"🔔 Could not pause the consumer of {peer.peer_id}: {e}")
+            peer.paused = False
+            return
+        if self.task is None:
+            # Stopped while pausing, the room is being left
+            peer.paused = False
+            return
+        now = time.monotonic()
+        peer.reason = reason
+        peer.accounted_at = now
+        peer.next_probe = now + self.probe_interval
+        self.pauses += 1
+        self._paused_changed(1)
+        PAUSES.inc(reason=reason)
+        logger.info(f"⏸️ Paused the consumer of {peer.peer_id} ({reason})")
+
+    async def _resume(self, peer: PeerActivity, reason: str):
+        consumer = peer.consumer
+        if not peer.paused or consumer is None:
+            return
+        now = time.monotonic()
+        self._account(peer, now)
+        peer.paused = False
+        try:
+            await self._set_paused(consumer, False)
+        except Exception as e:
+            logger.warning(
+                f"🔔 Could not resume the consumer of {peer.peer_id}, retrying: {e}"
+            )
+            peer.paused = True
+            peer.accounted_at = time.monotonic()
+            return
+        self._paused_changed(-1)
+        if reason == "probe":
+            peer.probe_started = now
+            peer.probe_until = now + self.probe_seconds
+        RESUMES.inc(reason=reason)
+        if peer.on_resume:
+            peer.on_resume()
+        logger.info(f"▶️ Resumed the consumer of {peer.peer_id} ({reason})")
+
+    async def _set_paused(self, consumer, paused: bool):
+        # On the SFU when the local peer can, so packets stop; on the consumer otherwise,
+        # the recorder then drops its frames
+        if self.server_side:
+            result = getattr(
+                self.local_peer, "pause_consumer" if paused else "resume_consumer"
+            )(consumer.id)
+        else:
+            result = getattr(consumer, "pause" if paused else "resume")()
+        if inspect.isawaitable(result):
+            await result
+
+    def _release(self, peer: PeerActivity):
+        """Forget the peer's consumer pause, it closed or was replaced."""
+        if peer.paused:
+            self._account(peer, time.monotonic())
+            peer.paused = False
+            self._paused_changed(-1)
+
+    def _account(self, peer: PeerActivity, now: float):
+        if not peer.paused:
+            return
+        seconds = now - peer.accounted_at
+        peer.accounted_at = now
+        peer.paused_seconds += seconds
+        self.paused_seconds += seconds
+        PAUSED_SECONDS.inc(seconds)
+        if self.server_side:
+            SAVED_BYTES.inc(seconds * self.bitrate / 8)
+        SAVED_CPU.inc(seconds * track_cost.cost)
+
+    def _paused_changed(self, change: int):
+        PAUSED.inc(change)
+        track_cost.paused_changed(change)
@@ -1,20 +1,495 @@
+import os
+import json
 import pathlib
 import asyncio
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Callable, Dict, List
 
 from huddle01.handlers.local_peer_handler import NewConsumerAdded
-from chatot.recorder import WebRTCMediaRecorder
-from chatot.uploader import upload_file
-from chatot.utils.main import get_random_string
+from chatot.huddle.activity import ConsumerActivity
+from chatot.recorder import WebRTCMediaRecorder, OpusPassthroughRecorder, RecordingOptions
+from chatot.recorder.mixer import RoomMixer
+from chatot.recorder.options import PAUSE_OFF, RECORDING_MODE_OPUS
+from chatot.recorder.peer import PeerTrack
+from chatot.uploader import MultipartUploadWriter, UploadService
+from chatot.utils.main import get_random_string, when_all
+from chatot.utils.manifest import RoomManifest
+from chatot.utils.sessions import Session, TRACK_DONE, TRACK_FAILED, TRACK_UPLOADING
+from chatot.utils.tracing import Trace
 from chatot.utils.webhook_sender import WebhookSender
 
 # Configure logging
 from chatot.log import base_logger
 logger = base_logger.getChild(__name__)
 
-async def on_new_consumer(eventData: NewConsumerAdded):
+# Peer id of the room mix in webhooks and `/status`
+MIX_PEER_ID = "mix"
+# Peer and track id of the room manifest in webhooks and `/status`
+MANIFEST_PEER_ID = "manifest"
+
+
+def send_webhook(**kwargs) -> bool:
+    """
+    Queue a webhook (see `WebhookSender.send_webhook`) if `WEBHOOK_URL` and
+    `WEBHOOK_API_KEY` are set. Webhook errors are logged, never raised.
+
+    Returns:
+        bool: Whether the webhook was queued
+    """
+    webhook_sender = WebhookSender._instance
+    if not getattr(webhook_sender, '_initialized', False):
+        return False
+    try:
+        webhook_sender.send_webhook(**kwargs)
+        return True
+    except Exception as e:
+        logger.error(f"Error sending webhook for {kwargs.get('peer_id')}: {e}")
+        return False
+
+
+async def record_track(
+    track,
+    remote_peer_id: str,
+    track_id: str,
+    recording_options: RecordingOptions,
+    room_id: str = "",
+    session: Session | None = None,
+    receiver=None,
+    mix_input=None,
+    webhook_extra: Callable[[], dict] | None = None,
+    manifest: RoomManifest | None = None,
+    hold: bool = False,
+    activity=None,
+):
+    """
+    Record a track and upload it once it ends, sending its webhook and reporting it
+    to the session. Used for consumers and for the room mix.
+
+    Args:
+        track: The audio track to record.
+        remote_peer_id: Peer the track belongs to, names the file.
+        track_id: Consumer id (or mix track id) of the track.
+        recording_options: How the room is recorded.
+        room_id: The room, for metric labels and traces.
+        session: The `/start` session tracks are reported to, if any.
+        receiver: The consumer's RTP receiver, needed for Opus passthrough.
+        mix_input: The track's `MixerInput` in the room mix, if the room is mixed.
+        webhook_extra: Called when the recording completes, its fields are added to the webhook.
+        manifest: The room manifest the track is reported to, if any.
+        hold: The recording is a peer's consolidated one, its passthrough recorder outlives the receiver.
+        activity: The peer's `PeerActivity`, fed the decoded frames, if consumers may be paused.
+
+    Returns:
+        tuple: (recorder, track span)
+    """
+    trace = session.trace if session else Trace(**{"room.id": room_id})
+    span_attributes = {"peer.id": remote_peer_id, "track.id": track_id}
+
+    passthrough = recording_options.mode == RECORDING_MODE_OPUS
+    if passthrough and receiver is None:
+        logger.warning("🔔 No RTP receiver on consumer, falling back to transcoding")
+        passthrough = False
+    profile = recording_options.profile
+    if passthrough and recording_options.tap:
+        logger.warning("🔔 Opus passthrough does not decode audio, no PCM tap for this track")
+    if passthrough and mix_input:
+        logger.warning("🔔 Opus passthrough does not decode audio, this track is left out of the room mix")
+        mix_input.close()
+        mix_input = None
+    if passthrough:
+        format = extension = os.getenv("PASSTHROUGH_CONTAINER") or "ogg"
+    else:
+        format, extension = profile.container_format, profile.extension
+    audio_file_name = f"{remote_peer_id}-{get_random_string(4)}.{extension}"
+    audio_file_path = f"{pathlib.Path().resolve()}/recordings/{audio_file_name}"
+    object_name = f"recordings/{audio_file_name}"
+    index_object_name = f"{os.path.splitext(object_name)[0]}.index.json"
+
+    logger.info(f"✅ Starting to record track: {audio_file_name}")
+
+    segmented = recording_options.segmented and not passthrough
+
+    upload_writer = None
+    # Segments are uploaded as they close, so they never stream
+    if os.getenv("STREAMING_UPLOAD", "").lower() == "true" and not segmented:
+        keep_local = os.getenv("STREAMING_UPLOAD_KEEP_LOCAL", "true").lower() == "true"
+        upload_writer = MultipartUploadWriter(
+            object_name=object_name,
+            local_path=audio_file_path if keep_local else None
+        )
+
+    metric_labels = {"room": room_id, "peer": remote_peer_id, "track": track_id}
+    if passthrough:
+        audioRecorder = OpusPassthroughRecorder(
+            format=format,
+            output_path=audio_file_path,
+            output_file=upload_writer,
+            receiver=receiver,
+            loop=asyncio.get_event_loop(),
+            labels=metric_labels,
+            hold=hold
+        )
+    else:
+        audioRecorder = WebRTCMediaRecorder(
+            format=format,
+            output_path=audio_file_path,
+            output_file=upload_writer,
+            profile=profile,
+            track=track,
+            loop=asyncio.get_event_loop(),
+            segment_duration=recording_options.segment_duration if segmented else None,
+            segment_size=recording_options.segment_size if segmented else None,
+            silence_policy=recording_options.silence_policy,
+            labels=metric_labels,
+            tap=recording_options.tap,
+            mix=mix_input,
+            activity=activity
+        )
+    await audioRecorder.start()
+    track_span = trace.start_span("track", **span_attributes)
+    if session:
+        session.add_track(track_id, remote_peer_id, object_name)
+    if manifest:
+        manifest.add_track(track_id, remote_peer_id, index_object_name if segmented else object_name, format)
+
+    def track_state(state, url=None, error=None):
+        if session:
+            session.update_track(track_id, state, url=url, error=error)
+
+    def manifest_done(future=None, url=None, error=None):
+        if not manifest:
+            return
+        if segmented:
+            size = sum(entry["size"] for entry, _ in segment_uploads)
+        else:
+            size = future.job.size if future else None
+        manifest.track_done(
+            track_id,
+            url=url,
+            size=size,
+            segments=len(segment_uploads),
+            timing=audioRecorder.timeline.to_dict(manifest.started_at),
+            error=error,
+        )
+
+    def trace_upload(future):
+        job = future.job
+        if job.started_at is not None:
+            trace.add_span("upload.queue", job.enqueued_at, job.started_at, parent=track_span, **span_attributes)
+            trace.add_span("upload", job.started_at, job.finished_at, parent=track_span, bytes=job.size, **span_attributes)
+
+    def on_webhook_done(queued_at, finished_at, attempts, error):
+        trace.add_span("webhook.delivery", queued_at, finished_at, parent=track_span, attempts=attempts, **span_attributes)
+        if error:
+            track_span.attributes["error"] = error
+        track_span.finish(finished_at)
+
+    def on_upload_done(future, extra=None):
+        trace_upload(future)
+        try:
+            uploaded_file_url = future.result()
+        except Exception as e:
+            logger.error(f"Error uploading file: {e}")
+            track_state(TRACK_FAILED, error=str(e))
+            manifest_done(future, error=str(e))
+            track_span.attributes["error"] = str(e)
+            track_span.finish()
+            return
+
+        logger.info(f"Uploaded file url: {uploaded_file_url}")
+        track_state(TRACK_DONE, url=uploaded_file_url)
+        manifest_done(future, url=uploaded_file_url)
+
+        latency = trace.breakdown(track_span)
+        sent = send_webhook(
+            peer_id=remote_peer_id,
+            audio_file_url=uploaded_file_url,
+            extra={**(extra or {}), "latency": latency},
+            on_done=partial(on_webhook_done, latency["webhook_queued_at"])
+        )
+        if not sent:
+            track_span.finish()
+
+    # (index entry, upload future) for every closed segment, in order
+    segment_uploads = []
+
+    def on_segment_uploaded(entry, future):
+        try:
+            entry["url"] = future.result()
+            os.remove(entry.pop("path"))
+            if recording_options.segment_webhooks:
+                send_webhook(peer_id=remote_peer_id, audio_file_url=entry["url"], extra={"segment": entry})
+        except Exception as e:
+            logger.error(f"Error uploading segment {entry['object_name']}: {e}")
+
+    def on_segment(segment):
+        logger.info(f"⬆️ Queueing segment {segment['sequence']} upload to bucket")
+        entry = dict(segment, object_name=f"recordings/{os.path.basename(segment['path'])}", url=None)
+        future = UploadService().submit(file_name=segment["path"], object_name=entry["object_name"])
+        future.add_done_callback(partial(on_segment_uploaded, entry))
+        segment_uploads.append((entry, future))
+
+    def completion_extra(**extra):
+        # Trimmed recordings are shorter than the track, keep the way back to source time
+        if not passthrough and audioRecorder.silence.timestamp_map:
+            extra["timestamp_map"] = audioRecorder.silence.timestamp_map
+        # Where the track starts, in epoch seconds and in the room, and its gaps
+        extra["timing"] = audioRecorder.timeline.to_dict(manifest.started_at if manifest else None)
+        if webhook_extra:
+            extra.update(webhook_extra())
+        return extra
+
+    def upload_segment_index(_):
+        trace.add_span("segments.wait", completed_at, time.time(), parent=track_span, segments=len(segment_uploads), **span_attributes)
+        index = [
+            {key: value for key, value in entry.items() if key != "path"}
+            for entry, _ in segment_uploads
+        ]
+        future = UploadService().submit_bytes(
+            data=json.dumps({"peerId": remote_peer_id, **completion_extra(segments=index)}).encode(),
+            object_name=index_object_name,
+            content_type="application/json"
+        )
+        future.add_done_callback(partial(on_upload_done, extra=completion_extra(segments=index)))
+
+    completed_at = None
+
+    def on_recording_complete():
+        nonlocal completed_at
+        logger.info("⬆️ Queueing file upload to bucket")
+        track_state(TRACK_UPLOADING)
+        completed_at = time.time()
+        if audioRecorder.stopped_at:
+            trace.add_span("recorder.stop", audioRecorder.stopped_at, completed_at, parent=track_span, **span_attributes)
+        if audioRecorder.flush_timing:
+            trace.add_span("recorder.flush", *audioRecorder.flush_timing, parent=track_span, **span_attributes)
+
+        try:
+            upload_service = UploadService()
+            if segmented:
+                when_all([future for _, future in segment_uploads], upload_segment_index)
+                return
+            elif upload_writer:
+                future = upload_service.submit_call(
+                    object_name=object_name,
+                    run=upload_writer.complete,
+                    size=upload_writer.bytes_written
+                )
+            else:
+                future = upload_service.submit(
+                    file_name=audio_file_path,
+                    object_name=object_name
+                )
+            future.add_done_callback(partial(on_upload_done, extra=completion_extra()))
+        except Exception as e:
+            logger.error(f"Error queueing file upload: {e}")
+            track_state(TRACK_FAILED, error=str(e))
+            manifest_done(error=str(e))
+            track_span.attributes["error"] = str(e)
+            track_span.finish()
+
+    audioRecorder.on("segment", on_segment)
+    audioRecorder.once("completed", on_recording_complete)
+    return audioRecorder, track_span
+
+
+@dataclass(slots=True)
+class PeerRecording:
+    """
+    A peer's one recording in a room, continued by each of its consumers, see
+    `chatot.recorder.peer`.
+    """
+    peer_id: str
+    recorder: Any
+    track: PeerTrack
+    span: Any
+    consumers: List[str]
+
+    def attach(self, consumer) -> bool:
+        """
+        Continue the recording with `consumer`.
+
+        Returns:
+            bool: False if it cannot, e.g. passthrough and the consumer has no RTP receiver
+        """
+        if not self.recorder.recording:
+            return False
+        if isinstance(self.recorder, OpusPassthroughRecorder):
+            if consumer.rtpReceiver is None:
+                return False
+            try:
+                self.recorder.attach(consumer.rtpReceiver)
+            except Exception as e:
+                logger.warning(f"🔔 Cannot continue the recording of {self.peer_id}: {e}")
+                return False
+        else:
+            self.track.attach(consumer.track)
+        self.consumers.append(consumer.id)
+        return True
+
+    def detach(self, consumer):
+        self.track.detach(consumer.track)
+
+    def resumed(self):
+        """The consumer was paused until now, place what follows by wall clock."""
+        if isinstance(self.recorder, OpusPassthroughRecorder):
+            self.recorder.rebaser.resync()
+        else:
+            self.track.rebaser.resync()
+
+    async def stop(self):
+        self.track.stop()
+        await self.recorder.stop()
+
+
+async def stop_peer_recordings(peers: Dict[str, PeerRecording]):
+    """Stop the peers' recordings once the room's consumers are closed."""
+    recordings = list(peers.values())
+    peers.clear()
+    await asyncio.gather(*(peer.stop() for peer in recordings))
+
+
+def start_consumer_activity(recording_options: RecordingOptions, local_peer=None) -> ConsumerActivity | None:
+    """The room's consumer pause policy, None when consumers are never paused."""
+    if recording_options.pause_policy == PAUSE_OFF:
+        return None
+    activity = ConsumerActivity(recording_options.pause_policy, local_peer=local_peer)
+    activity.start()
+    return activity
+
+
+async def stop_consumer_activity(activity: ConsumerActivity | None):
+    if activity is not None:
+        await activity.stop()
+
+
+async def start_room_mix(
+    recording_options: RecordingOptions,
+    room_id: str = "",
+    session: Session | None = None,
+    manifest: RoomManifest | None = None,
+) -> tuple:
+    """
+    Start the room mix, if the room is mixed. Consumers are added to it by
+    `on_new_consumer`, and it is recorded and uploaded like one more track.
+
+    Returns:
+        tuple: (mixer, recorder), both None when the room is not mixed
+    """
+    if not recording_options.mix:
+        return None, None
+    mixer = RoomMixer(gains=recording_options.mix_gains, labels={"room": room_id})
+    recorder, _ = await record_track(
+        mixer.track,
+        MIX_PEER_ID,
+        mixer.track.id,
+        recording_options,
+        room_id=room_id,
+        session=session,
+        webhook_extra=lambda: {"mix": mixer.stats()},
+        manifest=manifest,
+    )
+    logger.info(f"✅ Mixing room {room_id}")
+    return mixer, recorder
+
+
+async def stop_room_mix(mixer: RoomMixer | None, recorder, timeout: float = 5.0):
+    """
+    Stop the room mix once its consumers are closed, recording what is still in the
+    jitter window before the recorder stops.
+    """
+    if mixer is None:
+        return
+    mixer.stop()
+    if recorder.task:
+        await asyncio.wait({recorder.task}, timeout=timeout)
+    await recorder.stop()
+
+
+def start_room_manifest(recording_options: RecordingOptions, room_id: str = "", session: Session | None = None) -> RoomManifest | None:
+    """The room's manifest, None when the room has none. Create it as the room is joined."""
+    if not recording_options.manifest:
+        return None
+    return RoomManifest(room_id, session.session_id if session else None)
+
+
+def finish_room_manifest(manifest: RoomManifest | None, session: Session | None = None):
+    """
+    Upload the manifest once every track of the room is uploaded or failed, and send
+    its webhook. Call it once the room is left; the session waits for the manifest
+    like it waits for a track.
+    """
+    if manifest is None:
+        return
+
+    def manifest_state(state, url=None, error=None):
+        if session:
+            session.update_track(MANIFEST_PEER_ID, state, url=url, error=error)
+
+    def on_uploaded(future):
+        try:
+            url = future.result()
+        except Exception as e:
+            logger.error(f"Error uploading manifest: {e}")
+            manifest_state(TRACK_FAILED, error=str(e))
+            return
+
+        logger.info(f"Uploaded manifest url: {url}")
+        manifest_state(TRACK_DONE, url=url)
+        send_webhook(
+            peer_id=MANIFEST_PEER_ID,
+            audio_file_url=url,
+            extra={"manifest": {"room_id": manifest.room_id, "session_id": manifest.session_id, "tracks": len(manifest.tracks)}}
+        )
+
+    def upload(_):
+        logger.info(f"⬆️ Queueing manifest upload to bucket: {manifest.object_name}")
+        manifest_state(TRACK_UPLOADING)
+        try:
+            future = UploadService().submit_bytes(
+                data=manifest.to_json(),
+                object_name=manifest.object_name,
+                content_type="application/json"
+            )
+            future.add_done_callback(on_uploaded)
+        except Exception as e:
+            logger.error(f"Error queueing manifest upload: {e}")
+            manifest_state(TRACK_FAILED, error=str(e))
+
+    if session:
+        session.add_track(MANIFEST_PEER_ID, MANIFEST_PEER_ID, manifest.object_name)
+    manifest.close(upload)
+
+
+async def on_new_consumer(
+    eventData: NewConsumerAdded,
+    recording_options: RecordingOptions | None = None,
+    room_id: str = "",
+    session: Session | None = None,
+    mixer: RoomMixer | None = None,
+    manifest: RoomManifest | None = None,
+    peers: Dict[str, PeerRecording] | None = None,
+    activity: ConsumerActivity | None = None,
+):
+    """
+    Record a new audio consumer. With `recording_options.consolidate` and the room's
+    `peers`, a peer's later consumers continue its first consumer's recording. With
+    the room's `activity`, the consumer is paused while its peer is muted or silent.
+    """
+    if recording_options is None:
+        recording_options = RecordingOptions()
+    if not recording_options.consolidate:
+        peers = None
+
     consumer = eventData["consumer"]
     remote_peer_id = eventData["remote_peer_id"]
     audioRecorder = None
+    peer = None
+    trace = session.trace if session else Trace(**{"room.id": room_id})
+    span_attributes = {"peer.id": remote_peer_id, "track.id": consumer.id}
+    track_span = None
 
     logger.info(f"✅ New consumer created: {consumer.id=}")
 
@@ -23,43 +498,59 @@ async def on_new_consumer(eventData: NewConsumerAdded):
             f"Audio consumer detected (ID: {consumer.id}), setting up recording"
         )
         track = consumer.track
-        format = "mp3"
-        audio_file_name = f"{remote_peer_id}-{get_random_string(4)}.{format}"
-        audio_file_path = f"{pathlib.Path().resolve()}/recordings/{audio_file_name}"
-
-        if track:
-            logger.info(f"✅ Starting to record track: {audio_file_name}")
-
-            audioRecorder = WebRTCMediaRecorder(
-                format=format,
-                output_path=audio_file_path,
-                track=track,
-                loop=asyncio.get_event_loop()
+
+        existing = peers.get(remote_peer_id) if peers is not None else None
+        peer_activity = activity.add(remote_peer_id, consumer) if activity and track else None
+        if track and existing and existing.attach(consumer):
+            logger.info(f"✅ Consumer {consumer.id} continues the recording of {remote_peer_id}")
+            peer, track_span = existing, existing.span
+            trace.mark("consumer.attach", parent=track_span, **span_attributes)
+            if peer_activity:
+                peer_activity.on_resume = peer.resumed
+        elif track:
+            # A peer whose recording cannot be continued gets a separate one
+            consolidate = peers is not None and existing is None
+            peer_track = PeerTrack(track) if consolidate else None
+            consumer_ids = [consumer.id]
+
+            def webhook_extra():
+                extra = {"consumers": consumer_ids} if consolidate else {}
+                if peer_activity:
+                    extra["paused_seconds"] = round(peer_activity.paused_seconds, 3)
+                return extra
+
+            audioRecorder, track_span = await record_track(
+                peer_track or track,
+                remote_peer_id,
+                consumer.id,
+                recording_options,
+                room_id=room_id,
+                session=session,
+                receiver=consumer.rtpReceiver,
+                mix_input=mixer.add_input(remote_peer_id, consumer.id) if mixer and not mixer.stopped else None,
+                webhook_extra=webhook_extra,
+                manifest=manifest,
+                hold=consolidate,
+                activity=peer_activity,
             )
-            await audioRecorder.start()
-
-            def on_recording_complete():
-                logger.info("⬆️ Uploading file to bucket")
-
-                try:
-                    uploaded_file_url = upload_file(
-                        file_name=audio_file_path,
-                        object_name=f"recordings/{audio_file_name}"
-                    )
-                    logger.info(f"Uploaded file url: {uploaded_file_url}")
-                    webhook_sender = WebhookSender(endpoint_url=None)
-                    webhook_sender.send_webhook(peer_id=remote_peer_id, audio_file_url=uploaded_file_url)
-                except Exception as e:
-                    logger.error(f"Error uploading file: {e}")
-
-            audioRecorder.once("completed", on_recording_complete)
+            if consolidate:
+                peer = peers[remote_peer_id] = PeerRecording(remote_peer_id, audioRecorder, peer_track, track_span, consumer_ids)
+                if peer_activity:
+                    peer_activity.on_resume = peer.resumed
         else:
             logger.warning("🔔 Track not found or not in ready state")
 
         @consumer._observer.on("close")
         async def on_close():
             logger.info(
-                f"Consumer {consumer.id} closed, stopping recording"
+                f"Consumer {consumer.id} closed"
             )
-            if audioRecorder:
+            if track_span:
+                trace.mark("consumer.close", parent=track_span, **span_attributes)
+            if activity:
+                activity.remove(consumer)
+            if peer:
+                # The peer's recording goes on until the room is left
+                peer.detach(consumer)
+            elif audioRecorder:
                 await audioRecorder.stop()
@@ -11,9 +11,22 @@ from huddle01.room import RoomEvents, RoomEventsData, Room
 from huddle01.handlers import ConsumeOptions
 
 from pyee import AsyncIOEventEmitter
+from functools import partial
 import json
 
-from chatot.huddle.handlers import on_new_consumer
+from chatot.huddle.activity import PRODUCER_PAUSE_EVENTS
+from chatot.huddle.handlers import (
+    finish_room_manifest,
+    on_new_consumer,
+    start_consumer_activity,
+    start_room_manifest,
+    start_room_mix,
+    stop_consumer_activity,
+    stop_peer_recordings,
+    stop_room_mix,
+)
+from chatot.recorder import RecordingOptions
+from chatot.utils.sessions import Session
 from chatot.log import base_logger
 
 logger = base_logger.getChild(__name__)
@@ -28,17 +41,30 @@ class Huddle01Manager(AsyncIOEventEmitter):
     Attributes:
         project_id (str): The Huddle01 project ID.
         api_key (str): The API key for authentication with Huddle01 services.
+        recording_options (RecordingOptions): How tracks in this room are recorded.
+        session (Session): The `/start` session tracks are reported to, if any.
+        mixer (RoomMixer): The room mix, when `recording_options.mix` is set.
+        manifest (RoomManifest): The room's manifest, when `recording_options.manifest` is set.
+        peers (dict): Each peer's recording by peer id, when `recording_options.consolidate` is set.
+        activity (ConsumerActivity): Pauses consumers of silent peers, unless `recording_options.pause_policy` is off.
     """
 
-    def __init__(self, project_id: str, api_key: str, loop=None,):
+    def __init__(self, project_id: str, api_key: str, loop=None, recording_options: RecordingOptions | None = None, session: Session | None = None):
         super(Huddle01Manager, self).__init__(loop=loop)
         self.project_id = project_id
         self.api_key = api_key
+        self.recording_options = recording_options or RecordingOptions()
+        self.session = session
         options = HuddleClientOptions(autoConsume=False, volatileMessaging=False)
         self.client = HuddleClient(project_id=project_id, options=options)
         self.local_peer = None
         self.room = None
         self.peer_id = None
+        self.mixer = None
+        self.mix_recorder = None
+        self.manifest = None
+        self.peers = {}
+        self.activity = None
 
     async def join_room(self, room_id: str) -> Room:
         """
@@ -68,14 +94,46 @@ class Huddle01Manager(AsyncIOEventEmitter):
                 if (data["label"] != "audio"):
                     logger.info(f"{data["label"]} found, ignoring..")
                 else:
-                    await room.local_peer.consume(options=ConsumeOptions(producer_id=data["producer_id"], producer_peer_id=data["remote_peer_id"]))
+                    consume = partial(room.local_peer.consume, options=ConsumeOptions(producer_id=data["producer_id"], producer_peer_id=data["remote_peer_id"]))
+                    # A muted peer's producer is consumed once it unmutes
+                    if self.activity and self.activity.consume_later(data["remote_peer_id"], consume):
+                        return
+                    await consume()
 
             @room.once(RoomEvents.RoomClosed)
             def on_room_close():
                 logger.info("Room Closed, emitting completed")
+                if self.session:
+                    self.session.trace.mark("room.closed")
                 self.emit("completed")
 
-            room.local_peer.on(LocalPeerEvents.NewConsumer, on_new_consumer)
+            # Before the first consumer, so every track is in the mix from its first frame
+            self.activity = start_consumer_activity(self.recording_options, local_peer=room.local_peer)
+            if self.activity:
+                # huddle01 1.1.2a2 does not report producer pauses, see `log_pause_support`
+                for name, signal in zip(PRODUCER_PAUSE_EVENTS, (self.activity.producer_muted, self.activity.producer_unmuted)):
+                    event = getattr(RoomEvents, name, None)
+                    if event is not None:
+                        room.on(event, lambda data, signal=signal: signal(data["remote_peer_id"]))
+
+            self.manifest = start_room_manifest(self.recording_options, room_id=room_id, session=self.session)
+            self.mixer, self.mix_recorder = await start_room_mix(
+                self.recording_options, room_id=room_id, session=self.session, manifest=self.manifest
+            )
+
+            room.local_peer.on(
+                LocalPeerEvents.NewConsumer,
+                partial(
+                    on_new_consumer,
+                    recording_options=self.recording_options,
+                    room_id=room_id,
+                    session=self.session,
+                    mixer=self.mixer,
+                    manifest=self.manifest,
+                    peers=self.peers,
+                    activity=self.activity,
+                )
+            )
 
             @room.on(RoomEvents.ConsumerClosed)
             async def on_consumer_closed(data: RoomEventsData.ConsumerClosed):
@@ -97,4 +155,14 @@ class Huddle01Manager(AsyncIOEventEmitter):
             self.local_peer = None
             await self.client.close()
 
+        # After the consumers, the peers' recordings leave the mix as they stop
+        mixer, self.mixer = self.mixer, None
+        activity, self.activity = self.activity, None
+        await stop_consumer_activity(activity)
+        await stop_peer_recordings(self.peers)
+        await stop_room_mix(mixer, self.mix_recorder)
+        # Every track of the room is stopped, the manifest waits for their uploads
+        manifest, self.manifest = self.manifest, None
+        finish_room_manifest(manifest, self.session)
+
         logger.info("Room left successfully")
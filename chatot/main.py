@@ -1,34 +1,75 @@
-import os
 import logging
-from dotenv import load_dotenv
-from chatot.api import apiHandler
-from chatot.utils.webhook_sender import WebhookSender
+import sys
+
+from chatot.settings import get_settings
 
 # Configure logging
 from chatot.log import base_logger
 logger = base_logger.getChild(__name__)
 
-load_dotenv()
 
-API_KEY = os.getenv("HUDDLE01_API_KEY")
-PROJECT_ID = os.getenv("HUDDLE01_PROJECT_ID")
-WEBHOOK_URL= os.getenv("WEBHOOK_URL")
-WEBHOOK_SECRET = os.getenv("WEBHOOK_API_KEY")
+def serve_api(host: str, port: int):
+    """
+    Serve the recording API in this process. `/healthz` answers as soon as waitress
+    listens, the media stack is imported in the background (see `chatot.api.warmup`).
+    SIGTERM or SIGINT drains the process before it exits (see `chatot.api.drain`).
 
-if not API_KEY or not PROJECT_ID:
-    logger.error(
-        "Missing required environment variables. Please set HUDDLE01_API_KEY, HUDDLE01_PROJECT_ID"
-    )
-    raise Exception("Invalid Environment Variables")
+    Returns:
+        DrainReport | None: The drain that stopped the server, None if it stopped otherwise
+    """
+    # Loads `.env` before any subsystem reads its settings
+    settings = get_settings()
 
-if __name__ == "__main__":
-    # Run the async main function
-    logger.setLevel(logging.DEBUG)
+    from chatot.api import apiHandler
+    from chatot.api.admission import AdmissionController
+    from chatot.api.drain import Drainer
+    from chatot.api.warmup import warm_up
+    from chatot.cluster import ClusterNode
+    from chatot.utils.memory import tune_gc
+    from chatot.utils.shutdown import on_shutdown_signal, stop_serving
+    from chatot.utils.webhook_sender import WebhookSender
 
-    if WEBHOOK_URL and WEBHOOK_SECRET:
+    if settings.webhook_url and settings.webhook_secret:
         logger.info("INITIALISING WEBHOOK ENDPOINT")
-        WebhookSender(endpoint_url=WEBHOOK_URL, webhook_secret=WEBHOOK_SECRET)
-    logger.info("Starting API Server")
+        WebhookSender(endpoint_url=settings.webhook_url, webhook_secret=settings.webhook_secret)
+    # Join the cluster before taking requests so other nodes can place rooms here
+    ClusterNode()
+    # Start sampling before the first room so the idle memory is not charged to tracks
+    AdmissionController()
+    tune_gc()
+    warm_up()
+    drainer = Drainer()
+    on_shutdown_signal(lambda name: drainer.start(name, on_done=lambda report: stop_serving()))
+    logger.info(f"Starting API Server on {host}:{port}")
 
     from waitress import serve
-    serve(apiHandler, host='0.0.0.0', port=5000)
+    serve(apiHandler, host=host, port=port)
+    return drainer.wait(0)
+
+
+def main():
+    logger.setLevel(logging.DEBUG)
+
+    settings = get_settings()
+    missing = settings.missing()
+    if missing:
+        logger.error(
+            f"Missing required environment variables. Please set {', '.join(missing)}"
+        )
+        raise Exception("Invalid Environment Variables")
+
+    if settings.workers > 1:
+        from chatot.supervisor import Supervisor
+        logger.info(f"Starting supervisor with {settings.workers} workers")
+        report = Supervisor(workers=settings.workers).run(host='0.0.0.0', port=settings.port)
+    else:
+        report = serve_api(host='0.0.0.0', port=settings.port)
+
+    if report is not None and not report["complete"]:
+        from chatot.utils.shutdown import EXIT_DRAIN_INCOMPLETE
+        sys.exit(EXIT_DRAIN_INCOMPLETE)
+
+
+if __name__ == "__main__":
+    # Run the async main function
+    main()
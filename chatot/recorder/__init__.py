@@ -1,3 +1,22 @@
-from .audio_recorder import WebRTCMediaRecorder
+from .options import RecordingOptions
+from .profiles import RecordingProfile
 
-__all__ = ["WebRTCMediaRecorder"]
+__all__ = [
+    "WebRTCMediaRecorder",
+    "OpusPassthroughRecorder",
+    "RecordingOptions",
+    "RecordingProfile",
+]
+
+
+def __getattr__(name):
+    # The recorders import PyAV and aiortc, which the API does not need to start
+    if name == "WebRTCMediaRecorder":
+        from .audio_recorder import WebRTCMediaRecorder
+
+        return WebRTCMediaRecorder
+    if name == "OpusPassthroughRecorder":
+        from .opus_passthrough import OpusPassthroughRecorder
+
+        return OpusPassthroughRecorder
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,6 +4,15 @@ from aiortc.mediastreams import MediaStreamError
 import av
 from pyee import AsyncIOEventEmitter
 import os
+import time
+
+from .encoder import EncodePipeline
+from .metrics import RECV_WAIT, recorder_started, recorder_stopped, track_labels
+from .profiles import RecordingProfile
+from .silence import TIMESTAMPED_CONTAINERS, SilenceFilter, SilentFrame
+from .tap import PcmTap
+from .timeline import TrackTimeline
+from .types import RecordingSegment
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -14,9 +23,37 @@ logger = logging.getLogger(__name__)
 class WebRTCMediaRecorder(AsyncIOEventEmitter):
     """
     Records media from a RemoteStreamTrack to a file.
+
+    With `segment_duration` or `segment_size` set, the recording is split into
+    `<name>-0000.<ext>`, `<name>-0001.<ext>`, ... and a "segment" event carrying a
+    `RecordingSegment` is emitted as soon as each one is closed, before "completed".
+
+    `silence_policy` decides what happens to silent frames, see `chatot.recorder.silence`.
+    Gaps in the received PTS are filled by the same policy, and `timeline` keeps
+    the track's start time and gaps, see `chatot.recorder.timeline`.
+    With `tap`, the PCM of every received frame is also published to a live tap,
+    see `chatot.recorder.tap`. With `mix`, received frames are also added to the
+    room's mix, see `chatot.recorder.mixer`.
     """
 
-    def __init__(self, track, output_path: str, loop=None, format: str | None = None):
+    def __init__(
+        self,
+        track,
+        output_path: str,
+        loop=None,
+        format: str | None = None,
+        output_file=None,
+        profile: RecordingProfile | None = None,
+        queue_size: int | None = None,
+        overflow_policy: str | None = None,
+        segment_duration: float | None = None,
+        segment_size: int | None = None,
+        silence_policy: str | None = None,
+        labels: dict | None = None,
+        tap: bool = False,
+        mix=None,
+        activity=None,
+    ):
         """
         Initialize the recorder with a RemoteStreamTrack.
 
@@ -24,42 +61,235 @@ class WebRTCMediaRecorder(AsyncIOEventEmitter):
             track: The RemoteStreamTrack object to record from.
             output_path: Path where the recorded file will be saved.
             format: Output format (determined from filename extension if None).
+            output_file: Writable file object to mux into instead of output_path, format is then required.
+            profile: Codec, sample rate, channels and bitrate to encode with (MP3 at the source rate if None).
+            queue_size: Frames buffered for the encoder pool (ENCODER_QUEUE_SIZE if None).
+            overflow_policy: What to do when the encoder falls behind, see `chatot.recorder.encoder`.
+            segment_duration: Start a new segment after this many seconds of audio.
+            segment_size: Start a new segment after this many encoded bytes.
+            silence_policy: "encode", "gap" or "trim" (SILENCE_POLICY if None).
+            labels: Metric labels ("room", "peer", "track") of this recording.
+            tap: Publish the received PCM to a shared-memory ring for live readers.
+            mix: The `MixerInput` of this track in the room's mix, closed when the recorder stops.
+            activity: The peer's `PeerActivity`, fed the received frames, see `chatot.huddle.activity`.
         """
         self.track = track
         self.output_path = output_path
         self.format = format
+        self.output_file = output_file
+        self.profile = profile or RecordingProfile()
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.segment_duration = segment_duration
+        self.segment_size = segment_size
+        self.segments: list[RecordingSegment] = []
+        extension = os.path.splitext(output_path)[1].lstrip(".")
+        self.silence = SilenceFilter(
+            policy=silence_policy,
+            timestamped=(format or extension) in TIMESTAMPED_CONTAINERS,
+        )
+        self.labels = track_labels(**(labels or {"track": getattr(track, "id", "")}))
+        self.tap = PcmTap(labels=self.labels) if tap else None
+        self.mix = mix
+        self.activity = activity
+        # Tracks that deliver audio late on purpose (the room mix) say by how much
+        self.timeline = TrackTimeline(latency=getattr(track, "latency", 0.0))
+        self.frames_received = 0
+        self.recv_wait_seconds = 0.0
         self.recording = False
+        # Epoch times of `stop()` and of flushing the encoder, for latency tracing
+        self.stopped_at = None
+        self.flush_timing = None
         self.task = None
         self.container = None
         self.stream = None
+        self.resampler = None
+        self.pipeline = None
+        self._segment = None
+        self._silence_frame = None
         super(WebRTCMediaRecorder, self).__init__(loop=loop)
 
+    @property
+    def segmented(self) -> bool:
+        return (
+            bool(self.segment_duration or self.segment_size)
+            and self.output_file is None
+        )
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames received but not yet encoded."""
+        return self.pipeline.queue_depth if self.pipeline else 0
+
+    def stats(self) -> dict:
+        """Encoder queue depth, encode latency, drop and silence counters for this recorder."""
+        stats = self.pipeline.stats() if self.pipeline else {}
+        if self.silence.enabled:
+            stats["silence"] = self.silence.stats()
+        return stats
+
     async def start(self):
         """Start recording media."""
         if self.recording:
             return
 
         self.recording = True
+        recorder_started(self)
         self.task = asyncio.create_task(self._record())
 
     async def stop(self):
-        """Stop recording media."""
+        """Stop recording media, waiting for queued frames to be encoded and flushed."""
         if not self.recording:
             return
 
         self.recording = False
+        self.stopped_at = time.time()
+        recorder_stopped(self)
+        if self.tap:
+            self.tap.close()
+        if self.mix:
+            self.mix.close()
 
-        if self.container:
-            self.container.close()
-            self.container = None
-            self.stream = None
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.task = None
+
+        flush_started = time.time()
+        if self.pipeline:
+            try:
+                await self.pipeline.close(finish=self._finish)
+            except Exception as e:
+                logger.error(f"Error flushing recording: {e}")
+        elif self.container:
+            self._finish()
+        self.flush_timing = (flush_started, time.time())
 
         self.emit("completed")
         logger.info("✅ Recorder stopped")
 
-        if self.task:
-            self.task.cancel()
-            self.task = None
+    def _write_tap(self, frame):
+        try:
+            self.tap.write(frame)
+        except Exception as e:
+            # Live readers are best effort, the recording goes on without them
+            logger.error(f"Error writing PCM tap, closing it: {e}")
+            self.tap.close()
+            self.tap = None
+
+    def _write_mix(self, frame):
+        try:
+            self.mix.write(frame)
+        except Exception as e:
+            # The mix goes on without this track, its own recording is unaffected
+            logger.error(f"Error mixing frame, leaving the mix: {e}")
+            self.mix.close()
+            self.mix = None
+
+    def _segment_path(self, sequence: int) -> str:
+        root, extension = os.path.splitext(self.output_path)
+        return f"{root}-{sequence:04d}{extension}"
+
+    def _open_output(self, frame):
+        """
+        Open the container and add the output stream once the source format is known.
+        Runs on the encoder pool, once per segment.
+
+        A resampler is only created when the profile asks for a different sample rate or
+        channel layout than the source, and is then reused for every frame and segment.
+        """
+        profile = self.profile
+        rate = profile.sample_rate or frame.sample_rate
+        layout = profile.layout or frame.layout.name
+
+        if self.segmented:
+            sequence = len(self.segments)
+            path = self._segment_path(sequence)
+            self._segment = RecordingSegment(
+                sequence=sequence,
+                path=path,
+                start_pts=frame.pts,
+                start_time=float(frame.pts * frame.time_base)
+                if frame.pts is not None and frame.time_base
+                else 0.0,
+                duration=0.0,
+                size=0,
+            )
+            self.container = av.open(path, mode="w", format=self.format)
+        else:
+            self.container = av.open(
+                self.output_file or self.output_path, mode="w", format=self.format
+            )
+
+        self.stream = self.container.add_stream(
+            profile.spec.encoder, rate=rate, layout=layout
+        )
+        if profile.bitrate and not profile.spec.lossless:
+            self.stream.bit_rate = profile.bitrate
+
+        if self.resampler is None and (
+            rate != frame.sample_rate or layout != frame.layout.name
+        ):
+            self.resampler = av.AudioResampler(
+                format=self.stream.format.name, layout=layout, rate=rate
+            )
+
+    def _mux(self, packets):
+        for packet in packets:
+            if self._segment is not None:
+                self._segment["size"] += packet.size
+            self.container.mux(packet)
+
+    def _encode(self, frame):
+        """Encode and write one frame. Runs on the encoder pool."""
+        silent = isinstance(frame, SilentFrame)
+        if silent:
+            frame = self._silence_frame = frame.to_frame(reuse=self._silence_frame)
+
+        if self.container is None:
+            self._open_output(frame)
+
+        started = time.perf_counter()
+        frames = self.resampler.resample(frame) if self.resampler else (frame,)
+        for output_frame in frames:
+            self._mux(self.stream.encode(output_frame))
+        if self.silence.enabled:
+            self.silence.record_encode(time.perf_counter() - started, silent)
+
+        segment = self._segment
+        if segment is not None:
+            segment["duration"] += frame.samples / frame.sample_rate
+            if (
+                self.segment_duration and segment["duration"] >= self.segment_duration
+            ) or (self.segment_size and segment["size"] >= self.segment_size):
+                self._close_output()
+
+    def _close_output(self):
+        """Flush the encoder and close the current container, announcing it if segmented."""
+        try:
+            if self.container and self.stream:
+                self._mux(self.stream.encode(None))
+        finally:
+            if self.container:
+                self.container.close()
+            self.container = None
+            self.stream = None
+
+        segment = self._segment
+        self._segment = None
+        if segment is not None:
+            segment["size"] = os.path.getsize(segment["path"])
+            self.segments.append(segment)
+            self.pipeline.loop.call_soon_threadsafe(self.emit, "segment", segment)
+
+    def _finish(self):
+        """Flush remaining packets and close the container. Runs on the encoder pool."""
+        try:
+            if self.container and self.stream and self.resampler:
+                for output_frame in self.resampler.resample(None):
+                    self._mux(self.stream.encode(output_frame))
+        finally:
+            self._close_output()
+            self.resampler = None
 
     async def _record(self):
         """Record media from the RemoteStreamTrack."""
@@ -71,27 +301,49 @@ class WebRTCMediaRecorder(AsyncIOEventEmitter):
             # os.makedirs() creates parent directories as needed (like mkdir -p)
             # exist_ok=True prevents an error if the directory already exists
             # Ensure it's not an empty string if path is just a filename
-            if output_dir:
+            if output_dir and self.output_file is None:
                 os.makedirs(output_dir, exist_ok=True)
 
-            # Create output container
-            self.container = av.open(self.output_path, mode="w", format=self.format)
-
-            # Create appropriate stream
-            if self.track.kind == "audio":
-                self.stream = self.container.add_stream("mp3")
-            else:
+            # The container is opened with the first frame, see `_open_output`
+            if self.track.kind != "audio":
                 logger.error("Cannot record video streams")
                 return
 
-            # Record frames
+            self.pipeline = EncodePipeline(
+                encode=self._encode,
+                loop=asyncio.get_running_loop(),
+                max_size=self.queue_size,
+                policy=self.overflow_policy,
+            )
+
+            # Receive frames, encoding happens on the encoder pool
             while self.recording and self.track.readyState == "live":
                 try:
+                    started = time.perf_counter()
                     frame = await self.track.recv()
+                    waited = time.perf_counter() - started
+                    self.frames_received += 1
+                    self.recv_wait_seconds += waited
+                    RECV_WAIT.observe(waited)
 
-                    # Encode and write the packet
-                    for packet in self.stream.encode(frame):
-                        self.container.mux(packet)
+                    if self.activity:
+                        if self.activity.paused:
+                            # Paused on the consumer only, its packets still arrive
+                            continue
+                        self.activity.observe(frame)
+                    if self.tap:
+                        self._write_tap(frame)
+                    if self.mix:
+                        self._write_mix(frame)
+                    gap = self.timeline.observe(
+                        frame.pts, frame.samples, frame.sample_rate, frame.time_base
+                    )
+                    if gap:
+                        for silent_frame in self.silence.fill_gap(frame, gap):
+                            await self.pipeline.put(silent_frame)
+                    frame = self.silence.process(frame)
+                    if frame is not None:
+                        await self.pipeline.put(frame)
 
                 except MediaStreamError:
                     logger.warn(
@@ -102,9 +354,4 @@ class WebRTCMediaRecorder(AsyncIOEventEmitter):
         except asyncio.CancelledError:
             logger.info("Received Closing Signal")
         finally:
-            # Flushing any remaining packets
-            if self.container and self.stream:
-                for packet in self.stream.encode(None):
-                    self.container.mux(packet)
-
             await self.stop()
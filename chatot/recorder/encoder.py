@@ -0,0 +1,335 @@
+"""
+Encoder worker pool used by `WebRTCMediaRecorder`.
+
+The room's event loop only receives frames and hands them to a bounded,
+per-recorder `EncodePipeline`. The PyAV encode and mux calls run on a
+process-wide thread pool (PyAV releases the GIL inside the codec), one
+drain job at a time per recorder so packets stay in order.
+
+Overflow policy, applied when a recorder's queue is full:
+    block:       `put` waits for the encoder to free a slot. No audio is lost,
+                 frames back up in the track instead (default).
+    drop_oldest: the oldest queued frame is discarded to make room.
+    spill:       frames are appended to a temporary file under
+                 `ENCODER_SPILL_DIR` and replayed in order once the queue
+                 has room again. Disk is used instead of memory.
+"""
+
+import asyncio
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import av
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Histogram
+
+logger = base_logger.getChild(__name__)
+
+OVERFLOW_BLOCK = "block"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+ENCODE_LATENCY = Histogram(
+    "chatot_encode_latency_seconds",
+    "Time to encode and mux one frame on the encoder pool.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1),
+)
+
+
+class EncoderPool:
+    """
+    Process-wide thread pool that runs encode and mux work for all recorders.
+    Implemented as a singleton sized by `ENCODER_WORKERS` (defaults to the number of cores).
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(EncoderPool, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, workers: int | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        if workers is None:
+            workers = int(os.getenv("ENCODER_WORKERS") or os.cpu_count() or 1)
+
+        self.workers = max(1, workers)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="chatot-encoder"
+        )
+        self._initialized = True
+        logger.info(f"Encoder pool started with {self.workers} workers")
+
+    def submit(self, fn: Callable, *args):
+        return self.executor.submit(fn, *args)
+
+
+class EncodePipeline:
+    """
+    Bounded frame queue for one recorder, drained on the `EncoderPool`.
+
+    Args:
+        encode: Called on a pool thread with each frame, in order.
+        loop: The event loop the producer (`put`) runs on.
+        max_size: Maximum number of frames held in memory.
+        policy: One of `OVERFLOW_POLICIES`.
+    """
+
+    __slots__ = (
+        "encode",
+        "loop",
+        "max_size",
+        "policy",
+        "pool",
+        "_lock",
+        "_queue",
+        "_draining",
+        "_space",
+        "_waiting",
+        "_on_close",
+        "_failed",
+        "_spill_writer",
+        "_spill_reader",
+        "_spill_pending",
+        "encoded_frames",
+        "dropped_frames",
+        "spilled_frames",
+        "last_encode_latency",
+        "avg_encode_latency",
+        "max_encode_latency",
+    )
+
+    def __init__(
+        self,
+        encode: Callable,
+        loop: asyncio.AbstractEventLoop,
+        max_size: int | None = None,
+        policy: str | None = None,
+    ):
+        if max_size is None:
+            max_size = int(os.getenv("ENCODER_QUEUE_SIZE") or 50)
+        if policy is None:
+            policy = os.getenv("ENCODER_OVERFLOW_POLICY") or OVERFLOW_BLOCK
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown encoder overflow policy: {policy}")
+
+        self.encode = encode
+        self.loop = loop
+        self.max_size = max(1, max_size)
+        self.policy = policy
+        self.pool = EncoderPool()
+
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._draining = False
+        self._space = asyncio.Event()
+        self._waiting = False
+        self._on_close = None
+        self._failed = None
+
+        self._spill_writer = None
+        self._spill_reader = None
+        self._spill_pending = 0
+
+        self.encoded_frames = 0
+        self.dropped_frames = 0
+        self.spilled_frames = 0
+        self.last_encode_latency = 0.0
+        self.avg_encode_latency = 0.0
+        self.max_encode_latency = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        """Frames waiting to be encoded, including spilled ones."""
+        return len(self._queue) + self._spill_pending
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "encoded_frames": self.encoded_frames,
+            "dropped_frames": self.dropped_frames,
+            "spilled_frames": self.spilled_frames,
+            "encode_latency_ms": {
+                "last": round(self.last_encode_latency * 1000, 3),
+                "avg": round(self.avg_encode_latency * 1000, 3),
+                "max": round(self.max_encode_latency * 1000, 3),
+            },
+            "overflow_policy": self.policy,
+        }
+
+    async def put(self, frame: av.AudioFrame):
+        """
+        Queue a frame for encoding, applying the overflow policy when full.
+        """
+        if self._failed:
+            raise self._failed
+
+        while True:
+            with self._lock:
+                if self._spill_pending or len(self._queue) >= self.max_size:
+                    if self.policy == OVERFLOW_SPILL:
+                        self._spill(frame)
+                        break
+                    if self.policy == OVERFLOW_DROP_OLDEST:
+                        self._queue.popleft()
+                        self.dropped_frames += 1
+                        self._queue.append(frame)
+                        break
+                    self._waiting = True
+                    self._space.clear()
+                else:
+                    self._queue.append(frame)
+                    break
+            await self._space.wait()
+
+        self._schedule()
+
+    async def close(self, finish: Callable | None = None):
+        """
+        Wait for every queued frame to be encoded, then run `finish` on the
+        encoder pool (used to flush the encoder and close the container).
+        """
+        future = self.loop.create_future()
+        with self._lock:
+            self._on_close = (finish, future)
+        self._schedule()
+        await future
+
+    def _schedule(self):
+        with self._lock:
+            if self._draining:
+                return
+            self._draining = True
+        self.pool.submit(self._drain)
+
+    def _next(self):
+        """Pop the next frame in order: memory queue first, then the spill file."""
+        with self._lock:
+            if self._queue:
+                frame = self._queue.popleft()
+                if self._waiting:
+                    self._waiting = False
+                    self.loop.call_soon_threadsafe(self._space.set)
+                return frame
+            if not self._spill_pending:
+                self._draining = False
+                if self._spill_writer:
+                    self._spill_writer.seek(0)
+                    self._spill_writer.truncate()
+                    self._spill_reader.seek(0)
+                return None
+            self._spill_pending -= 1
+
+        # Only the draining thread reads the spill file, so this can happen outside the lock
+        return self._unspill()
+
+    def _drain(self):
+        while True:
+            frame = self._next()
+            if frame is None:
+                break
+
+            started = time.perf_counter()
+            try:
+                self.encode(frame)
+            except Exception as e:
+                logger.error(f"Error encoding frame: {e}")
+                self._failed = e
+            latency = time.perf_counter() - started
+            ENCODE_LATENCY.observe(latency)
+
+            self.encoded_frames += 1
+            self.last_encode_latency = latency
+            self.avg_encode_latency += (latency - self.avg_encode_latency) * 0.05
+            if latency > self.max_encode_latency:
+                self.max_encode_latency = latency
+
+        with self._lock:
+            on_close = self._on_close
+            # Another drain started since `_next` gave up: it finishes once it is done
+            if on_close is None or self._queue or self._spill_pending or self._draining:
+                return
+            self._on_close = None
+
+        finish, future = on_close
+        error = None
+        try:
+            if finish:
+                finish()
+        except Exception as e:
+            logger.error(f"Error finishing encode pipeline: {e}")
+            error = e
+        finally:
+            self._close_spill()
+
+        self.loop.call_soon_threadsafe(self._resolve, future, error)
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, error):
+        if future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+    def _spill(self, frame):
+        """Append a frame to the spill file. Called with the lock held."""
+        if self._spill_writer is None:
+            spill_dir = os.getenv("ENCODER_SPILL_DIR") or tempfile.gettempdir()
+            os.makedirs(spill_dir, exist_ok=True)
+            fd, path = tempfile.mkstemp(prefix="chatot-spill-", dir=spill_dir)
+            self._spill_writer = os.fdopen(fd, "wb")
+            self._spill_reader = open(path, "rb")
+            os.unlink(path)
+
+        if isinstance(frame, av.AudioFrame):
+            record = (
+                frame.to_ndarray(),
+                frame.format.name,
+                frame.layout.name,
+                frame.sample_rate,
+                frame.pts,
+                frame.time_base,
+            )
+        else:
+            # Already encoded items (e.g. passthrough packets) are spilled as they are
+            record = frame
+        pickle.dump((isinstance(frame, av.AudioFrame), record), self._spill_writer)
+        self._spill_writer.flush()
+        self._spill_pending += 1
+        self.spilled_frames += 1
+
+    def _unspill(self):
+        """Read the next spilled frame back."""
+        is_frame, record = pickle.load(self._spill_reader)
+        if not is_frame:
+            return record
+
+        array, format, layout, sample_rate, pts, time_base = record
+        frame = av.AudioFrame.from_ndarray(array, format=format, layout=layout)
+        frame.sample_rate = sample_rate
+        frame.pts = pts
+        frame.time_base = time_base
+        return frame
+
+    def _close_spill(self):
+        with self._lock:
+            for spill_file in (self._spill_writer, self._spill_reader):
+                if spill_file:
+                    spill_file.close()
+            self._spill_writer = None
+            self._spill_reader = None
+            self._spill_pending = 0
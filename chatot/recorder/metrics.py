@@ -0,0 +1,122 @@
+"""
+Per-track recorder metrics.
+
+Recorders count received frames and the time spent waiting for them on plain
+attributes. The live recorders are turned into labelled samples only when
+`/metrics` is scraped, so the frame loop does no extra bookkeeping.
+"""
+
+import threading
+
+from chatot.utils.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+TRACK_LABELS = ("room", "peer", "track")
+
+# WebRTC Opus frames carry 20 ms of audio
+FRAME_SECONDS = 0.02
+
+RECV_WAIT = Histogram(
+    "chatot_track_recv_wait_seconds",
+    "Time spent waiting for the next frame from a track.",
+    buckets=(0.001, 0.005, 0.01, 0.02, 0.04, 0.1, 0.25, 1.0, 5.0),
+)
+
+_live_recorders = set()
+_lock = threading.Lock()
+
+
+def track_labels(room: str = "", peer: str = "", track: str = "") -> dict:
+    return {"room": room, "peer": peer, "track": track}
+
+
+def recorder_started(recorder):
+    with _lock:
+        _live_recorders.add(recorder)
+
+
+def recorder_stopped(recorder):
+    with _lock:
+        _live_recorders.discard(recorder)
+
+
+def live_recorders() -> int:
+    """Number of tracks being recorded."""
+    with _lock:
+        return len(_live_recorders)
+
+
+def recorders() -> list:
+    """The recorders of every live track."""
+    with _lock:
+        return list(_live_recorders)
+
+
+def encoder_lag() -> float:
+    """Seconds of audio waiting for the encoder on the most backed up track."""
+    with _lock:
+        recorders = list(_live_recorders)
+    return (
+        max((recorder.queue_depth for recorder in recorders), default=0) * FRAME_SECONDS
+    )
+
+
+def collect():
+    with _lock:
+        recorders = list(_live_recorders)
+
+    consumers = Gauge(
+        "chatot_active_consumers", "Tracks currently being recorded.", register=False
+    )
+    consumers.set(len(recorders))
+    received = Counter(
+        "chatot_track_frames_received_total",
+        "Frames received from the track.",
+        TRACK_LABELS,
+        register=False,
+    )
+    encoded = Counter(
+        "chatot_track_frames_encoded_total",
+        "Frames encoded and written.",
+        TRACK_LABELS,
+        register=False,
+    )
+    dropped = Counter(
+        "chatot_track_frames_dropped_total",
+        "Frames dropped by the encoder overflow policy.",
+        TRACK_LABELS,
+        register=False,
+    )
+    skipped = Counter(
+        "chatot_track_frames_silence_skipped_total",
+        "Silent frames not encoded.",
+        TRACK_LABELS,
+        register=False,
+    )
+    waited = Counter(
+        "chatot_track_recv_wait_seconds_total",
+        "Time spent waiting for frames from the track.",
+        TRACK_LABELS,
+        register=False,
+    )
+    queued = Gauge(
+        "chatot_track_encoder_queue_depth",
+        "Frames received but not yet encoded.",
+        TRACK_LABELS,
+        register=False,
+    )
+
+    for recorder in recorders:
+        labels = recorder.labels
+        pipeline = recorder.pipeline
+        received.inc(recorder.frames_received, **labels)
+        waited.inc(recorder.recv_wait_seconds, **labels)
+        encoded.inc(pipeline.encoded_frames if pipeline else 0, **labels)
+        dropped.inc(pipeline.dropped_frames if pipeline else 0, **labels)
+        queued.set(recorder.queue_depth, **labels)
+        silence = getattr(recorder, "silence", None)
+        skipped.inc(silence.skipped_frames if silence else 0, **labels)
+
+    return [consumers, received, encoded, dropped, skipped, waited, queued]
+
+
+MetricsRegistry().add_collector(collect)
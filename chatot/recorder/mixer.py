@@ -0,0 +1,386 @@
+"""
+Room mix: one recording of everybody in a room, next to the per-peer recordings.
+
+With mixing enabled (`/start?mix=true` or `ROOM_MIX=true`), every
+`WebRTCMediaRecorder` of the room also hands its received frames to a
+`MixerInput` of the room's `RoomMixer`, before silence processing. The mixer
+adds them into one float32 buffer on a fixed time grid (48 kHz, `ROOM_MIX_LAYOUT`,
+mono by default). `RoomMixer.track` reads the mix back in 20 ms frames, clipped
+to 16 bits, and is recorded and uploaded like any consumer's track.
+
+Placement: the first frame of an input is placed where the mix is at the moment
+it arrives, so peers joining mid-mix line up with the others. Later frames are
+placed by their PTS relative to that one, so gaps from packet loss or muting stay
+gaps. An input whose PTS drift more than `RESYNC_SECONDS` from its arrival times
+(a restarted sender, a clock jump) is placed by arrival again.
+
+Jitter: the mix is read `ROOM_MIX_JITTER` seconds (0.2 by default) behind real
+time, so frames arriving up to that late are still mixed in. Later frames are
+dropped from the mix, and counted.
+
+Everything runs on the room's event loop, inputs and the mix track alike.
+"""
+
+import asyncio
+import math
+import os
+import time
+import uuid
+from fractions import Fraction
+
+import av
+import numpy as np
+from aiortc.mediastreams import MediaStreamError
+
+from chatot.log import base_logger
+
+logger = base_logger.getChild(__name__)
+
+MIX_SAMPLE_RATE = 48000
+MIX_FRAME_SAMPLES = 960
+MIX_LAYOUTS = ("mono", "stereo")
+# Inputs whose PTS disagree with their arrival by more than this are placed again
+RESYNC_SECONDS = 1.0
+
+INT16_SCALE = 32768.0
+INT16_FORMATS = ("s16", "s16p")
+FLOAT_FORMATS = ("flt", "fltp")
+
+
+class MixerInput:
+    """
+    One track's contribution to the mix, fed by its recorder.
+
+    Args:
+        mixer: The room's mixer.
+        peer_id: The peer, for per-peer gain.
+        track_id: The consumer id.
+        gain: Linear gain applied to the track.
+    """
+
+    __slots__ = (
+        "mixer",
+        "peer_id",
+        "track_id",
+        "gain",
+        "closed",
+        "frames",
+        "late_samples",
+        "_anchor_pts",
+        "_anchor_position",
+        "_next_position",
+        "_resampler",
+        "_mapping",
+        "_mapping_key",
+    )
+
+    def __init__(
+        self, mixer: "RoomMixer", peer_id: str, track_id: str, gain: float = 1.0
+    ):
+        self.mixer = mixer
+        self.peer_id = peer_id
+        self.track_id = track_id
+        self.gain = gain
+        self.closed = False
+        self.frames = 0
+        self.late_samples = 0
+        self._anchor_pts = None
+        self._anchor_position = None
+        self._next_position = None
+        self._resampler = None
+        self._mapping = None
+        self._mapping_key = None
+
+    def _channel_mapping(self, channels: int, scale: float) -> np.ndarray:
+        """
+        (channels, mix channels) matrix taking a frame's samples to the mix, with the
+        gain and sample scale folded in. Downmixing averages the channels.
+        """
+        key = (channels, scale)
+        if key != self._mapping_key:
+            if channels == self.mixer.channels:
+                self._mapping = np.eye(channels, dtype=np.float32) * scale
+            else:
+                self._mapping = np.full(
+                    (channels, self.mixer.channels), scale / channels, dtype=np.float32
+                )
+            self._mapping_key = key
+        return self._mapping
+
+    def _samples(self, frame: av.AudioFrame) -> np.ndarray:
+        """The frame as float32 (samples, mix channels) in 16-bit scale at the mix rate, with the gain applied."""
+        mixer = self.mixer
+        name = frame.format.name
+        if frame.sample_rate == MIX_SAMPLE_RATE and (
+            name in INT16_FORMATS or name in FLOAT_FORMATS
+        ):
+            data = frame.to_ndarray()
+            channels = frame.layout.nb_channels
+            # Packed formats come as (1, samples * channels), planar ones as (channels, samples)
+            data = data.reshape(-1, channels) if not frame.format.is_planar else data.T
+            scale = self.gain if name in INT16_FORMATS else self.gain * INT16_SCALE
+            if channels == mixer.channels and scale == 1.0:
+                return data.astype(np.float32)
+            # One matrix product converts, downmixes and applies the gain
+            return data.astype(np.float32, copy=False) @ self._channel_mapping(
+                channels, scale
+            )
+
+        if self._resampler is None:
+            self._resampler = av.AudioResampler(
+                format="flt", layout=mixer.layout, rate=MIX_SAMPLE_RATE
+            )
+        converted = [
+            output.to_ndarray().reshape(-1, mixer.channels)
+            for output in self._resampler.resample(frame)
+        ]
+        if not converted:
+            return np.empty((0, mixer.channels), dtype=np.float32)
+        return np.concatenate(converted) * (self.gain * INT16_SCALE)
+
+    def _place(self, frame: av.AudioFrame, samples: int) -> int:
+        """Position of the frame's first sample on the mix timeline."""
+        arrival = self.mixer.clock() - samples
+        if frame.pts is None or frame.time_base is None:
+            position = (
+                self._next_position if self._next_position is not None else arrival
+            )
+        else:
+            position = None
+            if self._anchor_pts is not None:
+                position = self._anchor_position + round(
+                    (frame.pts - self._anchor_pts) * frame.time_base * MIX_SAMPLE_RATE
+                )
+            if (
+                position is None
+                or abs(position - arrival) > RESYNC_SECONDS * MIX_SAMPLE_RATE
+            ):
+                self._anchor_pts = frame.pts
+                self._anchor_position = position = arrival
+        self._next_position = position + samples
+        return position
+
+    def write(self, frame: av.AudioFrame):
+        """Add a received frame to the mix."""
+        if self.closed:
+            return
+        samples = self._samples(frame)
+        if not len(samples):
+            return
+        self.frames += 1
+        self.late_samples += self.mixer._add(self._place(frame, len(samples)), samples)
+
+    def close(self):
+        """The track ended, the mix goes on without it."""
+        if not self.closed:
+            self.closed = True
+            self.mixer._remove(self)
+
+
+class MixedTrack:
+    """
+    The mix as a track for `WebRTCMediaRecorder`: s16 frames of 20 ms, paced by
+    the mixer's clock and `jitter` behind it.
+    """
+
+    kind = "audio"
+
+    def __init__(self, mixer: "RoomMixer"):
+        self.mixer = mixer
+        self.id = f"mix-{uuid.uuid4().hex[:8]}"
+        # Frames are read this long after the audio in them was received
+        self.latency = mixer.jitter
+
+    @property
+    def readyState(self) -> str:
+        return "ended" if self.mixer.finished else "live"
+
+    async def recv(self) -> av.AudioFrame:
+        mixer = self.mixer
+        if mixer.finished:
+            raise MediaStreamError
+        if not mixer.stopped:
+            delay = mixer.due(mixer.position + MIX_FRAME_SAMPLES) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return mixer._read()
+
+
+class RoomMixer:
+    """
+    Mixes every audio track of a room into one stream, see the module docstring.
+
+    Args:
+        layout: "mono" or "stereo" (ROOM_MIX_LAYOUT if None, mono by default).
+        jitter: Seconds the mix trails real time (ROOM_MIX_JITTER if None, 0.2 by default).
+        gains: Linear gain by peer id, 1 for peers not listed.
+        labels: Metric labels ("room") of the room.
+
+    Raises:
+        ValueError: If the layout is not supported
+    """
+
+    __slots__ = (
+        "layout",
+        "channels",
+        "jitter",
+        "gains",
+        "labels",
+        "track",
+        "started",
+        "position",
+        "end",
+        "stopped",
+        "inputs",
+        "peers",
+        "frames",
+        "late_samples",
+        "clipped_frames",
+        "_buffer",
+        "_capacity",
+    )
+
+    def __init__(
+        self,
+        layout: str | None = None,
+        jitter: float | None = None,
+        gains: dict | None = None,
+        labels: dict | None = None,
+    ):
+        self.layout = layout or os.getenv("ROOM_MIX_LAYOUT") or "mono"
+        if self.layout not in MIX_LAYOUTS:
+            raise ValueError(f"Unsupported mix layout: {self.layout}")
+        self.channels = MIX_LAYOUTS.index(self.layout) + 1
+        self.jitter = (
+            jitter if jitter is not None else float(os.getenv("ROOM_MIX_JITTER") or 0.2)
+        )
+        self.gains = dict(gains or {})
+        self.labels = labels or {}
+        self.track = MixedTrack(self)
+        self.started = time.monotonic()
+        # Next sample the mix track reads, and the furthest sample written so far
+        self.position = 0
+        self.end = 0
+        self.stopped = False
+        self.inputs: list[MixerInput] = []
+        self.peers: set[str] = set()
+        self.frames = 0
+        self.late_samples = 0
+        self.clipped_frames = 0
+        # Room for the jitter window and inputs running ahead until they are placed again
+        frames = math.ceil(
+            (self.jitter + RESYNC_SECONDS + 1.0) * MIX_SAMPLE_RATE / MIX_FRAME_SAMPLES
+        )
+        self._capacity = frames * MIX_FRAME_SAMPLES
+        self._buffer = np.zeros((self._capacity, self.channels), dtype=np.float32)
+
+    @property
+    def finished(self) -> bool:
+        """Stopped, and everything written was read."""
+        return self.stopped and self.position >= self.end
+
+    def clock(self) -> int:
+        """The mix timeline position of now, in samples."""
+        return round((time.monotonic() - self.started) * MIX_SAMPLE_RATE)
+
+    def due(self, position: int) -> float:
+        """Monotonic time the mix up to `position` is read at."""
+        return self.started + position / MIX_SAMPLE_RATE + self.jitter
+
+    def add_input(self, peer_id: str, track_id: str) -> MixerInput:
+        """A track to mix in, until its `close`."""
+        mix_input = MixerInput(
+            self, peer_id, track_id, gain=self.gains.get(peer_id, 1.0)
+        )
+        self.inputs.append(mix_input)
+        self.peers.add(peer_id)
+        logger.info(
+            f"Mixing track {track_id} of peer {peer_id} ({len(self.inputs)} inputs)"
+        )
+        return mix_input
+
+    def set_gain(self, peer_id: str, gain: float):
+        """Change a peer's gain, for its current and later tracks."""
+        self.gains[peer_id] = gain
+        for mix_input in self.inputs:
+            if mix_input.peer_id == peer_id:
+                mix_input.gain = gain
+
+    def _remove(self, mix_input: MixerInput):
+        if mix_input in self.inputs:
+            self.inputs.remove(mix_input)
+        self.frames += mix_input.frames
+        self.late_samples += mix_input.late_samples
+
+    def _add(self, position: int, samples: np.ndarray) -> int:
+        """Add samples starting at `position` and return how many were too late or too early."""
+        count = len(samples)
+        skipped = 0
+        if position < self.position:
+            late = min(count, self.position - position)
+            samples = samples[late:]
+            position += late
+            skipped += late
+        overflow = position + len(samples) - (self.position + self._capacity)
+        if overflow > 0:
+            samples = samples[: max(0, len(samples) - overflow)]
+            skipped += min(count - skipped, overflow)
+        if not len(samples):
+            return skipped
+
+        offset = position % self._capacity
+        first = min(len(samples), self._capacity - offset)
+        self._buffer[offset : offset + first] += samples[:first]
+        if first < len(samples):
+            self._buffer[: len(samples) - first] += samples[first:]
+        self.end = max(self.end, position + len(samples))
+        return skipped
+
+    def _read(self) -> av.AudioFrame:
+        """The next 20 ms of the mix. The capacity is a whole number of frames, so it never wraps."""
+        offset = self.position % self._capacity
+        block = self._buffer[offset : offset + MIX_FRAME_SAMPLES]
+        if (
+            block.max(initial=0.0) >= INT16_SCALE
+            or block.min(initial=0.0) < -INT16_SCALE
+        ):
+            self.clipped_frames += 1
+            np.clip(block, -INT16_SCALE, INT16_SCALE - 1, out=block)
+        samples = block.astype(np.int16).reshape(1, -1)
+        block.fill(0.0)
+
+        frame = av.AudioFrame.from_ndarray(samples, format="s16", layout=self.layout)
+        frame.sample_rate = MIX_SAMPLE_RATE
+        frame.time_base = Fraction(1, MIX_SAMPLE_RATE)
+        frame.pts = self.position
+        self.position += MIX_FRAME_SAMPLES
+        return frame
+
+    def stop(self):
+        """
+        Stop mixing. The track returns what was already mixed without waiting
+        for the jitter window, then ends.
+        """
+        if self.stopped:
+            return
+        self.stopped = True
+        for mix_input in list(self.inputs):
+            mix_input.close()
+
+    def stats(self) -> dict:
+        """Inputs, peers, frames mixed, audio dropped for arriving too late and clipped frames."""
+        return {
+            "inputs": len(self.inputs),
+            "peers": sorted(self.peers),
+            "frames": self.frames + sum(mix_input.frames for mix_input in self.inputs),
+            "late_seconds": round(
+                (
+                    self.late_samples
+                    + sum(mix_input.late_samples for mix_input in self.inputs)
+                )
+                / MIX_SAMPLE_RATE,
+                3,
+            ),
+            "clipped_frames": self.clipped_frames,
+            "duration": round(self.position / MIX_SAMPLE_RATE, 3),
+        }
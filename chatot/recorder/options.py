@@ -0,0 +1,148 @@
+import os
+from dataclasses import dataclass, field
+from typing import Mapping
+
+from .profiles import RecordingProfile
+
+RECORDING_MODE_TRANSCODE = "transcode"
+RECORDING_MODE_OPUS = "opus"
+RECORDING_MODES = (RECORDING_MODE_TRANSCODE, RECORDING_MODE_OPUS)
+
+# Silence policies, see `chatot.recorder.silence`. Defined here so parsing options
+# does not import PyAV.
+SILENCE_ENCODE = "encode"
+SILENCE_GAP = "gap"
+SILENCE_TRIM = "trim"
+SILENCE_POLICIES = (SILENCE_ENCODE, SILENCE_GAP, SILENCE_TRIM)
+
+# Consumer pause policies, see `chatot.huddle.activity`
+PAUSE_OFF = "off"
+PAUSE_MUTED = "muted"
+PAUSE_INACTIVE = "inactive"
+PAUSE_POLICIES = (PAUSE_OFF, PAUSE_MUTED, PAUSE_INACTIVE)
+
+
+@dataclass
+class RecordingOptions:
+    """
+    Per-room recording settings, taken from `/start` query params with environment defaults.
+
+    Attributes:
+        mode: "transcode" decodes the received Opus and re-encodes it with the profile,
+              "opus" writes the received Opus packets straight into a container.
+        profile: Codec, sample rate, channels and bitrate used in "transcode" mode.
+        segment_duration: Rotate "transcode" recordings every this many seconds, None to disable.
+        segment_size: Rotate "transcode" recordings every this many bytes, None to disable.
+        segment_webhooks: Send a webhook for every uploaded segment.
+        silence_policy: What "transcode" mode does with silent frames, see `chatot.recorder.silence`.
+        tap: Publish each track's received PCM to a live tap in "transcode" mode, see `chatot.recorder.tap`.
+        mix: Also record one mix of every "transcode" track of the room, see `chatot.recorder.mixer`.
+        mix_gains: Linear gain of peers in the mix, by peer id. Other peers have gain 1.
+        manifest: Upload a manifest of the room's tracks and their timing once it is left,
+                  see `chatot.utils.manifest`.
+        consolidate: Keep one recording per peer across its consumers, see `chatot.recorder.peer`.
+        pause_policy: When consumers of muted or silent peers are paused, see `chatot.huddle.activity`.
+    """
+
+    mode: str = RECORDING_MODE_TRANSCODE
+    profile: RecordingProfile = field(default_factory=RecordingProfile)
+    segment_duration: float | None = None
+    segment_size: int | None = None
+    segment_webhooks: bool = False
+    silence_policy: str = SILENCE_ENCODE
+    tap: bool = False
+    mix: bool = False
+    mix_gains: dict[str, float] = field(default_factory=dict)
+    manifest: bool = True
+    consolidate: bool = True
+    pause_policy: str = PAUSE_OFF
+
+    @property
+    def segmented(self) -> bool:
+        return self.mode == RECORDING_MODE_TRANSCODE and bool(
+            self.segment_duration or self.segment_size
+        )
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "RecordingOptions":
+        """
+        Build options from request query params, falling back to the environment.
+
+        Raises:
+            ValueError: If a param has an unsupported value
+        """
+        mode = (
+            args.get("recording_mode")
+            or os.getenv("RECORDING_MODE")
+            or RECORDING_MODE_TRANSCODE
+        )
+        if mode not in RECORDING_MODES:
+            raise ValueError(f"Unsupported recording_mode: {mode}")
+
+        try:
+            segment_duration = (
+                float(
+                    args.get("segment_seconds")
+                    or os.getenv("RECORDING_SEGMENT_SECONDS")
+                    or 0
+                )
+                or None
+            )
+            segment_size = (
+                int(
+                    args.get("segment_bytes")
+                    or os.getenv("RECORDING_SEGMENT_BYTES")
+                    or 0
+                )
+                or None
+            )
+        except ValueError:
+            raise ValueError("segment_seconds and segment_bytes must be numbers")
+
+        silence_policy = (
+            args.get("silence") or os.getenv("SILENCE_POLICY") or SILENCE_ENCODE
+        )
+        if silence_policy not in SILENCE_POLICIES:
+            raise ValueError(f"Unsupported silence policy: {silence_policy}")
+
+        pause_policy = args.get("pause") or os.getenv("CONSUMER_PAUSE") or PAUSE_OFF
+        if pause_policy not in PAUSE_POLICIES:
+            raise ValueError(f"Unsupported pause policy: {pause_policy}")
+
+        segment_webhooks = (
+            args.get("segment_webhooks") or os.getenv("SEGMENT_WEBHOOKS") or ""
+        ).lower() == "true"
+        tap = (args.get("tap") or os.getenv("PCM_TAP") or "").lower() == "true"
+        mix = (args.get("mix") or os.getenv("ROOM_MIX") or "").lower() == "true"
+        manifest = (
+            args.get("manifest") or os.getenv("ROOM_MANIFEST") or "true"
+        ).lower() == "true"
+        consolidate = (
+            args.get("consolidate") or os.getenv("PEER_CONSOLIDATION") or "true"
+        ).lower() == "true"
+
+        # "peer-a:0.5,peer-b:1.5"
+        mix_gains = {}
+        for entry in filter(None, (args.get("mix_gains") or "").split(",")):
+            peer_id, _, gain = entry.rpartition(":")
+            try:
+                mix_gains[peer_id] = float(gain)
+            except ValueError:
+                raise ValueError(f"mix_gains entries must be peer:gain, got {entry}")
+            if not peer_id or mix_gains[peer_id] < 0:
+                raise ValueError(f"mix_gains entries must be peer:gain, got {entry}")
+
+        return cls(
+            mode=mode,
+            profile=RecordingProfile.from_args(args),
+            segment_duration=segment_duration,
+            segment_size=segment_size,
+            segment_webhooks=segment_webhooks,
+            silence_policy=silence_policy,
+            tap=tap,
+            mix=mix,
+            mix_gains=mix_gains,
+            manifest=manifest,
+            consolidate=consolidate,
+            pause_policy=pause_policy,
+        )
@@ -0,0 +1,320 @@
+import asyncio
+import fractions
+import os
+import time
+from dataclasses import dataclass
+
+import av
+from pyee import AsyncIOEventEmitter
+
+from .encoder import EncodePipeline
+from .metrics import RECV_WAIT, recorder_started, recorder_stopped, track_labels
+from .silence import TIMESTAMPED_CONTAINERS
+from .timeline import TimestampRebaser, TrackTimeline
+
+from chatot.log import base_logger
+
+logger = base_logger.getChild(__name__)
+
+OPUS_TIME_BASE = fractions.Fraction(1, 48000)
+
+# Container used for passthrough recordings. WebM keeps gaps in the RTP timestamps,
+# Ogg gets them filled with silence packets
+PASSTHROUGH_CONTAINERS = ("ogg", "webm")
+# A 20 ms CELT frame that decodes to digital silence
+OPUS_SILENCE = b"\xf8\xff\xfe"
+OPUS_SILENCE_SAMPLES = 960
+
+
+def opus_packet_samples(data: bytes) -> int:
+    """
+    Number of 48 kHz samples in an Opus packet, read from its TOC byte (RFC 6716, 3.1).
+    """
+    if not data:
+        return 0
+
+    toc = data[0]
+    config = toc >> 3
+    if config < 12:
+        frame_samples = (480, 960, 1920, 2880)[config % 4]
+    elif config < 16:
+        frame_samples = (480, 960)[config % 2]
+    else:
+        frame_samples = (120, 240, 480, 960)[config % 4]
+
+    code = toc & 0x03
+    if code == 0:
+        frames = 1
+    elif code in (1, 2):
+        frames = 2
+    else:
+        frames = data[1] & 0x3F if len(data) > 1 else 0
+
+    return frame_samples * frames
+
+
+@dataclass(slots=True)
+class OpusSilence:
+    """Queued for a gap in the timeline: `packets` packets of `OPUS_SILENCE` from `pts` on."""
+
+    pts: int
+    packets: int
+
+
+class EncodedFrameTap:
+    """
+    Stands in for the decoder queue of an aiortc `RTCRtpReceiver`.
+
+    The receiver puts `(codec, encoded_frame)` for every complete frame that
+    leaves its jitter buffer, with the RTP timestamp already unwrapped and starting
+    at 0 (aiortc's `TimestampMapper`). The tap hands those to the recorder instead, so
+    the decoder thread never sees them. The `None` sentinel that stops the
+    receiver is still forwarded so the decoder thread and track end normally.
+    """
+
+    def __init__(self, decoder_queue, on_frame, on_end):
+        self.decoder_queue = decoder_queue
+        self.on_frame = on_frame
+        self.on_end = on_end
+
+    def put(self, item):
+        if item is None:
+            self.decoder_queue.put(None)
+            self.on_end()
+            return
+
+        _, encoded_frame = item
+        self.on_frame(encoded_frame.data, encoded_frame.timestamp)
+
+
+class OpusPassthroughRecorder(AsyncIOEventEmitter):
+    """
+    Records the Opus payloads of an RTCRtpReceiver into an Ogg or WebM file without decoding them.
+
+    Emits "completed" once the container is closed, like `WebRTCMediaRecorder`.
+    `timeline` records the gaps in the RTP timestamps. WebM keeps them as they are;
+    Ogg would move them to the head of the stream, so they are filled with silence packets.
+
+    With `hold`, the recording outlives its receiver: `attach` hands it the receiver
+    of the peer's next consumer, and only `stop` ends it, see `chatot.recorder.peer`.
+    """
+
+    def __init__(
+        self,
+        receiver,
+        output_path: str,
+        loop=None,
+        format: str = "ogg",
+        output_file=None,
+        labels: dict | None = None,
+        hold: bool = False,
+    ):
+        """
+        Args:
+            receiver: The aiortc RTCRtpReceiver of the audio consumer.
+            output_path: Path where the recorded file will be saved.
+            format: "ogg" or "webm".
+            output_file: Writable file object to mux into instead of output_path.
+            labels: Metric labels ("room", "peer", "track") of this recording.
+            hold: Keep recording once the receiver stops, until `stop`.
+        """
+        if format not in PASSTHROUGH_CONTAINERS:
+            raise ValueError(f"Unsupported passthrough container: {format}")
+
+        self.receiver = receiver
+        self.output_path = output_path
+        self.output_file = output_file
+        self.format = format
+        self.labels = track_labels(**(labels or {}))
+        self.hold = hold
+        self.fill_gaps = format not in TIMESTAMPED_CONTAINERS
+        self.frames_received = 0
+        self.recv_wait_seconds = 0.0
+        self.recording = False
+        # Epoch times of `stop()` and of flushing the encoder, for latency tracing
+        self.stopped_at = None
+        self.flush_timing = None
+        self.task = None
+        self.container = None
+        self.stream = None
+        self.pipeline = None
+        self.packets = None
+        self.last_pts = None
+        self.timeline = TrackTimeline()
+        self.rebaser = TimestampRebaser()
+        self._tap = None
+        self._original_queue = None
+        # Bumped by `attach`, packets of replaced receivers are dropped
+        self._generation = 0
+        super(OpusPassthroughRecorder, self).__init__(loop=loop)
+
+    @property
+    def queue_depth(self) -> int:
+        return self.pipeline.queue_depth if self.pipeline else 0
+
+    def stats(self) -> dict:
+        return self.pipeline.stats() if self.pipeline else {}
+
+    @property
+    def sources(self) -> int:
+        """Receivers that delivered audio so far."""
+        return self.rebaser.sources
+
+    async def start(self):
+        """Start recording, taking over the receiver's decoder queue."""
+        if self.recording:
+            return
+
+        self.packets = asyncio.Queue()
+        self._take_over(self.receiver)
+
+        self.recording = True
+        recorder_started(self)
+        self.task = asyncio.create_task(self._record())
+
+    def attach(self, receiver):
+        """Record `receiver` from now on, in place of the current one."""
+        self._release()
+        self._generation += 1
+        self.rebaser.new_source()
+        self.receiver = receiver
+        self._take_over(receiver)
+
+    def _take_over(self, receiver):
+        queue_attr = "_RTCRtpReceiver__decoder_queue"
+        original_queue = getattr(receiver, queue_attr, None)
+        if original_queue is None:
+            raise Exception("RTCRtpReceiver has no decoder queue to tap")
+
+        loop = asyncio.get_running_loop()
+        generation = self._generation
+
+        def on_frame(data, timestamp):
+            loop.call_soon_threadsafe(
+                self.packets.put_nowait, (data, timestamp, generation)
+            )
+
+        def on_end():
+            loop.call_soon_threadsafe(self.packets.put_nowait, (None, None, generation))
+
+        self._original_queue = original_queue
+        self._tap = EncodedFrameTap(original_queue, on_frame, on_end)
+        setattr(receiver, queue_attr, self._tap)
+
+    def _release(self):
+        """Give the receiver its decoder queue back."""
+        if self._tap is not None:
+            setattr(
+                self.receiver, "_RTCRtpReceiver__decoder_queue", self._original_queue
+            )
+            self._tap = None
+
+    async def stop(self):
+        """Stop recording and close the container."""
+        if not self.recording:
+            return
+
+        self.recording = False
+        self.stopped_at = time.time()
+        recorder_stopped(self)
+
+        self._release()
+
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+        self.task = None
+
+        flush_started = time.time()
+        if self.pipeline:
+            try:
+                await self.pipeline.close(finish=self._finish)
+            except Exception as e:
+                logger.error(f"Error closing passthrough recording: {e}")
+        elif self.container:
+            self._finish()
+        self.flush_timing = (flush_started, time.time())
+
+        self.emit("completed")
+        logger.info("✅ Passthrough recorder stopped")
+
+    def _mux(self, item):
+        """Mux one Opus payload, or the silence packets of a gap. Runs on the encoder pool."""
+        if isinstance(item, OpusSilence):
+            for index in range(item.packets):
+                self._write(OPUS_SILENCE, item.pts + index * OPUS_SILENCE_SAMPLES)
+            return
+        self._write(*item)
+
+    def _write(self, data: bytes, timestamp: int):
+        """Wrap one Opus payload in a packet and mux it."""
+        # Jitter buffer output is ordered, anything at or before the last pts is a duplicate
+        if self.last_pts is not None and timestamp <= self.last_pts:
+            return
+        self.last_pts = timestamp
+
+        packet = av.Packet(data)
+        packet.stream = self.stream
+        packet.time_base = OPUS_TIME_BASE
+        packet.pts = timestamp
+        packet.dts = timestamp
+        packet.duration = opus_packet_samples(data)
+        self.container.mux(packet)
+
+    def _finish(self):
+        if self.container:
+            self.container.close()
+        self.container = None
+        self.stream = None
+
+    async def _record(self):
+        try:
+            output_dir = os.path.dirname(self.output_path)
+            if output_dir and self.output_file is None:
+                os.makedirs(output_dir, exist_ok=True)
+
+            self.container = av.open(
+                self.output_file or self.output_path, mode="w", format=self.format
+            )
+            # The stream is only used for its codec parameters, the libopus encoder
+            # fills in the OpusHead extradata but never encodes anything
+            self.stream = self.container.add_stream(
+                "libopus", rate=48000, layout="stereo"
+            )
+            self.stream.time_base = OPUS_TIME_BASE
+
+            self.pipeline = EncodePipeline(
+                encode=self._mux, loop=asyncio.get_running_loop()
+            )
+
+            while self.recording:
+                started = time.perf_counter()
+                data, timestamp, generation = await self.packets.get()
+                waited = time.perf_counter() - started
+                self.recv_wait_seconds += waited
+                RECV_WAIT.observe(waited)
+                if generation != self._generation:
+                    continue
+                if data is None:
+                    if self.hold:
+                        logger.info(
+                            "Receiver stopped, waiting for the peer's next consumer..."
+                        )
+                        continue
+                    logger.warn("Receiver stopped, exiting passthrough recording...")
+                    break
+                self.frames_received += 1
+                samples = opus_packet_samples(data)
+                timestamp = self.rebaser.rebase(
+                    timestamp, samples, 48000, OPUS_TIME_BASE
+                )
+                gap = self.timeline.observe(timestamp, samples, 48000, OPUS_TIME_BASE)
+                if gap and self.fill_gaps:
+                    await self.pipeline.put(
+                        OpusSilence(timestamp - gap, round(gap / OPUS_SILENCE_SAMPLES))
+                    )
+                await self.pipeline.put((data, timestamp))
+
+        except asyncio.CancelledError:
+            logger.info("Received Closing Signal")
+        finally:
+            await self.stop()
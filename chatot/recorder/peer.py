@@ -0,0 +1,88 @@
+"""
+One recording per peer, however many consumers the peer goes through.
+
+A peer that reconnects or republishes its microphone gets a new consumer, and
+used to get a new recording with it. With consolidation (on by default,
+`consolidate=false` on `/start` or `PEER_CONSOLIDATION=false` to turn it off),
+the peer's first consumer starts a recording that lasts until the room is left,
+and later consumers are attached to it:
+
+    transcode   the recorder reads a `PeerTrack`, which relays frames from the
+                peer's current consumer track
+    opus        the `OpusPassthroughRecorder` takes over the new consumer's
+                receiver, see `OpusPassthroughRecorder.attach`
+
+Either way a `TimestampRebaser` moves each consumer's PTS after the previous
+one's, so the time the peer was away is a gap in the recording's timeline,
+filled like any other (see `chatot.recorder.timeline`).
+"""
+
+import asyncio
+import uuid
+
+import av
+from aiortc.mediastreams import MediaStreamError
+
+from .timeline import TimestampRebaser
+
+
+class PeerTrack:
+    """
+    The audio of one peer as a single track for `WebRTCMediaRecorder`, relayed from
+    whichever consumer track is attached. `recv` waits while none is, and the track
+    only ends with `stop`.
+    """
+
+    kind = "audio"
+
+    def __init__(self, track=None):
+        self.id = f"peer-{uuid.uuid4().hex[:8]}"
+        self.readyState = "live"
+        self.source = None
+        self.rebaser = TimestampRebaser()
+        self._attached = asyncio.Event()
+        if track is not None:
+            self.attach(track)
+
+    @property
+    def sources(self) -> int:
+        """Consumer tracks that delivered audio so far."""
+        return self.rebaser.sources
+
+    def attach(self, track):
+        """Relay `track` from now on, in place of the current one."""
+        self.source = track
+        self.rebaser.new_source()
+        self._attached.set()
+
+    def detach(self, track):
+        """Stop relaying `track`, if it is the current one."""
+        if self.source is track:
+            self.source = None
+            self._attached.clear()
+
+    def stop(self):
+        self.readyState = "ended"
+        self._attached.set()
+
+    async def recv(self) -> av.AudioFrame:
+        while True:
+            if self.readyState != "live":
+                raise MediaStreamError
+            source = self.source
+            if source is None:
+                await self._attached.wait()
+                continue
+            try:
+                frame = await source.recv()
+            except MediaStreamError:
+                self.detach(source)
+                continue
+            if source is not self.source:
+                # Replaced while this frame was on its way
+                continue
+            if frame.pts is not None and frame.time_base:
+                frame.pts = self.rebaser.rebase(
+                    frame.pts, frame.samples, frame.sample_rate, frame.time_base
+                )
+            return frame
@@ -0,0 +1,148 @@
+import os
+from dataclasses import dataclass, replace
+from typing import Mapping
+
+
+@dataclass(frozen=True)
+class CodecSpec:
+    """
+    How a profile codec maps onto PyAV.
+
+    Attributes:
+        encoder: PyAV/FFmpeg encoder name.
+        container: Container format passed to `av.open`.
+        extension: File extension of the recording.
+        sample_rates: Sample rates the encoder accepts, None for any.
+        lossless: Whether bitrate is ignored.
+    """
+
+    encoder: str
+    container: str
+    extension: str
+    sample_rates: tuple | None = None
+    lossless: bool = False
+
+
+CODECS = {
+    "mp3": CodecSpec(
+        "mp3",
+        "mp3",
+        "mp3",
+        sample_rates=(8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000),
+    ),
+    "opus": CodecSpec(
+        "libopus", "ogg", "ogg", sample_rates=(8000, 12000, 16000, 24000, 48000)
+    ),
+    "aac": CodecSpec(
+        "aac",
+        "adts",
+        "aac",
+        sample_rates=(8000, 11025, 12000, 16000, 22050, 24000, 32000, 44100, 48000),
+    ),
+    "flac": CodecSpec("flac", "flac", "flac", lossless=True),
+    "wav": CodecSpec("pcm_s16le", "wav", "wav", lossless=True),
+}
+
+
+@dataclass(frozen=True)
+class RecordingProfile:
+    """
+    Codec, sample rate, channel layout and bitrate used to encode a track.
+
+    Attributes:
+        codec: One of `CODECS`.
+        sample_rate: Output sample rate, None keeps the source rate (48 kHz for WebRTC).
+        channels: 1 downmixes to mono, 2 keeps stereo, None keeps the source layout.
+        bitrate: Target bitrate in bits per second, None uses the encoder default.
+    """
+
+    codec: str = "mp3"
+    sample_rate: int | None = None
+    channels: int | None = None
+    bitrate: int | None = None
+
+    @property
+    def spec(self) -> CodecSpec:
+        return CODECS[self.codec]
+
+    @property
+    def container_format(self) -> str:
+        return self.spec.container
+
+    @property
+    def extension(self) -> str:
+        return self.spec.extension
+
+    @property
+    def layout(self) -> str | None:
+        return {1: "mono", 2: "stereo"}.get(self.channels)
+
+    def validate(self) -> "RecordingProfile":
+        """
+        Raises:
+            ValueError: If the combination is not supported
+        """
+        if self.codec not in CODECS:
+            raise ValueError(f"Unsupported codec: {self.codec}")
+        if (
+            self.sample_rate is not None
+            and self.spec.sample_rates
+            and self.sample_rate not in self.spec.sample_rates
+        ):
+            raise ValueError(
+                f"Unsupported sample_rate {self.sample_rate} for {self.codec}"
+            )
+        if self.channels not in (None, 1, 2):
+            raise ValueError(f"Unsupported channels: {self.channels}")
+        if self.bitrate is not None and self.bitrate <= 0:
+            raise ValueError(f"Unsupported bitrate: {self.bitrate}")
+        return self
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "RecordingProfile":
+        """
+        Build a profile from `/start` query params, falling back to the environment.
+
+        A named `profile` (see `PROFILES`) is applied first, then `codec`,
+        `sample_rate`, `channels` and `bitrate` override individual fields.
+
+        Raises:
+            ValueError: If a param has an unsupported value
+        """
+
+        def param(name: str, env: str) -> str | None:
+            return args.get(name) or os.getenv(env) or None
+
+        name = param("profile", "RECORDING_PROFILE") or "default"
+        if name not in PROFILES:
+            raise ValueError(f"Unknown recording profile: {name}")
+        profile = PROFILES[name]
+
+        overrides = {}
+        codec = param("codec", "RECORDING_CODEC")
+        if codec:
+            overrides["codec"] = codec.lower()
+        try:
+            for field, env in (
+                ("sample_rate", "RECORDING_SAMPLE_RATE"),
+                ("channels", "RECORDING_CHANNELS"),
+                ("bitrate", "RECORDING_BITRATE"),
+            ):
+                value = param(field, env)
+                if value:
+                    overrides[field] = int(value)
+        except ValueError:
+            raise ValueError("sample_rate, channels and bitrate must be integers")
+
+        return replace(profile, **overrides).validate()
+
+
+PROFILES = {
+    "default": RecordingProfile(),
+    # 16 kHz mono for speech recognition, a fraction of the default's encode CPU and size
+    "asr": RecordingProfile(codec="opus", sample_rate=16000, channels=1, bitrate=24000),
+    "speech": RecordingProfile(
+        codec="mp3", sample_rate=22050, channels=1, bitrate=48000
+    ),
+    "lossless": RecordingProfile(codec="flac"),
+}
@@ -0,0 +1,366 @@
+"""
+Silence handling for `WebRTCMediaRecorder`.
+
+Frames are classified on the room's event loop, before they are queued for the
+encoder pool, from the RMS level of the frame's samples. A frame only counts as
+silent once the level has stayed under `SILENCE_THRESHOLD_DB` for
+`SILENCE_HANGOVER` seconds, so word endings and short pauses are kept as they are.
+
+Policy, applied to silent frames:
+    encode: every frame is encoded as received and no detection runs (default).
+    gap:    silent frames are not encoded. WebM, which keeps a PTS gap where it
+            is, gets a DTX-style gap in the timeline. The others get digital
+            silence, which encodes several times cheaper than a noise floor and
+            keeps the duration: Ogg has no gaps within a stream, a skipped
+            silence would move the audio before it later.
+    trim:   silences are shortened to `SILENCE_TRIM_KEEP` seconds of digital
+            silence and the audio after them moved earlier. `timestamp_map`
+            maps recording time back to source time.
+
+Gaps in a track's timestamps (packet loss, a paused producer, see
+`chatot.recorder.timeline`) are treated like silence by the same policy:
+`fill_gap` returns digital silence for them, or leaves them to the container's
+timestamps ("gap" policy), or trims them ("trim" policy).
+"""
+
+import math
+import os
+import time
+from dataclasses import dataclass
+from fractions import Fraction
+
+import av
+import numpy as np
+
+from .options import SILENCE_ENCODE, SILENCE_GAP, SILENCE_POLICIES, SILENCE_TRIM
+from .types import TimestampMapping
+
+# Containers that keep a gap in the PTS where it is, Ogg moves it to the head of the stream
+TIMESTAMPED_CONTAINERS = ("webm",)
+# Longest frame of digital silence `fill_gap` returns, longer gaps take several
+GAP_FILL_SECONDS = 1.0
+
+
+@dataclass(slots=True)
+class SilentFrame:
+    """
+    Queued instead of a silent frame that should be written as digital silence.
+    The zeroed frame is only built on the encoder pool, see `to_frame`.
+    """
+
+    format: str
+    layout: str
+    samples: int
+    sample_rate: int
+    pts: int | None
+    time_base: Fraction | None
+
+    @classmethod
+    def like(cls, frame: av.AudioFrame) -> "SilentFrame":
+        return cls(
+            frame.format.name,
+            frame.layout.name,
+            frame.samples,
+            frame.sample_rate,
+            frame.pts,
+            frame.time_base,
+        )
+
+    def to_frame(self, reuse: av.AudioFrame | None = None) -> av.AudioFrame:
+        """
+        The zeroed frame. `reuse`, a frame this returned before, is handed back with
+        new timestamps when it has the same shape: encoders copy or reference its
+        samples and never write to them, so one zeroed buffer serves a whole recording.
+        """
+        frame = reuse
+        if (
+            frame is None
+            or frame.format.name != self.format
+            or frame.layout.name != self.layout
+            or frame.samples != self.samples
+        ):
+            frame = av.AudioFrame(
+                format=self.format, layout=self.layout, samples=self.samples
+            )
+            for plane in frame.planes:
+                plane.update(bytes(plane.buffer_size))
+        frame.sample_rate = self.sample_rate
+        frame.pts = self.pts
+        frame.time_base = self.time_base
+        return frame
+
+
+class SilenceDetector:
+    """
+    Energy based voice activity detection with a hangover.
+
+    Args:
+        threshold_db: Level in dBFS under which a frame is quiet (SILENCE_THRESHOLD_DB, -50 if None).
+        hangover: Seconds a track has to stay quiet before frames count as silent (SILENCE_HANGOVER, 0.3 if None).
+    """
+
+    __slots__ = (
+        "threshold_db",
+        "hangover",
+        "_threshold_power",
+        "_quiet_for",
+        "_scratch",
+    )
+
+    def __init__(
+        self, threshold_db: float | None = None, hangover: float | None = None
+    ):
+        if threshold_db is None:
+            threshold_db = float(os.getenv("SILENCE_THRESHOLD_DB") or -50.0)
+        if hangover is None:
+            hangover = float(os.getenv("SILENCE_HANGOVER") or 0.3)
+
+        self.threshold_db = threshold_db
+        self.hangover = hangover
+        # Mean square of a full scale signal at the threshold, compared against without a sqrt
+        self._threshold_power = 10 ** (threshold_db / 10)
+        self._quiet_for = 0.0
+        # Float copy of the last frame's samples, reused so detection allocates nothing per frame
+        self._scratch = np.empty(0, dtype=np.float32)
+
+    def power(self, frame: av.AudioFrame) -> float:
+        """Mean square of the frame's samples, relative to full scale."""
+        if frame.format.name == "s16":
+            # Packed 16 bit is what aiortc's decoder produces, view the plane without a copy
+            samples = np.frombuffer(
+                frame.planes[0],
+                dtype=np.int16,
+                count=frame.samples * len(frame.layout.channels),
+            )
+        else:
+            samples = frame.to_ndarray().reshape(-1)
+        if samples.size == 0:
+            return 0.0
+        if samples.dtype.kind == "i":
+            scale = float(np.iinfo(samples.dtype).max)
+            if self._scratch.size < samples.size:
+                self._scratch = np.empty(samples.size, dtype=np.float32)
+            converted = self._scratch[: samples.size]
+            np.copyto(converted, samples, casting="unsafe")
+            samples = converted
+        else:
+            scale = 1.0
+        return float(np.dot(samples, samples)) / samples.size / (scale * scale)
+
+    def level_db(self, frame: av.AudioFrame) -> float:
+        power = self.power(frame)
+        return 10 * math.log10(power) if power > 0 else -math.inf
+
+    def is_silent(self, frame: av.AudioFrame) -> bool:
+        if self.power(frame) >= self._threshold_power:
+            self._quiet_for = 0.0
+            return False
+        self._quiet_for += frame.samples / frame.sample_rate
+        return self._quiet_for > self.hangover
+
+
+class SilenceFilter:
+    """
+    Applies a silence policy to one recorder's frames and keeps its savings counters.
+
+    Args:
+        policy: One of `SILENCE_POLICIES` (SILENCE_POLICY, "encode" if None).
+        timestamped: Whether the output container keeps PTS gaps.
+        detector: Classifier to use, a default `SilenceDetector` if None.
+        keep: Seconds of each silence kept by the "trim" policy (SILENCE_TRIM_KEEP, 0.5 if None).
+    """
+
+    __slots__ = (
+        "policy",
+        "timestamped",
+        "detector",
+        "keep",
+        "timestamp_map",
+        "_silent_for",
+        "_trimmed_pts",
+        "_trimming",
+        "frames",
+        "silent_frames",
+        "skipped_frames",
+        "zeroed_frames",
+        "trimmed_seconds",
+        "filled_seconds",
+        "detect_seconds",
+        "avg_speech_encode",
+        "avg_silence_encode",
+    )
+
+    def __init__(
+        self,
+        policy: str | None = None,
+        timestamped: bool = False,
+        detector: SilenceDetector | None = None,
+        keep: float | None = None,
+    ):
+        if policy is None:
+            policy = os.getenv("SILENCE_POLICY") or SILENCE_ENCODE
+        if policy not in SILENCE_POLICIES:
+            raise ValueError(f"Unknown silence policy: {policy}")
+        if keep is None:
+            keep = float(os.getenv("SILENCE_TRIM_KEEP") or 0.5)
+
+        self.policy = policy
+        self.timestamped = timestamped
+        self.detector = detector or SilenceDetector()
+        self.keep = keep
+        self.timestamp_map: list[TimestampMapping] = []
+
+        self._silent_for = 0.0
+        self._trimmed_pts = 0
+        self._trimming = False
+
+        self.frames = 0
+        self.silent_frames = 0
+        self.skipped_frames = 0
+        self.zeroed_frames = 0
+        self.trimmed_seconds = 0.0
+        self.filled_seconds = 0.0
+        self.detect_seconds = 0.0
+        self.avg_speech_encode = 0.0
+        self.avg_silence_encode = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.policy != SILENCE_ENCODE
+
+    def process(self, frame: av.AudioFrame) -> av.AudioFrame | SilentFrame | None:
+        """
+        Classify a frame and return what to queue for encoding: the frame itself,
+        a `SilentFrame` for digital silence, or None to skip it.
+        """
+        if not self.enabled:
+            return frame
+
+        started = time.perf_counter()
+        silent = self.detector.is_silent(frame)
+        self.detect_seconds += time.perf_counter() - started
+        self.frames += 1
+
+        if not silent:
+            self._silent_for = 0.0
+            return self._shift(frame)
+
+        self.silent_frames += 1
+        self._silent_for += frame.samples / frame.sample_rate
+
+        if self.policy == SILENCE_GAP:
+            if self.timestamped:
+                self.skipped_frames += 1
+                return None
+            self.zeroed_frames += 1
+            return SilentFrame.like(frame)
+
+        if self._silent_for > self.keep:
+            self.skipped_frames += 1
+            self.trimmed_seconds += frame.samples / frame.sample_rate
+            if frame.time_base:
+                self._trimmed_pts += int(
+                    frame.samples / frame.sample_rate / frame.time_base
+                )
+            self._trimming = True
+            return None
+
+        self.zeroed_frames += 1
+        return SilentFrame.like(self._shift(frame))
+
+    def fill_gap(self, frame: av.AudioFrame, gap: int) -> list[SilentFrame]:
+        """
+        What to queue for `gap` (in the frame's time base) of audio missing right before
+        `frame`: digital silence, or nothing when the container keeps the gap ("gap"
+        policy) or the gap is trimmed ("trim" policy). Call before `process(frame)`.
+        """
+        seconds = float(gap * frame.time_base)
+        pts = frame.pts - gap
+        if self.policy == SILENCE_GAP and self.timestamped:
+            return []
+
+        if self.policy == SILENCE_TRIM:
+            # Keep what a silence of this length would keep, the rest is trimmed
+            kept = min(seconds, max(0.0, self.keep - self._silent_for))
+            self._silent_for += seconds
+            fill = self._silence(frame, pts - self._trimmed_pts, kept)
+            trimmed = seconds - kept
+            if trimmed > 0:
+                self.trimmed_seconds += trimmed
+                self._trimmed_pts += gap - int(kept / frame.time_base)
+                self._trimming = True
+            return fill
+
+        return self._silence(frame, pts, seconds)
+
+    def _silence(
+        self, frame: av.AudioFrame, pts: int, seconds: float
+    ) -> list[SilentFrame]:
+        """`seconds` of digital silence shaped like `frame`, starting at `pts`."""
+        total = round(seconds * frame.sample_rate)
+        chunk = int(GAP_FILL_SECONDS * frame.sample_rate)
+        fill = []
+        for offset in range(0, total, chunk):
+            fill.append(
+                SilentFrame(
+                    frame.format.name,
+                    frame.layout.name,
+                    min(chunk, total - offset),
+                    frame.sample_rate,
+                    pts + int(offset / frame.sample_rate / frame.time_base),
+                    frame.time_base,
+                )
+            )
+        self.filled_seconds += total / frame.sample_rate
+        return fill
+
+    def _shift(self, frame):
+        """Move a frame earlier by the trimmed duration, noting where the timeline jumps."""
+        if self.policy != SILENCE_TRIM or frame.pts is None or not frame.time_base:
+            return frame
+
+        if self._trimming or not self.timestamp_map:
+            self._trimming = False
+            self.timestamp_map.append(
+                TimestampMapping(
+                    recording_time=float(
+                        (frame.pts - self._trimmed_pts) * frame.time_base
+                    ),
+                    source_time=float(frame.pts * frame.time_base),
+                )
+            )
+        frame.pts -= self._trimmed_pts
+        return frame
+
+    def record_encode(self, latency: float, silent: bool):
+        """Track encode cost of speech and digital silence separately. Runs on the encoder pool."""
+        if silent:
+            self.avg_silence_encode += (latency - self.avg_silence_encode) * 0.05
+        else:
+            self.avg_speech_encode += (latency - self.avg_speech_encode) * 0.05
+
+    def stats(self) -> dict:
+        """
+        Frames classified and the encoder time saved, estimated from the average encode
+        latency of speech frames (skipped frames) and the difference to digital silence (zeroed frames).
+        """
+        zeroed_saving = (
+            max(0.0, self.avg_speech_encode - self.avg_silence_encode)
+            if self.avg_silence_encode
+            else 0.0
+        )
+        return {
+            "policy": self.policy,
+            "frames": self.frames,
+            "silent_frames": self.silent_frames,
+            "skipped_frames": self.skipped_frames,
+            "zeroed_frames": self.zeroed_frames,
+            "trimmed_seconds": round(self.trimmed_seconds, 3),
+            "filled_seconds": round(self.filled_seconds, 3),
+            "detect_seconds": round(self.detect_seconds, 6),
+            "encoder_seconds_saved": round(
+                self.skipped_frames * self.avg_speech_encode
+                + self.zeroed_frames * zeroed_saving,
+                6,
+            ),
+        }
@@ -0,0 +1,372 @@
+"""
+Live PCM taps: the raw audio of a track in a shared-memory ring buffer.
+
+With taps enabled (`/start?tap=true` or `PCM_TAP=true`), `WebRTCMediaRecorder`
+copies the PCM of every received frame into a `multiprocessing.shared_memory`
+block named `chatot-tap-...` before the frame goes to the encoder. Processes on
+the same host attach to it with `PcmTapReader` and read live audio without a
+socket or a serialization step. `/taps` lists the active taps.
+
+Layout, little endian:
+
+    0    magic "CHTAPv1\\0", version, header size, sample rate, channels,
+         bytes per sample, closed flag
+    32   capacity       size of the ring in bytes
+    40   sequence       odd while the fields below are being updated
+    48   cursor         bytes written since the tap opened
+    56   pts            PTS of the latest frame, in time_base
+    64   pts_cursor     cursor at the start of the latest frame
+    72   time_base      numerator, denominator
+    80   wallclock      epoch time the latest frame was received
+    88   frames         frames written
+    96   reserved       cursor once the write in progress is done
+    128  ring           interleaved s16 samples, byte `n` of the stream at `n % capacity`
+
+Writes are whole sample frames (channels * 2 bytes). The writer never waits
+for readers. It bumps `reserved` before copying a frame into the ring and
+`cursor` once the copy is done. A reader that falls more than `capacity` bytes
+behind, or whose copy is overwritten while it reads, skips the lost audio and
+counts it, so a slow reader only ever loses its own data.
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+import uuid
+from multiprocessing import resource_tracker, shared_memory
+
+import av
+import numpy as np
+
+from chatot.log import base_logger
+
+from .types import TapInfo
+
+logger = base_logger.getChild(__name__)
+
+TAP_PREFIX = "chatot-tap-"
+TAP_MAGIC = b"CHTAPv1\0"
+TAP_VERSION = 1
+TAP_FORMAT = "s16"
+
+HEADER = struct.Struct("<8sIIIIIIQQQqQIIdQQ")
+HEADER_SIZE = 128
+# Offsets of the fields updated for every frame
+CLOSED_OFFSET = 28
+SEQUENCE_OFFSET = 40
+FRAME_STATE = struct.Struct("<QqQIIdQ")
+FRAME_STATE_OFFSET = 48
+RESERVED_OFFSET = 96
+
+U32 = struct.Struct("<I")
+U64 = struct.Struct("<Q")
+
+_taps = set()
+_lock = threading.Lock()
+
+
+def taps() -> list[TapInfo]:
+    """Every open tap of this process."""
+    with _lock:
+        open_taps = list(_taps)
+    return [tap.info() for tap in open_taps if tap.name]
+
+
+class PcmTap:
+    """
+    Writer side of a tap, owned by one recorder. The shared memory is created with
+    the first frame, once the sample rate and channel layout are known.
+
+    Args:
+        seconds: Audio the ring holds (PCM_TAP_SECONDS if None, 10 by default).
+        labels: Metric labels ("room", "peer", "track") of the recording, shown by `/taps`.
+    """
+
+    __slots__ = (
+        "seconds",
+        "labels",
+        "name",
+        "sample_rate",
+        "layout",
+        "channels",
+        "capacity",
+        "cursor",
+        "frames",
+        "created_at",
+        "_sequence",
+        "_shm",
+        "_resampler",
+    )
+
+    def __init__(self, seconds: float | None = None, labels: dict | None = None):
+        self.seconds = seconds or float(os.getenv("PCM_TAP_SECONDS") or 10)
+        self.labels = labels or {}
+        self.name = None
+        self.sample_rate = None
+        self.layout = None
+        self.channels = 0
+        self.capacity = 0
+        self.cursor = 0
+        self.frames = 0
+        self.created_at = None
+        self._sequence = 0
+        self._shm = None
+        self._resampler = None
+
+    def _open(self, frame: av.AudioFrame):
+        self.sample_rate = frame.sample_rate
+        self.layout = frame.layout.name
+        self.channels = frame.layout.nb_channels
+        bytes_per_frame = self.channels * 2
+        self.capacity = int(self.seconds * self.sample_rate) * bytes_per_frame
+
+        self._shm = shared_memory.SharedMemory(
+            name=f"{TAP_PREFIX}{uuid.uuid4().hex[:16]}",
+            create=True,
+            size=HEADER_SIZE + self.capacity,
+        )
+        self.name = self._shm.name.lstrip("/")
+        HEADER.pack_into(
+            self._shm.buf,
+            0,
+            TAP_MAGIC,
+            TAP_VERSION,
+            HEADER_SIZE,
+            self.sample_rate,
+            self.channels,
+            2,
+            0,
+            self.capacity,
+            0,
+            0,
+            -1,
+            0,
+            1,
+            self.sample_rate,
+            0.0,
+            0,
+            0,
+        )
+        self.created_at = time.time()
+        with _lock:
+            _taps.add(self)
+        logger.info(
+            f"Opened PCM tap {self.name} ({self.sample_rate} Hz, {self.channels} channels)"
+        )
+
+    def _pcm(self, frame: av.AudioFrame) -> list:
+        """Interleaved s16 buffers of `frame` in the tap's rate and layout, without copying when it already is."""
+        if (
+            frame.format.name == TAP_FORMAT
+            and frame.sample_rate == self.sample_rate
+            and frame.layout.name == self.layout
+        ):
+            return [
+                (
+                    memoryview(frame.planes[0])[: frame.samples * self.channels * 2],
+                    frame.pts,
+                    frame.time_base,
+                )
+            ]
+
+        if self._resampler is None:
+            self._resampler = av.AudioResampler(
+                format=TAP_FORMAT, layout=self.layout, rate=self.sample_rate
+            )
+        return [
+            (
+                memoryview(converted.planes[0])[
+                    : converted.samples * self.channels * 2
+                ],
+                converted.pts,
+                converted.time_base,
+            )
+            for converted in self._resampler.resample(frame)
+        ]
+
+    def write(self, frame: av.AudioFrame):
+        """Append the PCM of a received frame. Runs on the room's event loop and never blocks."""
+        if self._shm is None:
+            self._open(frame)
+
+        buf = self._shm.buf
+        for data, pts, time_base in self._pcm(frame):
+            size = data.nbytes
+            if size > self.capacity:
+                # Only the end of an oversized frame fits
+                data = data[size - self.capacity :]
+                self.cursor += size - self.capacity
+                size = self.capacity
+
+            start = self.cursor
+            U64.pack_into(buf, RESERVED_OFFSET, start + size)
+            offset = start % self.capacity
+            first = min(size, self.capacity - offset)
+            buf[HEADER_SIZE + offset : HEADER_SIZE + offset + first] = data[:first]
+            if first < size:
+                buf[HEADER_SIZE : HEADER_SIZE + size - first] = data[first:]
+
+            self.cursor = start + size
+            self.frames += 1
+            self._sequence += 1
+            U64.pack_into(buf, SEQUENCE_OFFSET, self._sequence)
+            FRAME_STATE.pack_into(
+                buf,
+                FRAME_STATE_OFFSET,
+                self.cursor,
+                pts if pts is not None else -1,
+                start,
+                time_base.numerator if time_base else 1,
+                time_base.denominator if time_base else self.sample_rate,
+                time.time(),
+                self.frames,
+            )
+            self._sequence += 1
+            U64.pack_into(buf, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self):
+        """Mark the tap closed and remove it. Attached readers keep their mapping until they close it."""
+        with _lock:
+            _taps.discard(self)
+        shm, self._shm = self._shm, None
+        if shm is None:
+            return
+        try:
+            U32.pack_into(shm.buf, CLOSED_OFFSET, 1)
+            shm.close()
+            shm.unlink()
+        except Exception as e:
+            logger.error(f"Error closing PCM tap {self.name}: {e}")
+        logger.info(f"Closed PCM tap {self.name}")
+
+    def info(self) -> TapInfo:
+        return {
+            "name": self.name,
+            "room_id": self.labels.get("room", ""),
+            "peer_id": self.labels.get("peer", ""),
+            "track_id": self.labels.get("track", ""),
+            "sample_rate": self.sample_rate,
+            "channels": self.channels,
+            "sample_format": TAP_FORMAT,
+            "capacity": self.capacity,
+            "cursor": self.cursor,
+            "created_at": self.created_at,
+        }
+
+
+class PcmTapReader:
+    """
+    Reader side of a tap, for a consumer process on the same host (not the recording
+    process itself).
+
+    Reading starts at the live edge. Each `read` returns what was written since the
+    previous one; audio that was overwritten before it could be read is skipped and
+    added to `lost_bytes`.
+
+    Args:
+        name: The tap's name, from `/taps`.
+
+    Raises:
+        FileNotFoundError: If there is no such tap
+        ValueError: If the block is not a tap
+    """
+
+    def __init__(self, name: str):
+        if sys.version_info >= (3, 13):
+            self._shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            # Attaching registers the block as if this process owned it, the
+            # resource tracker would remove it when the reader exits
+            self._shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+
+        (
+            magic,
+            version,
+            _,
+            self.sample_rate,
+            self.channels,
+            self.bytes_per_sample,
+            _,
+            self.capacity,
+        ) = HEADER.unpack_from(self._shm.buf, 0)[:8]
+        if magic != TAP_MAGIC or version != TAP_VERSION:
+            self._shm.close()
+            raise ValueError(f"{name} is not a PCM tap")
+
+        self.name = name
+        self.frame_bytes = self.channels * self.bytes_per_sample
+        self.lost_bytes = 0
+        self.position = self._state()[0]
+
+    @property
+    def closed(self) -> bool:
+        """Whether the recorder closed the tap. Data written before is still readable."""
+        return U32.unpack_from(self._shm.buf, CLOSED_OFFSET)[0] == 1
+
+    def _state(self) -> tuple:
+        """(cursor, pts, pts_cursor, time_base_num, time_base_den, wallclock, frames), consistently."""
+        buf = self._shm.buf
+        # A writer that died mid-update leaves the sequence odd, settle for its last state then
+        for _ in range(10000):
+            sequence = U64.unpack_from(buf, SEQUENCE_OFFSET)[0]
+            state = FRAME_STATE.unpack_from(buf, FRAME_STATE_OFFSET)
+            if (
+                sequence % 2 == 0
+                and U64.unpack_from(buf, SEQUENCE_OFFSET)[0] == sequence
+            ):
+                break
+        return state
+
+    def read(self) -> tuple:
+        """
+        Audio written since the previous read.
+
+        Returns:
+            (samples, pts): int16 samples shaped (n, channels), and the PTS of the first
+            one in the track's time base, or None when nothing new was written
+        """
+        cursor, pts, pts_cursor, tb_num, tb_den, _, _ = self._state()
+        start = self.position
+        if cursor - start > self.capacity:
+            self.lost_bytes += cursor - self.capacity - start
+            start = cursor - self.capacity
+        size = cursor - start
+        if size <= 0:
+            return np.empty((0, self.channels), dtype=np.int16), None
+
+        buf = self._shm.buf
+        data = bytearray(size)
+        offset = start % self.capacity
+        first = min(size, self.capacity - offset)
+        data[:first] = buf[HEADER_SIZE + offset : HEADER_SIZE + offset + first]
+        if first < size:
+            data[first:] = buf[HEADER_SIZE : HEADER_SIZE + size - first]
+
+        # The writer may have lapped the copy, drop what it overwrote
+        overwritten = U64.unpack_from(buf, RESERVED_OFFSET)[0] - self.capacity - start
+        if overwritten > 0:
+            self.lost_bytes += overwritten
+            del data[:overwritten]
+            start += overwritten
+        self.position = cursor
+
+        samples = np.frombuffer(data, dtype=np.int16).reshape(-1, self.channels)
+        samples_per_tick = self.sample_rate * tb_num / tb_den
+        first_pts = (
+            None
+            if pts < 0
+            else pts - round((pts_cursor - start) / self.frame_bytes / samples_per_tick)
+        )
+        return samples, first_pts
+
+    def close(self):
+        self._shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
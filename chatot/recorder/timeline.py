@@ -0,0 +1,219 @@
+"""
+Where a track's audio sits in time.
+
+`TrackTimeline` follows the PTS of the frames (or Opus packets) a recorder
+receives. It remembers when the first one was received, in epoch seconds, and
+finds the gaps between the PTS a frame should have had and the one it has:
+packet loss, a muted or paused producer, a sender that stopped for a while.
+Recorders fill the gaps so the file keeps the track's real timeline, see
+`SilenceFilter.fill_gap`. The start time and the gaps go into the webhook and the
+room manifest.
+
+A PTS up to a second behind the timeline is a duplicate or reordered frame and
+is ignored. One further behind, or one that jumps further than `TRACK_MAX_GAP`
+seconds (6 hours by default), is taken as a restarted clock rather than a gap: it
+is counted in `resets` and the timeline carries on from the new PTS.
+
+`TimestampRebaser` puts the frames of successive sources of one peer (consumers
+that replace each other as the peer reconnects or republishes) on one timeline,
+so a consolidated recording sees the time the peer was away as one more gap.
+"""
+
+import os
+import time
+from fractions import Fraction
+
+from .types import TimelineGap, TrackTiming
+
+# Gaps listed in `TrackTiming`, longer timelines only add to the totals
+MAX_LISTED_GAPS = 1000
+# Frames this far behind the timeline are duplicates or reordered, further is a reset
+LATE_SECONDS = 1.0
+
+
+class TrackTimeline:
+    """
+    Args:
+        latency: Seconds the track delivers audio after it was captured, on top of one
+                 frame, e.g. the room mix's jitter window.
+        max_gap: Longest gap filled (TRACK_MAX_GAP if None, 21600 by default).
+    """
+
+    __slots__ = (
+        "latency",
+        "max_gap",
+        "start_time",
+        "first_pts",
+        "time_base",
+        "next_pts",
+        "elapsed",
+        "gaps",
+        "gap_count",
+        "gap_seconds",
+        "resets",
+    )
+
+    def __init__(self, latency: float = 0.0, max_gap: float | None = None):
+        self.latency = latency
+        self.max_gap = (
+            max_gap
+            if max_gap is not None
+            else float(os.getenv("TRACK_MAX_GAP") or 6 * 3600)
+        )
+        self.start_time = None
+        self.first_pts = None
+        self.time_base = None
+        self.next_pts = None
+        # Seconds of timeline before the last reset
+        self.elapsed = 0.0
+        self.gaps: list[TimelineGap] = []
+        self.gap_count = 0
+        self.gap_seconds = 0.0
+        self.resets = 0
+
+    @property
+    def duration(self) -> float:
+        """Seconds from the first sample to the end of the latest frame, gaps included."""
+        if self.next_pts is None:
+            return self.elapsed
+        return self.elapsed + float((self.next_pts - self.first_pts) * self.time_base)
+
+    def observe(
+        self,
+        pts: int | None,
+        samples: int,
+        sample_rate: int,
+        time_base: Fraction | None,
+    ) -> int:
+        """
+        Account for a received frame of `samples` samples.
+
+        Returns:
+            int: Missing audio before the frame, in `time_base` units, 0 if it follows on
+        """
+        if self.start_time is None:
+            # The frame was complete when it arrived, its first sample is older
+            self.start_time = time.time() - samples / sample_rate - self.latency
+
+        if pts is None or not time_base:
+            # No timestamps, so no gaps either, only the duration
+            if self.next_pts is not None:
+                self.elapsed = self.duration
+                self.next_pts = self.first_pts = None
+            self.elapsed += samples / sample_rate
+            return 0
+
+        length = round(samples / sample_rate / time_base)
+        if self.next_pts is None or time_base != self.time_base:
+            self._restart(pts, time_base)
+            self.next_pts = pts + length
+            return 0
+
+        gap = pts - self.next_pts
+        # Timestamps may be off by a sample or two, half a frame is no gap yet
+        if abs(gap) <= length // 2:
+            self.next_pts = pts + length
+            return 0
+        if gap < 0 and -gap * time_base <= LATE_SECONDS:
+            # A duplicate or reordered frame, its time is accounted for already
+            return 0
+        if gap < 0 or gap * time_base > self.max_gap:
+            self.resets += 1
+            self._restart(pts, time_base)
+            self.next_pts = pts + length
+            return 0
+
+        seconds = float(gap * time_base)
+        self.gap_count += 1
+        self.gap_seconds += seconds
+        if len(self.gaps) < MAX_LISTED_GAPS:
+            self.gaps.append(
+                TimelineGap(start=round(self.duration, 3), duration=round(seconds, 3))
+            )
+        self.next_pts = pts + length
+        return gap
+
+    def _restart(self, pts: int, time_base: Fraction):
+        if self.next_pts is not None:
+            self.elapsed = self.duration
+        self.first_pts = pts
+        self.time_base = time_base
+
+    def to_dict(self, origin: float | None = None) -> TrackTiming:
+        """
+        Args:
+            origin: Epoch time offsets are relative to, e.g. when the room was joined.
+        """
+        return TrackTiming(
+            start_time=self.start_time,
+            offset=round(self.start_time - origin, 3)
+            if self.start_time is not None and origin is not None
+            else None,
+            duration=round(self.duration, 3),
+            gaps=list(self.gaps),
+            gap_count=self.gap_count,
+            gap_seconds=round(self.gap_seconds, 3),
+            resets=self.resets,
+        )
+
+
+class TimestampRebaser:
+    """
+    Maps the PTS of successive sources onto one timeline. The first source keeps its
+    own PTS. Each later one starts after the previous one's last frame, plus the
+    wall-clock time that passed between them. Within a source, PTS keep their spacing.
+    """
+
+    __slots__ = (
+        "offset",
+        "next_pts",
+        "time_base",
+        "last_seen",
+        "sources",
+        "_pending",
+        "_new_source",
+    )
+
+    def __init__(self):
+        self.offset = 0
+        self.next_pts = None
+        self.time_base = None
+        self.last_seen = None
+        self.sources = 0
+        self._pending = True
+        self._new_source = True
+
+    def new_source(self):
+        """The next frame comes from a new source."""
+        self._pending = True
+        self._new_source = True
+
+    def resync(self):
+        """The next frame may not follow on from the last one (a paused source), place it by wall clock."""
+        self._pending = True
+
+    def rebase(
+        self, pts: int, samples: int, sample_rate: int, time_base: Fraction
+    ) -> int:
+        """The PTS of a frame of `samples` samples on the shared timeline."""
+        now = time.monotonic()
+        if self._pending or time_base != self.time_base:
+            if self.next_pts is None:
+                start = pts
+            else:
+                if time_base != self.time_base:
+                    self.next_pts = round(self.next_pts * self.time_base / time_base)
+                # The frame was complete when it arrived, so it started a frame earlier
+                away = now - self.last_seen - samples / sample_rate
+                start = self.next_pts + max(0, round(away / time_base))
+            if self._new_source:
+                self.sources += 1
+                self._new_source = False
+            self.offset = start - pts
+            self.time_base = time_base
+            self._pending = False
+        self.last_seen = now
+        rebased = pts + self.offset
+        end = rebased + round(samples / sample_rate / time_base)
+        self.next_pts = end if self.next_pts is None else max(self.next_pts, end)
+        return rebased
@@ -0,0 +1,102 @@
+from typing import TypedDict
+
+
+class RecordingSegment(TypedDict):
+    """
+    Type definition for one finished segment of a segmented recording.
+
+    Attributes:
+        sequence: Position of the segment in the recording, starting at 0
+        path: Local path of the segment file
+        start_pts: PTS of the segment's first source frame, in the track's time base
+        start_time: start_pts in seconds
+        duration: Seconds of audio in the segment
+        size: Size of the segment file in bytes
+    """
+
+    sequence: int
+    path: str
+    start_pts: int | None
+    start_time: float
+    duration: float
+    size: int
+
+
+class TimestampMapping(TypedDict):
+    """
+    Type definition for one entry of a trimmed recording's timestamp map.
+    From `recording_time` on, recording time t maps to source time
+    `source_time + (t - recording_time)`, until the next entry.
+
+    Attributes:
+        recording_time: Seconds into the recording
+        source_time: Seconds into the source track
+    """
+
+    recording_time: float
+    source_time: float
+
+
+class TapInfo(TypedDict):
+    """
+    Type definition for an open live PCM tap, as listed by `/taps`.
+
+    Attributes:
+        name: Shared memory name to attach to with `PcmTapReader`
+        room_id: Room of the recorded track
+        peer_id: Peer of the recorded track
+        track_id: Consumer id of the recorded track
+        sample_rate: Samples per second
+        channels: Interleaved channels
+        sample_format: Always "s16", signed 16-bit little endian
+        capacity: Size of the ring in bytes
+        cursor: Bytes written so far
+        created_at: Epoch time the tap was opened
+    """
+
+    name: str
+    room_id: str
+    peer_id: str
+    track_id: str
+    sample_rate: int
+    channels: int
+    sample_format: str
+    capacity: int
+    cursor: int
+    created_at: float
+
+
+class TimelineGap(TypedDict):
+    """
+    Type definition for audio missing from a track, filled as the silence policy says.
+
+    Attributes:
+        start: Seconds into the track the gap starts at
+        duration: Seconds of audio missing
+    """
+
+    start: float
+    duration: float
+
+
+class TrackTiming(TypedDict):
+    """
+    Type definition for where a recorded track sits in time, see `chatot.recorder.timeline`.
+
+    Attributes:
+        start_time: Epoch time of the track's first sample, None if nothing was received
+        offset: start_time relative to when the room was joined, in seconds
+        duration: Seconds from the first sample to the last, gaps included
+        gaps: The first 1000 gaps in the track
+        gap_count: Number of gaps
+        gap_seconds: Total length of the gaps
+        resets: Times the track's timestamps restarted
+    """
+
+    start_time: float | None
+    offset: float | None
+    duration: float
+    gaps: list[TimelineGap]
+    gap_count: int
+    gap_seconds: float
+    resets: int
@@ -0,0 +1,147 @@
+"""
+Process-wide configuration, loaded once from the environment (and `.env`).
+
+Only the settings needed to start a node and reach Huddle01, R2 and the webhook
+endpoint live here. Subsystems with their own tuning knobs (encoder, loop pool,
+admission control, ...) still read them when they are created.
+
+Nothing is validated at import. `Settings.missing` lists what a node cannot run
+without, and `chatot.main` reports it before serving.
+"""
+
+import os
+import threading
+from dataclasses import dataclass
+
+from dotenv import load_dotenv
+
+# S3 and R2 reject parts smaller than 5 MiB, except for the last one
+MIN_PART_SIZE = 5 * 1024 * 1024
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Attributes:
+        huddle01_project_id: HUDDLE01_PROJECT_ID, required.
+        huddle01_api_key: HUDDLE01_API_KEY, required.
+        webhook_url: WEBHOOK_URL, webhooks are not sent without it.
+        webhook_secret: WEBHOOK_API_KEY, signs the webhooks.
+        account_id: ACCOUNT_ID of the R2 account.
+        access_key_id: ACCESS_KEY_ID of the R2 token.
+        access_key_secret: ACCESS_KEY_SECRET of the R2 token.
+        bucket_name: BUCKET_NAME recordings are uploaded to.
+        custom_domain: CUSTOM_DOMAIN recordings are served from, if any.
+        s3_endpoint_url: S3_ENDPOINT_URL, any S3 compatible endpoint instead of R2.
+        upload_max_pool_connections: UPLOAD_MAX_POOL_CONNECTIONS of the shared client.
+        upload_max_tries: UPLOAD_MAX_TRIES per upload.
+        upload_backoff_base: UPLOAD_BACKOFF_BASE seconds before the first retry.
+        upload_backoff_max: UPLOAD_BACKOFF_MAX seconds between retries at most.
+        multipart_part_size: MULTIPART_PART_SIZE bytes, at least 5 MiB.
+        multipart_parts_in_flight: MULTIPART_PARTS_IN_FLIGHT per recording.
+        multipart_upload_workers: MULTIPART_UPLOAD_WORKERS shared by all recordings.
+        port: PORT the API listens on.
+        workers: WORKERS, more than 1 runs a supervisor with worker processes.
+    """
+
+    huddle01_project_id: str | None = None
+    huddle01_api_key: str | None = None
+    webhook_url: str | None = None
+    webhook_secret: str | None = None
+    account_id: str | None = None
+    access_key_id: str | None = None
+    access_key_secret: str | None = None
+    bucket_name: str | None = None
+    custom_domain: str | None = None
+    s3_endpoint_url: str | None = None
+    upload_max_pool_connections: int = 32
+    upload_max_tries: int = 5
+    upload_backoff_base: float = 0.5
+    upload_backoff_max: float = 30.0
+    multipart_part_size: int = DEFAULT_PART_SIZE
+    multipart_parts_in_flight: int = 2
+    multipart_upload_workers: int = 4
+    port: int = 5000
+    workers: int = 1
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """
+        Raises:
+            ValueError: If a numeric setting is not a number
+        """
+        return cls(
+            huddle01_project_id=os.getenv("HUDDLE01_PROJECT_ID") or None,
+            huddle01_api_key=os.getenv("HUDDLE01_API_KEY") or None,
+            webhook_url=os.getenv("WEBHOOK_URL") or None,
+            webhook_secret=os.getenv("WEBHOOK_API_KEY") or None,
+            account_id=os.getenv("ACCOUNT_ID") or None,
+            access_key_id=os.getenv("ACCESS_KEY_ID") or None,
+            access_key_secret=os.getenv("ACCESS_KEY_SECRET") or None,
+            bucket_name=os.getenv("BUCKET_NAME") or None,
+            custom_domain=os.getenv("CUSTOM_DOMAIN") or None,
+            s3_endpoint_url=(os.getenv("S3_ENDPOINT_URL") or "").rstrip("/") or None,
+            upload_max_pool_connections=int(
+                os.getenv("UPLOAD_MAX_POOL_CONNECTIONS") or 32
+            ),
+            upload_max_tries=int(os.getenv("UPLOAD_MAX_TRIES") or 5),
+            upload_backoff_base=float(os.getenv("UPLOAD_BACKOFF_BASE") or 0.5),
+            upload_backoff_max=float(os.getenv("UPLOAD_BACKOFF_MAX") or 30.0),
+            multipart_part_size=max(
+                MIN_PART_SIZE,
+                int(os.getenv("MULTIPART_PART_SIZE") or DEFAULT_PART_SIZE),
+            ),
+            multipart_parts_in_flight=int(os.getenv("MULTIPART_PARTS_IN_FLIGHT") or 2),
+            multipart_upload_workers=int(os.getenv("MULTIPART_UPLOAD_WORKERS") or 4),
+            port=int(os.getenv("PORT") or 5000),
+            workers=int(os.getenv("WORKERS") or 1),
+        )
+
+    @property
+    def storage_configured(self) -> bool:
+        return all(
+            (
+                self.account_id,
+                self.access_key_id,
+                self.access_key_secret,
+                self.bucket_name,
+            )
+        )
+
+    @property
+    def storage_endpoint(self) -> str:
+        return (
+            self.s3_endpoint_url
+            or f"https://{self.account_id}.r2.cloudflarestorage.com"
+        )
+
+    def missing(self) -> list[str]:
+        """Environment variables a node cannot record without."""
+        required = {
+            "HUDDLE01_PROJECT_ID": self.huddle01_project_id,
+            "HUDDLE01_API_KEY": self.huddle01_api_key,
+        }
+        return [name for name, value in required.items() if not value]
+
+
+_settings: Settings | None = None
+_lock = threading.Lock()
+
+
+def get_settings() -> Settings:
+    """The settings of this process, read from the environment and `.env` on first use."""
+    global _settings
+    with _lock:
+        if _settings is None:
+            load_dotenv()
+            _settings = Settings.from_env()
+        return _settings
+
+
+def reload_settings() -> Settings:
+    """Read the environment again, e.g. after a test or harness changed it."""
+    global _settings
+    with _lock:
+        _settings = None
+    return get_settings()
@@ -0,0 +1,4 @@
+from .supervisor import Supervisor, WorkerProcess
+from .proxy import create_proxy_app
+
+__all__ = ["Supervisor", "WorkerProcess", "create_proxy_app"]
@@ -0,0 +1,233 @@
+import re
+
+from flask import Flask, Response, make_response, request, jsonify
+
+from chatot.log import base_logger
+from chatot.utils.metrics import MetricsRegistry
+
+from .supervisor import Supervisor, WorkerProcess
+
+logger = base_logger.getChild(__name__)
+
+# Headers that describe the worker's connection, not the response
+HOP_HEADERS = {
+    "connection",
+    "content-encoding",
+    "content-length",
+    "keep-alive",
+    "transfer-encoding",
+}
+
+SAMPLE = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})? (.*)$")
+
+
+def merge_metrics(pages: list) -> str:
+    """
+    Merge Prometheus text pages into one, adding a `worker` label to every sample.
+    Samples of the same family from different pages are grouped under one HELP/TYPE header.
+
+    Args:
+        pages: (worker label, page text) pairs, a None label leaves the page's samples as they are
+    """
+    families = {}
+    for worker, text in pages:
+        family = None
+        for line in text.splitlines():
+            if line.startswith("# HELP ") or line.startswith("# TYPE "):
+                _, kind, name, rest = (line.split(" ", 3) + [""])[:4]
+                family = families.setdefault(
+                    name, {"HELP": "", "TYPE": "untyped", "samples": []}
+                )
+                family[kind] = rest
+                continue
+            match = SAMPLE.match(line)
+            if not match or family is None:
+                continue
+            name, labels, value = match.groups()
+            if worker is None:
+                family["samples"].append(line)
+                continue
+            labels = (
+                f'{{worker="{worker}",{labels[1:]}'
+                if labels
+                else f'{{worker="{worker}"}}'
+            )
+            family["samples"].append(f"{name}{labels} {value}")
+
+    lines = []
+    for name, family in families.items():
+        lines.append(f"# HELP {name} {family['HELP']}")
+        lines.append(f"# TYPE {name} {family['TYPE']}")
+        lines += family["samples"]
+    return "\n".join(lines) + "\n"
+
+
+def create_proxy_app(supervisor: Supervisor) -> Flask:
+    """
+    The API front end of supervisor mode.
+
+    `/start` goes to the worker `Supervisor.place` picks, `/stop` and `/status` to the
+    worker that owns the room or session. `/status` without arguments, `/taps` and
+    `/metrics` merge every worker's answer. `/drain` drains every worker.
+    """
+    app = Flask(__name__)
+
+    def forward(worker: WorkerProcess, path: str):
+        response = supervisor.http.get(
+            f"{worker.url}{path}", params=request.args, timeout=30
+        )
+        headers = [
+            (name, value)
+            for name, value in response.headers.items()
+            if name.lower() not in HOP_HEADERS
+        ]
+        return Response(response.content, status=response.status_code, headers=headers)
+
+    def not_found():
+        target = request.args.get("room_id") or request.args.get("session_id")
+        return jsonify(
+            {"status": "not_found", "message": f"No active session for room {target}"}
+        ), 404
+
+    @app.route("/healthz", methods=["GET"])
+    async def healthz():
+        return make_response("", 503 if supervisor.draining else 204)
+
+    @app.route("/start", methods=["GET"])
+    async def start_recording():
+        room_id = request.args.get("room_id")
+        if not room_id:
+            return jsonify({"error": "Missing room_id parameter"}), 400
+        if supervisor.draining:
+            return (
+                jsonify(
+                    {
+                        "status": "draining",
+                        "message": "Node is draining before it exits",
+                    }
+                ),
+                503,
+                {"Retry-After": "1"},
+            )
+
+        # A room that is already recording is restarted on the worker that owns it
+        worker = supervisor.owner(room_id=room_id) or supervisor.place()
+        try:
+            response = forward(worker, "/start")
+        except Exception as e:
+            logger.error(
+                f"Error forwarding start of {room_id} to worker {worker.index}: {e}"
+            )
+            return jsonify(
+                {"status": "error", "message": f"Worker {worker.index} unavailable"}
+            ), 503
+
+        if response.status_code < 300:
+            supervisor.assign(
+                worker,
+                room_id,
+                (response.get_json(silent=True) or {}).get("session_id"),
+            )
+        return response
+
+    @app.route("/stop", methods=["GET"])
+    async def stop_room():
+        room_id = request.args.get("room_id")
+        session_id = request.args.get("session_id")
+        if not room_id and not session_id:
+            return jsonify({"error": "Missing room_id parameter"}), 400
+
+        worker = supervisor.owner(room_id=room_id, session_id=session_id)
+        if worker is None:
+            return not_found()
+        return forward(worker, "/stop")
+
+    @app.route("/status", methods=["GET"])
+    async def status():
+        room_id = request.args.get("room_id")
+        session_id = request.args.get("session_id")
+
+        if room_id or session_id:
+            worker = supervisor.owner(room_id=room_id, session_id=session_id)
+            if worker is None:
+                return not_found()
+            return forward(worker, "/status")
+
+        counts, sessions = {}, []
+        for worker in supervisor.workers:
+            try:
+                answer = supervisor.http.get(f"{worker.url}/status", timeout=5).json()
+            except Exception as e:
+                logger.error(f"Error reading status of worker {worker.index}: {e}")
+                continue
+            for state, count in answer.get("counts", {}).items():
+                counts[state] = counts.get(state, 0) + count
+            sessions += [
+                dict(session, worker=worker.index)
+                for session in answer.get("sessions", [])
+            ]
+
+        return jsonify(
+            {"counts": counts, "sessions": sessions, **supervisor.stats()}
+        ), 200
+
+    @app.route("/drain", methods=["GET", "POST"])
+    async def drain():
+        if request.method == "POST":
+            from chatot.utils.shutdown import stop_serving
+
+            started = supervisor.drain("api", on_done=lambda report: stop_serving())
+            return jsonify(
+                {"status": "draining" if started else "already_draining"}
+            ), 202
+
+        if not supervisor.draining:
+            return jsonify({"status": "serving"}), 200
+        if supervisor.drain_report is not None:
+            return jsonify({"status": "drained", **supervisor.drain_report}), 200
+        workers = [
+            {"worker": worker.index, "alive": worker.alive, "drain": worker.drain}
+            for worker in supervisor.workers
+        ]
+        return jsonify(
+            {
+                "status": "draining",
+                "reason": supervisor.drain_reason,
+                "workers": workers,
+            }
+        ), 200
+
+    @app.route("/taps", methods=["GET"])
+    async def taps():
+        # Workers share the host, so their taps can be read from here too
+        found = []
+        for worker in supervisor.workers:
+            try:
+                answer = supervisor.http.get(
+                    f"{worker.url}/taps", params=request.args, timeout=5
+                ).json()
+            except Exception as e:
+                logger.error(f"Error reading taps of worker {worker.index}: {e}")
+                continue
+            found += [dict(tap, worker=worker.index) for tap in answer.get("taps", [])]
+        return jsonify({"taps": found}), 200
+
+    @app.route("/metrics", methods=["GET"])
+    async def metrics():
+        pages = [(None, MetricsRegistry().render())]
+        for worker in supervisor.workers:
+            try:
+                pages.append(
+                    (
+                        worker.index,
+                        supervisor.http.get(f"{worker.url}/metrics", timeout=5).text,
+                    )
+                )
+            except Exception as e:
+                logger.error(f"Error reading metrics of worker {worker.index}: {e}")
+        return Response(
+            merge_metrics(pages),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+    return app
@@ -0,0 +1,426 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Counter
+from chatot.utils.shutdown import EXIT_DRAIN_INCOMPLETE
+
+logger = base_logger.getChild(__name__)
+
+PLACEMENT_TRACKS = "tracks"
+PLACEMENT_CPU = "cpu"
+PLACEMENTS = (PLACEMENT_TRACKS, PLACEMENT_CPU)
+
+WORKER_RESTARTS = Counter(
+    "chatot_worker_restarts_total",
+    "Worker processes restarted after exiting.",
+    ("worker",),
+)
+ROOMS_LOST = Counter(
+    "chatot_rooms_lost_total",
+    "Rooms whose worker process exited while they were active.",
+)
+# Seconds the supervisor waits for drained workers to exit, on top of their deadline
+DRAIN_GRACE_SECONDS = 5.0
+
+
+def run_worker(index: int, port: int):
+    """
+    Entry point of a worker process: the regular API, bound to loopback.
+    Each worker gets its own webhook outbox so deliveries are never claimed twice,
+    and a private session store since only the supervisor is reachable from outside.
+    """
+    outbox = os.getenv("WEBHOOK_OUTBOX_PATH") or "webhooks/outbox.sqlite3"
+    root, extension = os.path.splitext(outbox)
+    os.environ["WEBHOOK_OUTBOX_PATH"] = f"{root}.worker{index}{extension}"
+    os.environ["WORKER_INDEX"] = str(index)
+    os.environ["CLUSTER_STORE"] = "memory://"
+
+    from chatot.main import serve_api
+
+    report = serve_api(host="127.0.0.1", port=port)
+    if report is not None and not report["complete"]:
+        sys.exit(EXIT_DRAIN_INCOMPLETE)
+
+
+class WorkerProcess:
+    """
+    One worker process and what the supervisor knows about it.
+
+    Attributes:
+        index: Position of the worker, stable across restarts.
+        port: Loopback port the worker's API listens on.
+        load: Last `/load` answer, adjusted for rooms placed since.
+        rooms: Active room ids placed on this worker.
+        restarts: How many times the process was restarted.
+        drain: Last `/drain` answer seen while the worker drained.
+    """
+
+    def __init__(self, index: int, port: int):
+        self.index = index
+        self.port = port
+        self.process = None
+        self.load = {"sessions": 0, "tracks": 0, "cpu_percent": 0.0}
+        self.rooms = set()
+        self.restarts = 0
+        self.started_at = None
+        self.drain = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, context):
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.index, self.port),
+            name=f"chatot-worker-{self.index}",
+        )
+        self.process.start()
+        self.started_at = time.time()
+        self.load = {"sessions": 0, "tracks": 0, "cpu_percent": 0.0}
+        logger.info(
+            f"Worker {self.index} started on port {self.port} (pid {self.process.pid})"
+        )
+
+    def stop(self, timeout: float = 10.0):
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+
+    def start_drain(self, http: requests.Session):
+        """Ask the worker to drain and exit, with SIGTERM if its API does not answer."""
+        try:
+            response = http.post(f"{self.url}/drain", timeout=5)
+            response.raise_for_status()
+            self.drain = response.json()
+        except Exception as e:
+            logger.warning(
+                f"Worker {self.index} did not take the drain request, sending SIGTERM: {e}"
+            )
+            if self.alive:
+                self.process.terminate()
+
+    def poll_drain(self, http: requests.Session):
+        try:
+            self.drain = http.get(f"{self.url}/drain", timeout=1).json()
+        except Exception:
+            # Exiting
+            pass
+
+    def to_dict(self) -> dict:
+        return {
+            "worker": self.index,
+            "port": self.port,
+            "pid": self.process.pid if self.process else None,
+            "alive": self.alive,
+            "restarts": self.restarts,
+            "started_at": self.started_at,
+            "rooms": sorted(self.rooms),
+            "load": dict(self.load),
+        }
+
+
+class Supervisor:
+    """
+    Runs `workers` API processes on loopback ports and tracks which one owns each room.
+
+    Every worker is a full chatot process (its own loop pool, encoder pool, upload
+    service and webhook outbox), so Opus decoding and encoding scale past one core.
+    New rooms go to the worker with the fewest active tracks, or the lowest CPU with
+    `WORKER_PLACEMENT=cpu`, using loads polled every `WORKER_LOAD_INTERVAL` seconds.
+    A worker that exits is restarted and the rooms it owned are reported as lost.
+
+    `drain` (SIGTERM or SIGINT, or `POST /drain` on the proxy) refuses new rooms and
+    drains every worker, see `chatot.api.drain`; workers are no longer restarted.
+    """
+
+    def __init__(
+        self, workers: int, base_port: int | None = None, placement: str | None = None
+    ):
+        if base_port is None:
+            base_port = int(os.getenv("WORKER_BASE_PORT") or 5101)
+        if placement is None:
+            placement = os.getenv("WORKER_PLACEMENT") or PLACEMENT_TRACKS
+        if placement not in PLACEMENTS:
+            raise ValueError(f"Unknown worker placement: {placement}")
+
+        self.placement = placement
+        self.load_interval = float(os.getenv("WORKER_LOAD_INTERVAL") or 1.0)
+        self.workers: List[WorkerProcess] = [
+            WorkerProcess(index, base_port + index) for index in range(max(1, workers))
+        ]
+        self.lost_rooms = deque(maxlen=100)
+
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._rooms: Dict[str, WorkerProcess] = {}
+        self._assigned_at: Dict[str, float] = {}
+        # Session ids stay routable after the room ends, for `/status`
+        self._sessions: Dict[str, WorkerProcess] = {}
+        self._session_routes = int(os.getenv("SESSION_ROUTES") or 10000)
+        self._running = False
+        self._monitor = None
+        self.drain_deadline = float(os.getenv("DRAIN_DEADLINE") or 25)
+        self.drain_reason = None
+        self.drain_started_at = None
+        self.drain_report = None
+
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.workers), pool_maxsize=32)
+        self.http.mount("http://", adapter)
+
+    def start(self):
+        self._running = True
+        for worker in self.workers:
+            worker.start(self._context)
+        self._monitor = threading.Thread(
+            target=self._watch, name="chatot-supervisor", daemon=True
+        )
+        self._monitor.start()
+
+    def stop(self):
+        self._running = False
+        for worker in self.workers:
+            worker.stop()
+
+    def run(self, host: str, port: int):
+        """
+        Start the workers and serve the proxy front end until interrupted or drained.
+
+        Returns:
+            dict | None: The drain that stopped the proxy, None if it stopped otherwise
+        """
+        from waitress import serve
+        from chatot.utils.shutdown import on_shutdown_signal, stop_serving
+        from .proxy import create_proxy_app
+
+        self.start()
+        on_shutdown_signal(
+            lambda name: self.drain(name, on_done=lambda report: stop_serving())
+        )
+        try:
+            serve(create_proxy_app(self), host=host, port=port)
+        finally:
+            self.stop()
+        return self.drain_report
+
+    @property
+    def draining(self) -> bool:
+        return self.drain_started_at is not None
+
+    def drain(self, reason: str, on_done: Callable[[dict], None] | None = None) -> bool:
+        """
+        Drain every worker and wait for them to exit in the background, then call
+        `on_done(report)`. Safe to call from a signal handler.
+
+        Returns:
+            bool: False if the supervisor was already draining
+        """
+        with self._lock:
+            if self.drain_started_at is not None:
+                return False
+            self.drain_started_at = time.time()
+            self.drain_reason = reason
+        # Drained workers exit, they must not be restarted
+        self._running = False
+        threading.Thread(
+            target=self._drain,
+            args=(on_done,),
+            name="chatot-supervisor-drain",
+            daemon=True,
+        ).start()
+        return True
+
+    def _drain(self, on_done: Callable[[dict], None] | None):
+        logger.warning(
+            f"Draining {len(self.workers)} workers ({self.drain_reason}) within {self.drain_deadline}s"
+        )
+        started = time.monotonic()
+        for worker in self.workers:
+            if worker.alive:
+                worker.start_drain(self.http)
+
+        exit_by = started + self.drain_deadline + DRAIN_GRACE_SECONDS
+        while time.monotonic() < exit_by and any(
+            worker.alive for worker in self.workers
+        ):
+            for worker in self.workers:
+                if worker.alive:
+                    worker.poll_drain(self.http)
+            time.sleep(0.2)
+
+        killed = [worker.index for worker in self.workers if worker.alive]
+        for worker in self.workers:
+            worker.stop(timeout=1.0)
+
+        # A worker exits right after its drain, so its own report is in its log; its
+        # exit code says whether it left anything behind
+        workers = [
+            {
+                "worker": worker.index,
+                "exitcode": worker.process.exitcode if worker.process else None,
+                "killed": worker.index in killed,
+                "complete": worker.index not in killed
+                and worker.process is not None
+                and worker.process.exitcode == 0,
+                "progress": worker.drain,
+            }
+            for worker in self.workers
+        ]
+        report = self.drain_report = {
+            "reason": self.drain_reason,
+            "started_at": self.drain_started_at,
+            "duration": round(time.monotonic() - started, 3),
+            "deadline": self.drain_deadline,
+            "complete": all(worker["complete"] for worker in workers),
+            "workers": workers,
+        }
+        if report["complete"]:
+            logger.info(f"Drained every worker in {report['duration']}s: {report}")
+        else:
+            logger.error(
+                f"Drain left work behind after {report['duration']}s: {report}"
+            )
+
+        if on_done:
+            on_done(report)
+
+    def place(self) -> WorkerProcess:
+        """The live worker that should take the next room."""
+        with self._lock:
+            candidates = [
+                worker for worker in self.workers if worker.alive
+            ] or self.workers
+            if self.placement == PLACEMENT_CPU:
+                return min(
+                    candidates,
+                    key=lambda worker: (
+                        worker.load["cpu_percent"],
+                        worker.load["tracks"],
+                        len(worker.rooms),
+                    ),
+                )
+            return min(
+                candidates,
+                key=lambda worker: (
+                    worker.load["tracks"],
+                    len(worker.rooms),
+                    worker.load["cpu_percent"],
+                ),
+            )
+
+    def assign(self, worker: WorkerProcess, room_id: str, session_id: str | None):
+        """Remember that `worker` now owns `room_id` (and its session)."""
+        with self._lock:
+            self._forget(room_id)
+            self._rooms[room_id] = worker
+            self._assigned_at[room_id] = time.time()
+            worker.rooms.add(room_id)
+            # Count the room until the next load poll sees its tracks
+            worker.load["sessions"] += 1
+            if session_id:
+                self._sessions[session_id] = worker
+                if len(self._sessions) > self._session_routes:
+                    del self._sessions[next(iter(self._sessions))]
+
+    def _forget(self, room_id: str):
+        """Called with the lock held."""
+        worker = self._rooms.pop(room_id, None)
+        self._assigned_at.pop(room_id, None)
+        if worker is not None:
+            worker.rooms.discard(room_id)
+
+    def owner(
+        self, room_id: str | None = None, session_id: str | None = None
+    ) -> WorkerProcess | None:
+        with self._lock:
+            if session_id:
+                return self._sessions.get(session_id)
+            return self._rooms.get(room_id)
+
+    def _watch(self):
+        while self._running:
+            for worker in self.workers:
+                if not self._running:
+                    return
+                if not worker.alive:
+                    self._restart(worker)
+                    continue
+                self._poll_load(worker)
+            time.sleep(self.load_interval)
+
+    def _poll_load(self, worker: WorkerProcess):
+        polled_at = time.time()
+        try:
+            response = self.http.get(f"{worker.url}/load", timeout=self.load_interval)
+            response.raise_for_status()
+            load = response.json()
+        except Exception:
+            # Still starting, or busy; keep the last known load
+            return
+
+        active = set(load.get("rooms", []))
+        with self._lock:
+            worker.load = load
+            # Rooms that ended on the worker (left or failed) no longer belong to it,
+            # unless they were placed after the worker answered
+            for room_id in worker.rooms - active:
+                if self._assigned_at.get(room_id, 0) < polled_at:
+                    self._forget(room_id)
+
+    def _restart(self, worker: WorkerProcess):
+        exitcode = worker.process.exitcode if worker.process else None
+        with self._lock:
+            lost = sorted(worker.rooms)
+            for room_id in lost:
+                self._forget(room_id)
+            for session_id in [
+                sid for sid, owner in self._sessions.items() if owner is worker
+            ]:
+                del self._sessions[session_id]
+            if lost:
+                self.lost_rooms.append(
+                    {
+                        "worker": worker.index,
+                        "exitcode": exitcode,
+                        "rooms": lost,
+                        "at": time.time(),
+                    }
+                )
+
+        if lost:
+            ROOMS_LOST.inc(len(lost))
+            logger.error(
+                f"Worker {worker.index} exited with {exitcode}, lost rooms: {', '.join(lost)}"
+            )
+        else:
+            logger.error(f"Worker {worker.index} exited with {exitcode}")
+
+        worker.restarts += 1
+        WORKER_RESTARTS.inc(worker=worker.index)
+        worker.start(self._context)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "placement": self.placement,
+                "workers": [worker.to_dict() for worker in self.workers],
+                "lost_rooms": list(self.lost_rooms),
+                "draining": self.draining,
+            }
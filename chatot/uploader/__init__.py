@@ -1,3 +1,5 @@
-from .main import upload_file
+from .main import upload_file, upload_bytes
+from .multipart import MultipartUploadWriter
+from .service import UploadService
 
-__all__ = ["upload_file"]
+__all__ = ["upload_file", "upload_bytes", "MultipartUploadWriter", "UploadService"]
@@ -1,16 +1,9 @@
-import boto3
-import os
-from botocore.exceptions import ClientError
+import random
+import threading
+import time
 import logging
-from dotenv import load_dotenv
 
-load_dotenv()
-
-account_id = os.getenv("ACCOUNT_ID")
-access_key_id = os.getenv("ACCESS_KEY_ID")
-access_key_secret = os.getenv("ACCESS_KEY_SECRET")
-bucket_name = os.getenv("BUCKET_NAME")
-domain = os.getenv("CUSTOM_DOMAIN")
+from chatot.settings import get_settings
 
 # Configure logging
 logging.basicConfig(
@@ -18,28 +11,84 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+_client = None
+_client_lock = threading.Lock()
+
 
 def get_s3_client():
-    if (
-        account_id is None
-        or access_key_id is None
-        or access_key_secret is None
-        or bucket_name is None
-    ):
-        logger.error(f"Env values: account id: {account_id}, key_id: {access_key_id}, key_secret: {access_key_secret}, bucket: {bucket_name}")
+    """
+    Return the process-wide R2 client, creating it on first use.
+    boto3 clients are thread-safe, so every upload shares one connection pool.
+    boto3 is only imported then, it takes longer to import than the rest of the API.
+    """
+    global _client
+
+    settings = get_settings()
+    if not settings.storage_configured:
+        logger.error(
+            f"Env values: account id: {settings.account_id}, key_id: {settings.access_key_id}, "
+            f"key_secret: {settings.access_key_secret}, bucket: {settings.bucket_name}"
+        )
         raise Exception(
             "Account ID, Access Key Id, Access Key Secret or Bucket Name is not present"
         )
 
-    r2 = boto3.client(
-        "s3",
-        endpoint_url=f"https://{account_id}.r2.cloudflarestorage.com",
-        aws_access_key_id=access_key_id,
-        aws_secret_access_key=access_key_secret,
-        region_name="auto"
-    )
+    with _client_lock:
+        if _client is None:
+            import boto3
+            from botocore.config import Config
+
+            _client = boto3.client(
+                "s3",
+                endpoint_url=settings.storage_endpoint,
+                aws_access_key_id=settings.access_key_id,
+                aws_secret_access_key=settings.access_key_secret,
+                region_name="auto",
+                config=Config(
+                    max_pool_connections=settings.upload_max_pool_connections,
+                    connect_timeout=10,
+                    read_timeout=60,
+                    tcp_keepalive=True,
+                    # Retries are handled by `with_backoff` so they are visible in job timings
+                    retries={"max_attempts": 1, "mode": "standard"},
+                ),
+            )
+
+    return _client
 
-    return r2
+
+def get_object_url(object_name: str) -> str:
+    settings = get_settings()
+    if settings.custom_domain:
+        return f"https://{settings.custom_domain}/{object_name}"
+    return f"{settings.storage_endpoint}/{settings.bucket_name}/{object_name}"
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter for the given (zero based) attempt."""
+    settings = get_settings()
+    return random.uniform(0, min(settings.upload_backoff_max, settings.upload_backoff_base * (2 ** attempt)))
+
+
+def with_backoff(fn, description: str, tries: int | None = None):
+    """
+    Call `fn` until it succeeds, sleeping with exponential backoff and jitter between attempts.
+
+    Returns:
+        tuple: (result, attempts)
+    """
+    if tries is None:
+        tries = get_settings().upload_max_tries
+
+    for attempt in range(tries):
+        try:
+            return fn(), attempt + 1
+        except Exception as e:
+            logger.error(f"Error occurred while {description} (attempt {attempt + 1}/{tries}): {e}")
+            if attempt + 1 < tries:
+                time.sleep(backoff_delay(attempt))
+
+    raise Exception(f"Unable to complete {description}")
 
 
 def upload_file(file_name: str, object_name=None):
@@ -47,17 +96,32 @@ def upload_file(file_name: str, object_name=None):
         object_name = file_name
 
     r2 = get_s3_client()
+    bucket_name = get_settings().bucket_name
 
-    upload_try = 0
+    try:
+        with_backoff(
+            lambda: r2.upload_file(file_name, bucket_name, object_name),
+            description=f"uploading {object_name}",
+        )
+    except Exception:
+        raise Exception("Unable to upload file")
 
-    while upload_try < 3:
-        try:
-            r2.upload_file(file_name, bucket_name, object_name)
-            uploaded_file_url = f"https://{domain}/{object_name}" if domain else f"https://{account_id}.r2.cloudflarestorage.com/{bucket_name}/{object_name}"
-            return uploaded_file_url
-        except ClientError as e:
-            logger.error(f"Error occurred while uploading file: {e}")
-        finally:
-            upload_try = upload_try + 1
-
-    raise Exception("Unable to upload file")
+    return get_object_url(object_name)
+
+
+def upload_bytes(data: bytes, object_name: str, content_type: str = "application/octet-stream"):
+    """
+    Upload an in-memory object, e.g. a JSON index, with the same retries as `upload_file`.
+    """
+    r2 = get_s3_client()
+    bucket_name = get_settings().bucket_name
+
+    try:
+        with_backoff(
+            lambda: r2.put_object(Bucket=bucket_name, Key=object_name, Body=data, ContentType=content_type),
+            description=f"uploading {object_name}",
+        )
+    except Exception:
+        raise Exception("Unable to upload file")
+
+    return get_object_url(object_name)
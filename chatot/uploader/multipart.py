@@ -0,0 +1,276 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Deque, List
+
+from .main import get_object_url, get_s3_client, upload_file, with_backoff
+
+from chatot.log import base_logger
+from chatot.settings import get_settings
+
+logger = base_logger.getChild(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _part_executor() -> ThreadPoolExecutor:
+    """Threads uploading parts, shared by every recording and started with the first one."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=get_settings().multipart_upload_workers,
+                thread_name_prefix="chatot-multipart",
+            )
+        return _executor
+
+
+@dataclass(slots=True)
+class UploadPart:
+    """
+    A part of a multipart upload, and where its bytes are until it is sent.
+
+    Attributes:
+        number: Part number, from 1.
+        offset: Where the part starts in the recording.
+        size: Bytes in the part.
+        data: The part's bytes, or None when they are read back from the local file.
+        future: Resolves with the part's entry for `CompleteMultipartUpload`.
+    """
+
+    number: int
+    offset: int
+    size: int
+    data: bytes | None = None
+    future: Future = field(default_factory=Future)
+
+
+class MultipartUploadWriter:
+    """
+    Write-only file object that streams a recording to R2 while it is being muxed.
+
+    Bytes are buffered into parts of `MULTIPART_PART_SIZE` (8 MiB by default) and
+    each full part is uploaded in the background, so when the recording stops only
+    the last part and `CompleteMultipartUpload` remain. Recordings smaller than one
+    part are sent with a single `PutObject` instead.
+
+    `write` runs on the encoder pool, so it never touches the network or waits:
+    the multipart upload is created by the first part's upload thread, and parts cut
+    while `MULTIPART_PARTS_IN_FLIGHT` are uploading wait their turn in the local file
+    (or in memory without one) instead of holding up the encoder.
+
+    Everything written is also kept in `local_path` (when given). If a part cannot be
+    uploaded, the multipart upload is aborted and `complete` falls back to uploading
+    that local file. The local copy is removed once the streaming upload succeeds.
+    """
+
+    def __init__(self, object_name: str, local_path: str | None = None):
+        """
+        Args:
+            object_name: Key of the object in the bucket.
+            local_path: Local fallback copy of the recording, or None to keep nothing on disk.
+        """
+        self.object_name = object_name
+        self.local_path = local_path
+        settings = get_settings()
+        self.client = get_s3_client()
+        self.bucket_name = settings.bucket_name
+        self.part_size = settings.multipart_part_size
+        self.upload_id = None
+        self.failed = False
+        self.closed = False
+        self.bytes_written = 0
+
+        self._buffer = bytearray()
+        self._parts: List[UploadPart] = []
+        self._waiting: Deque[UploadPart] = deque()
+        self._max_in_flight = max(1, settings.multipart_parts_in_flight)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._create_lock = threading.Lock()
+        self._local_file = None
+
+        if local_path:
+            local_dir = os.path.dirname(local_path)
+            if local_dir:
+                os.makedirs(local_dir, exist_ok=True)
+            self._local_file = open(local_path, "wb")
+
+    def write(self, data) -> int:
+        if self._local_file:
+            self._local_file.write(data)
+
+        size = len(data)
+        self.bytes_written += size
+
+        if not self.failed:
+            self._buffer += data
+            if len(self._buffer) >= self.part_size:
+                self._flush_part()
+
+        return size
+
+    def close(self):
+        """No-op so PyAV can close the container; use `complete` to finish the upload."""
+        pass
+
+    def _flush_part(self):
+        """Cut the buffered bytes into the next part and send it, or queue it if enough parts are uploading."""
+        size = len(self._buffer)
+        part = UploadPart(
+            number=len(self._parts) + 1,
+            offset=self.bytes_written - size,
+            size=size,
+            data=bytes(self._buffer),
+        )
+        self._buffer.clear()
+        self._parts.append(part)
+
+        with self._lock:
+            if self._in_flight < self._max_in_flight:
+                self._in_flight += 1
+            else:
+                if self._local_file:
+                    # Already in the local file, read back once it is its turn
+                    if not self._local_file.closed:
+                        self._local_file.flush()
+                    part.data = None
+                self._waiting.append(part)
+                return
+        _part_executor().submit(self._upload_part, part)
+
+    def _upload_part(self, part: UploadPart):
+        try:
+            if self.failed:
+                raise Exception("Streaming upload already failed")
+            self._create()
+            data = part.data if part.data is not None else self._read_back(part)
+            response, _ = with_backoff(
+                lambda: self.client.upload_part(
+                    Bucket=self.bucket_name,
+                    Key=self.object_name,
+                    UploadId=self.upload_id,
+                    PartNumber=part.number,
+                    Body=data,
+                ),
+                description=f"uploading part {part.number} of {self.object_name}",
+            )
+            part.future.set_result(
+                {"PartNumber": part.number, "ETag": response["ETag"]}
+            )
+        except Exception as e:
+            self._fail()
+            part.future.set_exception(e)
+        finally:
+            part.data = None
+            self._next_part()
+
+    def _next_part(self):
+        """Hand the slot of a finished part to the next waiting one."""
+        with self._lock:
+            if not self._waiting:
+                self._in_flight -= 1
+                return
+            part = self._waiting.popleft()
+        _part_executor().submit(self._upload_part, part)
+
+    def _create(self):
+        """Start the multipart upload, once, from the first part to be sent."""
+        with self._create_lock:
+            if self.upload_id is None:
+                response, _ = with_backoff(
+                    lambda: self.client.create_multipart_upload(
+                        Bucket=self.bucket_name, Key=self.object_name
+                    ),
+                    description=f"starting multipart upload of {self.object_name}",
+                )
+                self.upload_id = response["UploadId"]
+
+    def _read_back(self, part: UploadPart) -> bytes:
+        with open(self.local_path, "rb") as local_file:
+            local_file.seek(part.offset)
+            return local_file.read(part.size)
+
+    def _fail(self):
+        if self.failed:
+            return
+        self.failed = True
+        self._buffer.clear()
+        logger.warning(
+            f"Streaming upload of {self.object_name} failed, falling back to the local file"
+        )
+
+    def _abort(self):
+        if self.upload_id is None:
+            return
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket_name, Key=self.object_name, UploadId=self.upload_id
+            )
+        except Exception as e:
+            logger.error(f"Error aborting multipart upload for {self.object_name}: {e}")
+
+    def complete(self) -> str:
+        """
+        Upload the last part and complete the multipart upload.
+
+        Returns:
+            str: URL of the uploaded object
+
+        Raises:
+            Exception: If neither the streaming upload nor the local fallback succeeded
+        """
+        if self.closed:
+            raise Exception("Upload already completed")
+        self.closed = True
+
+        if self._local_file:
+            self._local_file.close()
+
+        if not self.failed:
+            try:
+                if not self._parts:
+                    # Never filled a part, a single request is enough
+                    data = bytes(self._buffer)
+                    with_backoff(
+                        lambda: self.client.put_object(
+                            Bucket=self.bucket_name, Key=self.object_name, Body=data
+                        ),
+                        description=f"uploading {self.object_name}",
+                    )
+                else:
+                    if self._buffer:
+                        self._flush_part()
+                    futures = [part.future for part in self._parts]
+                    # Every part has to be done before the upload is completed or aborted
+                    wait(futures)
+                    parts = [future.result() for future in futures]
+                    if not self.failed:
+                        with_backoff(
+                            lambda: self.client.complete_multipart_upload(
+                                Bucket=self.bucket_name,
+                                Key=self.object_name,
+                                UploadId=self.upload_id,
+                                MultipartUpload={"Parts": parts},
+                            ),
+                            description=f"completing multipart upload of {self.object_name}",
+                        )
+            except Exception as e:
+                logger.error(
+                    f"Error completing streaming upload of {self.object_name}: {e}"
+                )
+                self._fail()
+
+        if not self.failed:
+            if self.local_path:
+                os.remove(self.local_path)
+            return get_object_url(self.object_name)
+
+        self._abort()
+        if not self.local_path:
+            raise Exception("Unable to upload file")
+
+        return upload_file(file_name=self.local_path, object_name=self.object_name)
@@ -0,0 +1,232 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable
+
+from .main import upload_bytes, upload_file
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+logger = base_logger.getChild(__name__)
+
+UPLOADS = Counter("chatot_uploads_total", "Finished upload jobs.", ("outcome",))
+UPLOAD_BYTES = Counter("chatot_upload_bytes_total", "Bytes uploaded successfully.")
+UPLOAD_DURATION = Histogram(
+    "chatot_upload_duration_seconds",
+    "Time an upload job spent running, retries included.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+UPLOAD_QUEUE_WAIT = Histogram(
+    "chatot_upload_queue_wait_seconds",
+    "Time an upload job waited for a worker.",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0),
+)
+
+
+class UploadFuture(Future):
+    """A future that also carries its `UploadJob`, so callbacks can read its timings."""
+
+    job: "UploadJob"
+
+
+@dataclass(slots=True)
+class UploadJob:
+    """
+    A queued upload and its timings (seconds since the epoch).
+    """
+
+    object_name: str
+    run: Callable[[], str]
+    future: UploadFuture = field(default_factory=UploadFuture)
+    size: int = 0
+    enqueued_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+
+    def __post_init__(self):
+        self.future.job = self
+
+    def timings(self) -> dict:
+        return {
+            "object_name": self.object_name,
+            "bytes": self.size,
+            "queued_ms": round(
+                ((self.started_at or self.enqueued_at) - self.enqueued_at) * 1000, 1
+            ),
+            "upload_ms": round(
+                ((self.finished_at or self.started_at or 0) - (self.started_at or 0))
+                * 1000,
+                1,
+            ),
+            "error": self.error,
+        }
+
+
+class UploadService:
+    """
+    Process-wide upload queue drained by `UPLOAD_WORKERS` threads.
+
+    Implemented as a singleton: every room shares the same workers and the
+    pooled R2 client from `get_s3_client`. Jobs return a future so the room's
+    event loop never waits on network I/O.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(UploadService, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, workers: int | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        if workers is None:
+            workers = int(os.getenv("UPLOAD_WORKERS") or 4)
+
+        self.jobs: queue.Queue[UploadJob] = queue.Queue()
+        self.recent_jobs = deque(maxlen=100)
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(
+                target=self._work, name=f"chatot-upload-{index}", daemon=True
+            )
+            for index in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        MetricsRegistry().add_collector(self.collect)
+
+        self._initialized = True
+        logger.info(f"Upload service started with {len(self._workers)} workers")
+
+    @property
+    def queue_depth(self) -> int:
+        return self.jobs.qsize()
+
+    def submit(self, file_name: str, object_name: str | None = None) -> UploadFuture:
+        """
+        Queue a local file for upload.
+
+        Returns:
+            UploadFuture: Resolves with the uploaded file url
+        """
+        if object_name is None:
+            object_name = file_name
+
+        job = UploadJob(
+            object_name=object_name,
+            run=lambda: upload_file(file_name=file_name, object_name=object_name),
+            size=os.path.getsize(file_name) if os.path.exists(file_name) else 0,
+        )
+        return self._enqueue(job)
+
+    def submit_bytes(
+        self,
+        data: bytes,
+        object_name: str,
+        content_type: str = "application/octet-stream",
+    ) -> UploadFuture:
+        """
+        Queue an in-memory object for upload.
+
+        Returns:
+            UploadFuture: Resolves with the uploaded object url
+        """
+        job = UploadJob(
+            object_name=object_name,
+            run=lambda: upload_bytes(
+                data=data, object_name=object_name, content_type=content_type
+            ),
+            size=len(data),
+        )
+        return self._enqueue(job)
+
+    def submit_call(
+        self, object_name: str, run: Callable[[], str], size: int = 0
+    ) -> UploadFuture:
+        """
+        Queue any blocking upload step, e.g. completing a streaming upload.
+
+        Returns:
+            UploadFuture: Resolves with the value returned by `run`
+        """
+        return self._enqueue(UploadJob(object_name=object_name, run=run, size=size))
+
+    def _enqueue(self, job: UploadJob) -> UploadFuture:
+        self.jobs.put(job)
+        return job.future
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            with self._lock:
+                self.in_flight += 1
+            job.started_at = time.time()
+
+            result, error = None, None
+            try:
+                result = job.run()
+            except Exception as e:
+                error = e
+                job.error = str(e)
+            job.finished_at = time.time()
+
+            with self._lock:
+                if error:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+                self.recent_jobs.append(job.timings())
+            logger.info(f"Upload job finished: {job.timings()}")
+
+            UPLOADS.inc(outcome="failure" if error else "success")
+            UPLOAD_DURATION.observe(job.finished_at - job.started_at)
+            UPLOAD_QUEUE_WAIT.observe(job.started_at - job.enqueued_at)
+            if not error:
+                UPLOAD_BYTES.inc(job.size)
+
+            if error:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+            # Only now: the future's callbacks queue the webhooks a drain waits for
+            with self._lock:
+                self.in_flight -= 1
+            self.jobs.task_done()
+
+    def collect(self) -> list:
+        """Queue depth and in-flight uploads, for `/metrics`."""
+        queued = Gauge(
+            "chatot_upload_queue_depth",
+            "Upload jobs waiting for a worker.",
+            register=False,
+        )
+        queued.set(self.queue_depth)
+        in_flight = Gauge(
+            "chatot_uploads_in_flight", "Upload jobs running.", register=False
+        )
+        in_flight.set(self.in_flight)
+        return [queued, in_flight]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queue_depth": self.queue_depth,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "recent_jobs": list(self.recent_jobs),
+            }
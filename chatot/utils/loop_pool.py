@@ -0,0 +1,189 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import Future
+from typing import Coroutine, List
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Gauge, Histogram, MetricsRegistry
+
+logger = base_logger.getChild(__name__)
+
+LOOP_LAG = Histogram(
+    "chatot_event_loop_lag_seconds",
+    "How late a periodic timer fired on each event loop.",
+    labelnames=("loop",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+class LoopWorker:
+    """
+    A single event loop running forever on its own daemon thread.
+
+    Many room sessions share one worker; `sessions` counts how many are
+    currently placed on it so the pool can pick the least-loaded loop.
+    `lag` is how late the last `LOOP_LAG_INTERVAL` timer fired on the loop.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.name = f"chatot-loop-{index}"
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_exception_handler(self._exception_handler)
+        self.sessions = 0
+        self.lag = 0.0
+        self.lag_interval = float(os.getenv("LOOP_LAG_INTERVAL") or 0.5)
+        self.thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+
+    def _exception_handler(self, loop, context):
+        exception = context.get("exception")
+        message = context.get("message")
+        logger.error(f"Unhandled exception in event loop {self.name}: {message}")
+        if exception:
+            logger.exception("Exception details:", exc_info=exception)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            try:
+                pending = asyncio.all_tasks(self.loop)
+                for task in pending:
+                    task.cancel()
+
+                if pending:
+                    self.loop.run_until_complete(
+                        asyncio.gather(*pending, return_exceptions=True)
+                    )
+
+                self.loop.close()
+            except Exception as close_err:
+                logger.error(f"Error closing event loop {self.name}: {close_err}")
+            finally:
+                logger.info(f"Event loop {self.name} closed")
+
+    async def _probe_lag(self):
+        while True:
+            started = self.loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.lag = max(0.0, self.loop.time() - started - self.lag_interval)
+            LOOP_LAG.observe(self.lag, loop=self.name)
+
+    def start(self):
+        self.thread.start()
+        self.submit(self._probe_lag())
+
+    def submit(self, coro: Coroutine) -> Future:
+        """
+        Schedule a coroutine on this worker's loop from any thread.
+
+        Returns:
+            concurrent.futures.Future: Resolves with the coroutine's result
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class LoopPool:
+    """
+    Fixed-size pool of event loops shared by all room sessions.
+
+    Implemented as a singleton, the pool is created on first use with
+    `LOOP_POOL_SIZE` loops (defaults to the number of cores) and rooms are
+    placed on whichever loop currently hosts the fewest sessions.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(LoopPool, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, size: int | None = None):
+        """
+        Initialize the pool and start its loops.
+        Size is only honoured on first initialization.
+
+        Args:
+            size (int, optional): Number of event loops to run.
+        """
+        if getattr(self, "_initialized", False):
+            return
+
+        if size is None:
+            size = int(os.getenv("LOOP_POOL_SIZE") or os.cpu_count() or 1)
+
+        self._lock = threading.Lock()
+        self.workers: List[LoopWorker] = [
+            LoopWorker(index) for index in range(max(1, size))
+        ]
+        for worker in self.workers:
+            worker.start()
+
+        MetricsRegistry().add_collector(self.collect)
+
+        self._initialized = True
+        logger.info(f"Loop pool started with {len(self.workers)} event loops")
+
+    def acquire(self) -> LoopWorker:
+        """
+        Reserve a slot on the least-loaded loop.
+
+        Returns:
+            LoopWorker: The worker the new session should run on
+        """
+        with self._lock:
+            worker = min(self.workers, key=lambda w: w.sessions)
+            worker.sessions += 1
+            return worker
+
+    def release(self, worker: LoopWorker):
+        """
+        Give back a slot reserved with `acquire`.
+        """
+        with self._lock:
+            worker.sessions = max(0, worker.sessions - 1)
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {
+                    "loop": w.name,
+                    "sessions": w.sessions,
+                    "lag_ms": round(w.lag * 1000, 3),
+                }
+                for w in self.workers
+            ]
+
+    def collect(self) -> list:
+        """Rooms per loop and current loop lag, for `/metrics`."""
+        rooms = Gauge(
+            "chatot_active_rooms", "Rooms placed on the loop pool.", register=False
+        )
+        sessions = Gauge(
+            "chatot_loop_sessions",
+            "Rooms placed on each event loop.",
+            ("loop",),
+            register=False,
+        )
+        lag = Gauge(
+            "chatot_loop_lag_seconds",
+            "Lag of the last timer on each event loop.",
+            ("loop",),
+            register=False,
+        )
+        for stats, worker in zip(self.stats(), self.workers):
+            sessions.set(stats["sessions"], loop=worker.name)
+            lag.set(worker.lag, loop=worker.name)
+        rooms.set(sum(worker.sessions for worker in self.workers))
+        return [rooms, sessions, lag]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.stop()
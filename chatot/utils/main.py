@@ -1,6 +1,32 @@
 import random
 import string
+import threading
+from concurrent.futures import Future
+from typing import Callable, List
 
 def get_random_string(length: int) -> str:
     result_str = ''.join(random.choice(string.ascii_letters) for i in range(length))
     return result_str
+
+
+def when_all(futures: List[Future], callback: Callable[[List[Future]], None]):
+    """
+    Call `callback(futures)` once every future is done, from the thread that finished last.
+    """
+    if not futures:
+        callback(futures)
+        return
+
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def on_done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            finished = remaining == 0
+        if finished:
+            callback(futures)
+
+    for future in futures:
+        future.add_done_callback(on_done)
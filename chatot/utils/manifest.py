@@ -0,0 +1,97 @@
+"""
+One JSON document per room that says where every track sits in time.
+
+`RoomManifest` collects the tracks of a room as they are recorded: peer, bucket key,
+format, size and the track's timing (`TrackTimeline.to_dict`), with its start
+offset relative to when the room was joined. Once the room is left and every track
+has been uploaded or failed, the manifest is uploaded next to the recordings as
+`recordings/<room>-<session>.manifest.json`, so a downstream job can line the
+tracks up from one GET instead of realigning them itself.
+"""
+
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from typing import Callable, Dict
+
+from chatot.utils.main import when_all
+from chatot.utils.types import ManifestTrack, RoomManifestData
+
+
+class RoomManifest:
+    """
+    Args:
+        room_id: The Huddle01 room.
+        session_id: The `/start` session, a random id if None.
+    """
+
+    def __init__(self, room_id: str, session_id: str | None = None):
+        self.room_id = room_id
+        self.session_id = session_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self.ended_at = None
+        self.object_name = f"recordings/{room_id}-{self.session_id}.manifest.json"
+        self.tracks: Dict[str, ManifestTrack] = {}
+        # Resolved once the track is uploaded or failed
+        self._done: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def add_track(self, track_id: str, peer_id: str, object_name: str, format: str):
+        with self._lock:
+            self.tracks[track_id] = ManifestTrack(
+                track_id=track_id,
+                peer_id=peer_id,
+                object_name=object_name,
+                url=None,
+                format=format,
+                size=None,
+                segments=0,
+                timing=None,
+                error=None,
+            )
+            self._done[track_id] = Future()
+
+    def track_done(
+        self,
+        track_id: str,
+        url: str | None = None,
+        size: int | None = None,
+        segments: int = 0,
+        timing: dict | None = None,
+        error: str | None = None,
+    ):
+        """Record how a track ended. Called from upload workers."""
+        with self._lock:
+            track = self.tracks.get(track_id)
+            done = self._done.get(track_id)
+            if track is None or done.done():
+                return
+            track.update(
+                url=url, size=size, segments=segments, timing=timing, error=error
+            )
+        done.set_result(track_id)
+
+    def to_dict(self) -> RoomManifestData:
+        with self._lock:
+            return RoomManifestData(
+                room_id=self.room_id,
+                session_id=self.session_id,
+                started_at=self.started_at,
+                ended_at=self.ended_at,
+                tracks=[dict(track) for track in self.tracks.values()],
+            )
+
+    def to_json(self) -> bytes:
+        return json.dumps(self.to_dict()).encode()
+
+    def close(self, callback: Callable[["RoomManifest"], None]):
+        """
+        The room was left: call `callback(manifest)` once every track is done, from the
+        thread that finished the last one.
+        """
+        with self._lock:
+            self.ended_at = time.time()
+            futures = list(self._done.values())
+        when_all(futures, lambda _: callback(self))
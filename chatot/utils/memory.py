@@ -0,0 +1,127 @@
+"""
+Garbage collector settings for a long running recording node.
+
+Frames, packets and their buffers are freed by reference counting as soon as they
+are encoded, so the cyclic collector only has to deal with the few container
+objects that survive a frame: futures, spans, session state. Its default
+thresholds (700, 10, 10) still run a young collection every few frames at high
+concurrency, and every full collection walks everything imported at startup.
+
+`tune_gc` raises the thresholds (`GC_THRESHOLDS`, "20000,20,50" by default) and
+freezes the objects alive at startup into the permanent generation, so collections
+only look at what the rooms allocate. Collections are timed and exported as metrics.
+"""
+
+import gc
+import os
+import time
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+logger = base_logger.getChild(__name__)
+
+DEFAULT_GC_THRESHOLDS = (20000, 20, 50)
+
+GC_PAUSE = Histogram(
+    "chatot_gc_pause_seconds",
+    "Time the cyclic garbage collector stopped the process, per collection.",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+_collection_started = None
+_paused = 0.0
+
+
+def _time_collection(phase: str, info: dict):
+    global _collection_started, _paused
+    if phase == "start":
+        _collection_started = time.perf_counter()
+    elif _collection_started is not None:
+        pause = time.perf_counter() - _collection_started
+        _paused += pause
+        GC_PAUSE.observe(pause)
+        _collection_started = None
+
+
+def gc_paused() -> float:
+    """Seconds spent in timed collections since `tune_gc`."""
+    return _paused
+
+
+def gc_thresholds() -> tuple:
+    """
+    Thresholds from `GC_THRESHOLDS`, e.g. "20000,20,50".
+
+    Raises:
+        ValueError: If it is not one to three positive integers
+    """
+    value = os.getenv("GC_THRESHOLDS")
+    if not value:
+        return DEFAULT_GC_THRESHOLDS
+    thresholds = tuple(int(part) for part in value.split(","))
+    if not 1 <= len(thresholds) <= 3 or any(threshold <= 0 for threshold in thresholds):
+        raise ValueError(
+            f"GC_THRESHOLDS must be one to three positive integers, got {value}"
+        )
+    return thresholds
+
+
+def tune_gc(freeze: bool = True):
+    """
+    Apply `gc_thresholds` and start timing collections. Call once startup is done,
+    with `freeze` the objects created so far are moved out of the collector's reach.
+    """
+    try:
+        thresholds = gc_thresholds()
+    except ValueError as e:
+        logger.error(f"{e}, keeping the default thresholds")
+        thresholds = DEFAULT_GC_THRESHOLDS
+
+    gc.set_threshold(*thresholds)
+    if _time_collection not in gc.callbacks:
+        gc.callbacks.append(_time_collection)
+    if freeze:
+        # Collect first so garbage from startup is not frozen with the rest
+        gc.collect()
+        gc.freeze()
+    logger.info(
+        f"GC thresholds {gc.get_threshold()}, {gc.get_freeze_count()} objects frozen"
+    )
+
+
+def collect():
+    collections = Counter(
+        "chatot_gc_collections_total",
+        "Collections run, per generation.",
+        ("generation",),
+        register=False,
+    )
+    collected = Counter(
+        "chatot_gc_collected_objects_total",
+        "Unreachable objects freed, per generation.",
+        ("generation",),
+        register=False,
+    )
+    pending = Gauge(
+        "chatot_gc_pending_objects",
+        "Count towards the next collection of each generation.",
+        ("generation",),
+        register=False,
+    )
+    frozen = Gauge(
+        "chatot_gc_frozen_objects",
+        "Objects in the permanent generation.",
+        register=False,
+    )
+
+    counts = gc.get_count()
+    for generation, stats in enumerate(gc.get_stats()):
+        collections.inc(stats["collections"], generation=str(generation))
+        collected.inc(stats["collected"], generation=str(generation))
+        pending.set(counts[generation], generation=str(generation))
+    frozen.set(gc.get_freeze_count())
+    return [collections, collected, pending, frozen]
+
+
+MetricsRegistry().add_collector(collect)
@@ -0,0 +1,267 @@
+"""
+Minimal Prometheus metrics, served in the text exposition format by `/metrics`.
+
+There are two ways to publish a value:
+    Counters, gauges and histograms are created at import time and updated where
+    the work happens. An update is a dict lookup and a few additions under a lock,
+    which is noise next to encoding a frame or making a request.
+    Collectors are callables registered with `MetricsRegistry.add_collector`. They
+    read state the hot path keeps anyway (per-track frame counters, queue depths,
+    loop lag) when `/metrics` is scraped, so nothing extra runs per frame.
+"""
+
+import bisect
+import math
+import os
+import threading
+from typing import Callable, Iterable, List
+
+import psutil
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """
+    Base class for a metric family with optional labels.
+
+    Args:
+        name: Metric name, e.g. "chatot_uploads_total".
+        documentation: HELP text.
+        labelnames: Names of the labels every update has to pass.
+        register: Add the metric to `MetricsRegistry`; collectors build unregistered ones.
+    """
+
+    type = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        register: bool = True,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if register:
+            MetricsRegistry().register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        """Drop a label set, e.g. when a track ends."""
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def samples(self) -> List[tuple]:
+        """(name suffix, labels, value) for every sample of the family."""
+        with self._lock:
+            return [
+                ("", dict(zip(self.labelnames, key)), value)
+                for key, value in self._values.items()
+            ]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+        register: bool = True,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super(Histogram, self).__init__(name, documentation, labelnames, register)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> List[tuple]:
+        with self._lock:
+            values = [
+                (key, list(counts), total, count)
+                for key, (counts, total, count) in self._values.items()
+            ]
+
+        samples = []
+        for key, counts, total, count in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                samples.append(
+                    ("_bucket", {**labels, "le": _format_value(bound)}, cumulative)
+                )
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class MetricsRegistry:
+    """
+    Process-wide set of metrics and collectors, rendered by `/metrics`.
+    Implemented as a singleton.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(MetricsRegistry, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self):
+        if getattr(self, "_initialized", False):
+            return
+
+        self._lock = threading.Lock()
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Metric]]] = [collect_process]
+        self._initialized = True
+
+    def register(self, metric: Metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def add_collector(self, collector: Callable[[], Iterable[Metric]]):
+        """
+        Register a callable returning unregistered metrics, called on every scrape.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> List[Metric]:
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        for collector in collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as e:
+                # A broken collector must not take the whole endpoint down
+                from chatot.log import base_logger
+
+                base_logger.getChild(__name__).error(
+                    f"Error collecting metrics from {collector}: {e}"
+                )
+        return metrics
+
+    def render(self) -> str:
+        """The Prometheus text exposition format of every metric."""
+        lines = []
+        for metric in self.collect():
+            lines.append(f"# HELP {metric.name} {_escape(metric.documentation)}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for suffix, labels, value in metric.samples():
+                if labels:
+                    label_text = ",".join(
+                        f'{name}="{_escape(str(label))}"'
+                        for name, label in labels.items()
+                    )
+                    lines.append(
+                        f"{metric.name}{suffix}{{{label_text}}} {_format_value(value)}"
+                    )
+                else:
+                    lines.append(f"{metric.name}{suffix} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def collect_process() -> List[Metric]:
+    """Resident memory, CPU time, threads and open files of this process."""
+    process = psutil.Process(os.getpid())
+    with process.oneshot():
+        cpu = process.cpu_times()
+        memory = process.memory_info()
+        threads = process.num_threads()
+        try:
+            open_fds = process.num_fds()
+        except AttributeError:
+            open_fds = None
+
+    rss = Gauge(
+        "process_resident_memory_bytes",
+        "Resident memory size in bytes.",
+        register=False,
+    )
+    rss.set(memory.rss)
+    cpu_seconds = Counter(
+        "process_cpu_seconds_total",
+        "Total user and system CPU time spent in seconds.",
+        register=False,
+    )
+    cpu_seconds.inc(cpu.user + cpu.system)
+    thread_count = Gauge(
+        "process_threads", "Number of OS threads in the process.", register=False
+    )
+    thread_count.set(threads)
+
+    metrics = [rss, cpu_seconds, thread_count]
+    if open_fds is not None:
+        fds = Gauge(
+            "process_open_fds", "Number of open file descriptors.", register=False
+        )
+        fds.set(open_fds)
+        metrics.append(fds)
+    return metrics
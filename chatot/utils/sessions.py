@@ -0,0 +1,275 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+from chatot.log import base_logger
+from chatot.utils.loop_pool import LoopWorker
+from chatot.utils.metrics import Gauge, MetricsRegistry
+from chatot.utils.tracing import Trace
+from chatot.utils.types import SessionStatus, TrackStatus
+
+logger = base_logger.getChild(__name__)
+
+SESSION_QUEUED = "queued"
+SESSION_JOINING = "joining"
+SESSION_RECORDING = "recording"
+SESSION_LEAVING = "leaving"
+SESSION_UPLOADING = "uploading"
+SESSION_DONE = "done"
+SESSION_FAILED = "failed"
+SESSION_STATES = (
+    SESSION_QUEUED,
+    SESSION_JOINING,
+    SESSION_RECORDING,
+    SESSION_LEAVING,
+    SESSION_UPLOADING,
+    SESSION_DONE,
+    SESSION_FAILED,
+)
+FINISHED_STATES = (SESSION_DONE, SESSION_FAILED)
+
+TRACK_RECORDING = "recording"
+TRACK_UPLOADING = "uploading"
+TRACK_DONE = "done"
+TRACK_FAILED = "failed"
+FINISHED_TRACK_STATES = (TRACK_DONE, TRACK_FAILED)
+
+# Rooms below `ADMISSION_SHED_BELOW_PRIORITY` (1 by default) may be stopped under load
+DEFAULT_PRIORITY = 1
+
+
+@dataclass(slots=True)
+class Session:
+    """
+    One `/start` of a room and everything that happens to it until its recordings are uploaded.
+
+    A session moves joining -> recording -> leaving -> uploading -> done, or to failed
+    from any of them. It starts out queued instead of joining when admission control
+    holds it until the node has room. It stays "uploading" until every track is done or failed.
+    State changes may come from the Flask thread, the room's event loop or an upload
+    worker, so they all go through the session's lock.
+
+    `stop_callback` is set once the room is joined and schedules leaving it on the room's loop.
+    `priority` decides the order queued sessions are admitted in and which rooms are shed
+    first; `stop_reason` says why a session was stopped by chatot rather than `/stop`.
+    `trace` collects the latency spans of the session and its tracks, see `chatot.utils.tracing`.
+    """
+
+    room_id: str
+    recording_options: Any = None
+    session_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    state: str = SESSION_JOINING
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    worker: LoopWorker | None = None
+    manager: Any = None
+    priority: int = DEFAULT_PRIORITY
+    stop_requested: bool = False
+    stop_reason: str | None = None
+    stop_callback: Callable[[], Any] | None = field(default=None, repr=False)
+    tracks: Dict[str, TrackStatus] = field(default_factory=dict)
+    on_finish: Callable[["Session"], None] | None = field(default=None, repr=False)
+    trace: Trace | None = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def __post_init__(self):
+        if self.trace is None:
+            self.trace = Trace(
+                trace_id=self.session_id,
+                **{"room.id": self.room_id, "session.id": self.session_id},
+            )
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def set_state(self, state: str, error: str | None = None) -> bool:
+        """
+        Move to `state` unless the session already finished.
+
+        Returns:
+            bool: Whether the state changed
+        """
+        with self._lock:
+            if self.finished:
+                return False
+            self._set(state, error)
+        self._notify()
+        return True
+
+    def left(self):
+        """The room was left: wait for uploads, or finish if none are pending."""
+        with self._lock:
+            if self.finished:
+                return
+            self._set(SESSION_UPLOADING if self._pending_tracks() else SESSION_DONE)
+        self._notify()
+
+    def add_track(self, track_id: str, peer_id: str, object_name: str):
+        with self._lock:
+            self.tracks[track_id] = TrackStatus(
+                peer_id=peer_id,
+                state=TRACK_RECORDING,
+                object_name=object_name,
+                url=None,
+                error=None,
+            )
+            self.updated_at = time.time()
+
+    def update_track(
+        self,
+        track_id: str,
+        state: str,
+        url: str | None = None,
+        error: str | None = None,
+    ):
+        """Record a track's progress, finishing the session once its last upload is done."""
+        with self._lock:
+            track = self.tracks.get(track_id)
+            if track is None:
+                return
+            track["state"] = state
+            if url is not None:
+                track["url"] = url
+            if error is not None:
+                track["error"] = error
+            self.updated_at = time.time()
+            if self.state == SESSION_UPLOADING and not self._pending_tracks():
+                self._set(SESSION_DONE)
+        self._notify()
+
+    def to_dict(self) -> SessionStatus:
+        with self._lock:
+            return SessionStatus(
+                session_id=self.session_id,
+                room_id=self.room_id,
+                state=self.state,
+                error=self.error,
+                priority=self.priority,
+                stop_reason=self.stop_reason,
+                loop=self.worker.name if self.worker else None,
+                created_at=self.created_at,
+                updated_at=self.updated_at,
+                tracks={
+                    track_id: dict(track) for track_id, track in self.tracks.items()
+                },
+            )
+
+    def _pending_tracks(self) -> bool:
+        return any(
+            track["state"] not in FINISHED_TRACK_STATES
+            for track in self.tracks.values()
+        )
+
+    def _set(self, state: str, error: str | None = None):
+        """Called with the lock held."""
+        if state not in SESSION_STATES:
+            raise ValueError(f"Unknown session state: {state}")
+        self.state = state
+        if error is not None:
+            self.error = error
+        self.updated_at = time.time()
+        logger.info(f"Session {self.session_id} ({self.room_id}) is {state}")
+
+    def _notify(self):
+        """Hand a finished session to `on_finish`, exactly once. Called without the lock."""
+        with self._lock:
+            if not self.finished or self.on_finish is None:
+                return
+            on_finish, self.on_finish = self.on_finish, None
+        on_finish(self)
+
+
+class SessionRegistry:
+    """
+    Thread-safe index of room sessions, by session id and by room.
+
+    Implemented as a singleton. A room maps to at most one unfinished session;
+    the last `SESSION_HISTORY` finished sessions are kept for `/status`.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(SessionRegistry, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, history: int | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        if history is None:
+            history = int(os.getenv("SESSION_HISTORY") or 100)
+
+        self.history = max(0, history)
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Session] = {}
+        self._rooms: Dict[str, Session] = {}
+        self._finished = deque()
+
+        MetricsRegistry().add_collector(self.collect)
+        self._initialized = True
+
+    def create(
+        self, room_id: str, recording_options=None, priority: int = DEFAULT_PRIORITY
+    ) -> Session:
+        """
+        Register a new session for `room_id`, replacing the room's current one in the room index.
+        """
+        session = Session(
+            room_id=room_id,
+            recording_options=recording_options,
+            priority=priority,
+            on_finish=self._on_finish,
+        )
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._rooms[room_id] = session
+        return session
+
+    def get(self, session_id: str) -> Session | None:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def active(self, room_id: str) -> Session | None:
+        """The unfinished session of a room, if any."""
+        with self._lock:
+            return self._rooms.get(room_id)
+
+    def active_rooms(self) -> List[str]:
+        with self._lock:
+            return list(self._rooms)
+
+    def sessions(self) -> List[Session]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def _on_finish(self, session: Session):
+        with self._lock:
+            if self._rooms.get(session.room_id) is session:
+                del self._rooms[session.room_id]
+            self._finished.append(session.session_id)
+            while len(self._finished) > self.history:
+                self._sessions.pop(self._finished.popleft(), None)
+
+    def collect(self) -> list:
+        """Sessions per state, for `/metrics`."""
+        counts = dict.fromkeys(SESSION_STATES, 0)
+        for session in self.sessions():
+            counts[session.state] += 1
+        sessions = Gauge(
+            "chatot_sessions",
+            "Room sessions by state, finished ones are kept up to SESSION_HISTORY.",
+            ("state",),
+            register=False,
+        )
+        for state, count in counts.items():
+            sessions.set(count, state=state)
+        return [sessions]
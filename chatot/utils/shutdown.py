@@ -0,0 +1,56 @@
+"""
+Shutting down on SIGTERM and SIGINT without killing work in progress.
+
+`on_shutdown_signal` hands the first signal to a callback, which starts draining
+the process in the background; `stop_serving` then makes the server in the main
+thread return as Ctrl-C would. A second signal stops the process right away.
+"""
+
+import _thread
+import signal
+import threading
+from typing import Callable
+
+from chatot.log import base_logger
+
+logger = base_logger.getChild(__name__)
+
+SHUTDOWN_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+# Exit code of a process whose drain left sessions, uploads or webhooks behind
+EXIT_DRAIN_INCOMPLETE = 3
+
+_stopping = threading.Event()
+
+
+def on_shutdown_signal(callback: Callable[[str], None]):
+    """
+    Call `callback(signal name)` on the first SIGTERM or SIGINT. It runs in the main
+    thread, between two steps of the server, so it has to return quickly.
+    Does nothing outside the main thread, where signal handlers cannot be installed.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+
+    received = []
+
+    def handle(signum, frame):
+        name = signal.Signals(signum).name
+        if _stopping.is_set():
+            # Raised by `stop_serving`
+            raise KeyboardInterrupt
+        if received:
+            logger.warning(f"Received {name} again, stopping now")
+            raise KeyboardInterrupt
+        received.append(name)
+        logger.info(f"Received {name}")
+        callback(name)
+
+    for signum in SHUTDOWN_SIGNALS:
+        signal.signal(signum, handle)
+
+
+def stop_serving():
+    """Make the server running in the main thread return, so the process exits."""
+    _stopping.set()
+    # Delivered as a SIGINT, which the handler then lets through
+    _thread.interrupt_main()
@@ -0,0 +1,329 @@
+"""
+Spans for the path from a room closing to the webhooks of its recordings.
+
+Every session has a `Trace` (its id is the session id). Stages are recorded as spans
+carrying the room, peer and track they belong to:
+
+    room.closed / stop.requested   what ended the recording (instant)
+    room.leave                     leaving the Huddle01 room
+    track                          a recorded track, from its start until its webhook is delivered
+      consumer.close               the consumer was closed (instant)
+      recorder.stop                `stop()` until the recorder emitted "completed"
+      recorder.flush               encoding queued frames and closing the container
+      segments.wait                waiting for the uploads of earlier segments
+      upload.queue, upload         waiting for an upload worker, then uploading
+      webhook.delivery             queued in the outbox until the receiver accepted it
+
+`Trace.breakdown` turns the spans of a track into the `latency` field of its webhook.
+
+Finished spans go to `Tracer`, which exports them when `TRACE_EXPORT` is set:
+"log" writes one JSON line per span to the `trace` child of the base logger, "otlp" posts
+batches in the OTLP/HTTP JSON format to `TRACE_OTLP_ENDPOINT`, e.g. an OpenTelemetry
+collector.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from chatot.log import base_logger
+
+logger = base_logger.getChild(__name__)
+trace_logger = base_logger.getChild("trace")
+
+TRACE_EXPORT_LOG = "log"
+TRACE_EXPORT_OTLP = "otlp"
+
+# Instants that end a recording, in the order they are looked for
+CLOSE_MARKS = ("room.closed", "stop.requested")
+
+
+def _span_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+@dataclass(slots=True)
+class Span:
+    """
+    A timed stage (epoch seconds). `end` is None while it runs.
+    """
+
+    name: str
+    trace_id: str
+    span_id: str = field(default_factory=_span_id)
+    parent_id: str | None = None
+    start: float = field(default_factory=time.time)
+    end: float | None = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end or time.time()) - self.start
+
+    def finish(self, end: float | None = None) -> "Span":
+        """End the span, once, and hand it to the exporter."""
+        if self.end is None:
+            self.end = end or time.time()
+            Tracer().export(self)
+        return self
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attributes": self.attributes,
+        }
+
+    def to_otlp(self) -> dict:
+        def value(item):
+            if isinstance(item, bool):
+                return {"boolValue": item}
+            if isinstance(item, int):
+                return {"intValue": str(item)}
+            if isinstance(item, float):
+                return {"doubleValue": item}
+            return {"stringValue": str(item)}
+
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int((self.end or self.start) * 1e9)),
+            "attributes": [
+                {"key": key, "value": value(item)}
+                for key, item in self.attributes.items()
+            ],
+        }
+
+
+class Trace:
+    """
+    The spans of one session, safe to add to from any thread.
+
+    Args:
+        trace_id: 32 hex characters, a new id if None.
+        attributes: Added to every span, e.g. {"room.id": ..., "session.id": ...}.
+    """
+
+    def __init__(self, trace_id: str | None = None, **attributes):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.attributes = attributes
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def start_span(
+        self,
+        name: str,
+        parent: Span | None = None,
+        start: float | None = None,
+        **attributes,
+    ) -> Span:
+        """Start a span; `finish` it when the stage is over."""
+        span = Span(
+            name=name,
+            trace_id=self.trace_id,
+            parent_id=parent.span_id if parent else None,
+            start=start or time.time(),
+            attributes={**self.attributes, **attributes},
+        )
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def add_span(
+        self,
+        name: str,
+        start: float,
+        end: float,
+        parent: Span | None = None,
+        **attributes,
+    ) -> Span:
+        """Record a stage that was timed elsewhere."""
+        return self.start_span(name, parent=parent, start=start, **attributes).finish(
+            end
+        )
+
+    @contextmanager
+    def span(self, name: str, parent: Span | None = None, **attributes):
+        span = self.start_span(name, parent=parent, **attributes)
+        try:
+            yield span
+        finally:
+            span.finish()
+
+    def mark(self, name: str, parent: Span | None = None, **attributes) -> Span:
+        """
+        Record an instant. Only the first mark of a name (per parent) counts,
+        later ones return it.
+        """
+        parent_id = parent.span_id if parent else None
+        with self._lock:
+            for span in self.spans:
+                if span.name == name and span.parent_id == parent_id:
+                    return span
+        now = time.time()
+        return self.add_span(name, now, now, parent=parent, **attributes)
+
+    def closed(self) -> Span | None:
+        """The mark of whatever ended the recording first, if anything did."""
+        with self._lock:
+            marks = [
+                span
+                for span in self.spans
+                if span.name in CLOSE_MARKS and span.parent_id is None
+            ]
+        return min(marks, key=lambda span: span.start, default=None)
+
+    def breakdown(self, track: Span) -> dict:
+        """
+        Latency of every stage so far, relative to the room closing (or the track
+        stopping on its own), for a track's webhook.
+        """
+        with self._lock:
+            spans = [
+                span
+                for span in self.spans
+                if span.parent_id in (None, track.span_id) and span is not track
+            ]
+
+        closed = self.closed()
+        if closed is not None:
+            reference, trigger = closed.start, closed.name
+        else:
+            stopped = next(
+                (span for span in spans if span.name == "recorder.stop"), None
+            )
+            reference, trigger = (
+                (stopped.start if stopped else track.start),
+                "track.ended",
+            )
+
+        now = time.time()
+        return {
+            "trigger": trigger,
+            "closed_at": reference,
+            "stages": {
+                span.name: {
+                    "start_ms": round((span.start - reference) * 1000, 3),
+                    "duration_ms": round(span.duration * 1000, 3),
+                }
+                for span in spans
+                if span.name not in CLOSE_MARKS and span.start >= track.start
+            },
+            "total_ms": round((now - reference) * 1000, 3),
+            "webhook_queued_at": now,
+        }
+
+
+class Tracer:
+    """
+    Exports finished spans in the background, as configured by `TRACE_EXPORT`.
+    Implemented as a singleton; exporting never blocks the caller.
+    """
+
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(Tracer, cls).__new__(cls)
+            cls._instance._initialized = False
+        return cls._instance
+
+    def __init__(self, mode: str | None = None):
+        if getattr(self, "_initialized", False):
+            return
+
+        self.mode = (
+            mode if mode is not None else os.getenv("TRACE_EXPORT") or ""
+        ).lower()
+        if self.mode not in ("", TRACE_EXPORT_LOG, TRACE_EXPORT_OTLP):
+            logger.error(
+                f"Unsupported TRACE_EXPORT {self.mode}, spans are not exported"
+            )
+            self.mode = ""
+        self.endpoint = (
+            os.getenv("TRACE_OTLP_ENDPOINT") or "http://localhost:4318/v1/traces"
+        )
+        self.interval = float(os.getenv("TRACE_EXPORT_INTERVAL") or 1.0)
+        self.exported = 0
+        self.dropped = 0
+
+        self._queue: queue.Queue[Span] = queue.Queue(maxsize=10000)
+        if self.mode == TRACE_EXPORT_OTLP:
+            import requests
+
+            self._http = requests.Session()
+        if self.mode:
+            self._thread = threading.Thread(
+                target=self._run, name="chatot-trace-export", daemon=True
+            )
+            self._thread.start()
+
+        self._initialized = True
+
+    def export(self, span: Span):
+        if not self.mode:
+            return
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < 512:
+                try:
+                    batch.append(
+                        self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.error(f"Error exporting {len(batch)} spans: {e}")
+
+    def _write(self, spans: List[Span]):
+        if self.mode == TRACE_EXPORT_LOG:
+            for span in spans:
+                trace_logger.info(json.dumps(span.to_dict()))
+            return
+
+        body = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            {"key": "service.name", "value": {"stringValue": "chatot"}}
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "chatot"},
+                            "spans": [span.to_otlp() for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+        response = self._http.post(self.endpoint, json=body, timeout=10)
+        response.raise_for_status()
@@ -0,0 +1,146 @@
+from typing import Dict, List, TypedDict
+
+
+class TrackStatus(TypedDict):
+    """
+    Type definition for the state of one recorded track, as reported by `/status`.
+
+    Attributes:
+        peer_id: The remote peer the track belongs to
+        state: recording, uploading, done or failed
+        object_name: Bucket key of the recording
+        url: URL sent in the webhook once uploaded
+        error: Why the track failed, if it did
+    """
+
+    peer_id: str
+    state: str
+    object_name: str
+    url: str | None
+    error: str | None
+
+
+class SessionStatus(TypedDict):
+    """
+    Type definition for a room session, as reported by `/status`.
+
+    Attributes:
+        session_id: Id returned by `/start`
+        room_id: The Huddle01 room
+        state: queued, joining, recording, leaving, uploading, done or failed
+        error: Why the session failed, if it did
+        priority: Admission and shedding priority, higher is more important
+        stop_reason: Why chatot stopped the session itself, e.g. "shed"
+        loop: Name of the event loop hosting the session
+        created_at: When `/start` was called (timestamp)
+        updated_at: When the state last changed (timestamp)
+        tracks: Recorded tracks by consumer id
+    """
+
+    session_id: str
+    room_id: str
+    state: str
+    error: str | None
+    priority: int
+    stop_reason: str | None
+    loop: str | None
+    created_at: float
+    updated_at: float
+    tracks: Dict[str, TrackStatus]
+
+
+class ManifestTrack(TypedDict):
+    """
+    Type definition for one track in a room manifest.
+
+    Attributes:
+        track_id: Consumer id, or the mix track id
+        peer_id: The remote peer the track belongs to, "mix" for the room mix
+        object_name: Bucket key of the recording, or of its segment index
+        url: URL sent in the webhook once uploaded
+        format: Container of the recording, e.g. mp3 or ogg
+        size: Bytes uploaded, segments included
+        segments: Number of segments, 0 if the track was not segmented
+        timing: Start time, offset in the room, duration and gaps, see `TrackTiming`
+        error: Why the track failed, if it did
+    """
+
+    track_id: str
+    peer_id: str
+    object_name: str
+    url: str | None
+    format: str
+    size: int | None
+    segments: int
+    timing: dict | None
+    error: str | None
+
+
+class RoomManifestData(TypedDict):
+    """
+    Type definition for the manifest uploaded once a room is left.
+
+    Attributes:
+        room_id: The Huddle01 room
+        session_id: Id returned by `/start`
+        started_at: When the room was joined (timestamp), track offsets are relative to it
+        ended_at: When the room was left (timestamp)
+        tracks: Every recorded track, in the order they started
+    """
+
+    room_id: str
+    session_id: str
+    started_at: float
+    ended_at: float | None
+    tracks: List[ManifestTrack]
+
+
+class DrainedSession(TypedDict):
+    """
+    Type definition for a session a drain left behind.
+
+    Attributes:
+        session_id: Id returned by `/start`
+        room_id: The Huddle01 room
+        state: State the session was in when the drain ended
+        pending_tracks: Bucket keys of the tracks that were not uploaded yet
+    """
+
+    session_id: str
+    room_id: str
+    state: str
+    pending_tracks: List[str]
+
+
+class DrainReport(TypedDict):
+    """
+    Type definition for the progress and outcome of a drain, see `chatot.api.drain`.
+
+    Attributes:
+        reason: What started the drain, e.g. "SIGTERM" or "api"
+        started_at: When the drain started (timestamp)
+        finished_at: When it ended (timestamp), None while it runs
+        duration: Seconds the drain took so far
+        deadline: Seconds the drain may take
+        complete: Whether nothing was left behind
+        rooms_stopped: Rooms left by the drain
+        queued_failed: Rooms waiting for admission that were failed instead
+        phases: Seconds until the rooms were left, the uploads done and the webhooks
+                delivered, None for a phase not reached (yet)
+        sessions: Sessions not finished yet
+        uploads: Upload jobs queued or running
+        webhooks: Webhooks not delivered yet
+    """
+
+    reason: str
+    started_at: float
+    finished_at: float | None
+    duration: float
+    deadline: float
+    complete: bool
+    rooms_stopped: int
+    queued_failed: int
+    phases: Dict[str, float | None]
+    sessions: List[DrainedSession]
+    uploads: int
+    webhooks: int
@@ -1,5 +1,141 @@
-import requests
 import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from chatot.log import base_logger
+from chatot.utils.metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+logger = base_logger.getChild(__name__)
+
+STATUS_PENDING = "pending"
+STATUS_DEAD = "dead"
+
+
+class WebhookOutbox:
+    """
+    SQLite backed outbox so webhooks that were not delivered yet survive a restart.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhooks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT
+            )
+            """
+        )
+
+    def add(self, payload: dict) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO webhooks (payload, status, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                (json.dumps(payload), STATUS_PENDING, now, now),
+            )
+            return cursor.lastrowid
+
+    def claim_due(self, limit: int, lease: float) -> list:
+        """
+        Return up to `limit` pending webhooks that are due, pushing their next attempt
+        `lease` seconds out so they are not picked up again while in flight.
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, payload, attempts, created_at FROM webhooks WHERE status = ? AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (STATUS_PENDING, now, limit),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE webhooks SET next_attempt_at = ? WHERE id = ?",
+                [(now + lease, row[0]) for row in rows],
+            )
+        return rows
+
+    def next_due_at(self) -> float | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) FROM webhooks WHERE status = ?", (STATUS_PENDING,)
+            ).fetchone()
+        return row[0]
+
+    def delivered(self, delivery_id: int):
+        with self._lock:
+            self._db.execute("DELETE FROM webhooks WHERE id = ?", (delivery_id,))
+
+    def retry(self, delivery_id: int, attempts: int, next_attempt_at: float, error: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE webhooks SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (attempts, next_attempt_at, error, delivery_id),
+            )
+
+    def dead(self, delivery_id: int, attempts: int, error: str):
+        with self._lock:
+            self._db.execute(
+                "UPDATE webhooks SET status = ?, attempts = ?, last_error = ? WHERE id = ?",
+                (STATUS_DEAD, attempts, error, delivery_id),
+            )
+
+    def expedite(self, exclude: set) -> int:
+        """
+        Make every pending webhook due now, except the ids in `exclude` (in flight).
+
+        Returns:
+            int: How many webhooks were waiting for a retry
+        """
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM webhooks WHERE status = ? AND next_attempt_at > ?", (STATUS_PENDING, now)
+            ).fetchall()
+            due = [(now, delivery_id) for (delivery_id,) in rows if delivery_id not in exclude]
+            self._db.executemany("UPDATE webhooks SET next_attempt_at = ? WHERE id = ?", due)
+        return len(due)
+
+    def backlog(self) -> tuple:
+        """
+        Returns:
+            tuple: (pending count, created_at of the oldest pending webhook or None)
+        """
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM webhooks WHERE status = ?", (STATUS_PENDING,)
+            ).fetchone()
+
+
+WEBHOOK_ATTEMPTS = Counter("chatot_webhook_attempts_total", "Webhook delivery attempts.", ("outcome",))
+WEBHOOK_REQUEST_LATENCY = Histogram(
+    "chatot_webhook_request_seconds",
+    "Duration of successful webhook requests.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 15.0),
+)
+WEBHOOK_DELIVERY_LATENCY = Histogram(
+    "chatot_webhook_delivery_seconds",
+    "Time from queueing a webhook to its successful delivery, retries included.",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 5.0, 30.0, 60.0, 300.0, 1800.0),
+)
 
 
 class WebhookSender:
@@ -20,51 +156,213 @@ class WebhookSender:
         Initialize the WebhookSender with the target endpoint URL.
         Endpoint URL is required only on first initialization.
 
+        Webhooks are written to an on-disk outbox (`WEBHOOK_OUTBOX_PATH`) and delivered
+        in the background over a pooled session, with at most `WEBHOOK_MAX_IN_FLIGHT`
+        requests in flight. Failed deliveries are retried with exponential backoff up to
+        `WEBHOOK_MAX_ATTEMPTS` times. Pending webhooks from a previous run are resent on start.
+
         Args:
             endpoint_url (str, optional): The URL where the webhook will be sent.
                                          Required only for first initialization.
+            webhook_secret (str, optional): Sent as the `x-api-key` header.
         """
         if not getattr(self, '_initialized', False):
             if endpoint_url is None:
                 raise ValueError("endpoint_url is required for first initialization")
             self.endpoint_url = endpoint_url
-            self.webhook_secet = webhook_secret
+            self.webhook_secret = webhook_secret
+
+            self.max_in_flight = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT") or 8)
+            self.max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS") or 8)
+            self.timeout = (
+                float(os.getenv("WEBHOOK_CONNECT_TIMEOUT") or 5),
+                float(os.getenv("WEBHOOK_READ_TIMEOUT") or 15),
+            )
+            self.backoff_base = float(os.getenv("WEBHOOK_BACKOFF_BASE") or 1.0)
+            self.backoff_max = float(os.getenv("WEBHOOK_BACKOFF_MAX") or 300.0)
+
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+            self.session.headers.update({
+                "Content-Type": "application/json",
+                "x-api-key": self.webhook_secret,
+            })
+
+            self.outbox = WebhookOutbox(os.getenv("WEBHOOK_OUTBOX_PATH") or "webhooks/outbox.sqlite3")
+            self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="chatot-webhook")
+
+            self.delivered = 0
+            self.failed_attempts = 0
+            self.dead = 0
+            self.recent_latencies = deque(maxlen=100)
+            # Called once a delivery from this process succeeds or is given up on
+            self._callbacks = {}
+            self._in_flight = 0
+            # Outbox ids being delivered, their lease is not a backoff
+            self._claimed = set()
+            self._lock = threading.Lock()
+            self._wakeup = threading.Event()
+            self._dispatcher = threading.Thread(target=self._dispatch, name="chatot-webhook-dispatcher", daemon=True)
+            self._dispatcher.start()
+
+            MetricsRegistry().add_collector(self.collect)
+
             self._initialized = True
-            print(f"Webhook Sender Initialised: {endpoint_url}")
+            logger.info(f"Webhook Sender Initialised: {endpoint_url}")
         elif endpoint_url is not None:
-            print("Warning: WebhookSender is already initialized. Ignoring new endpoint URL.")
+            logger.warning("WebhookSender is already initialized. Ignoring new endpoint URL.")
 
-    def send_webhook(self, peer_id: str, audio_file_url: str):
+    def send_webhook(
+        self,
+        peer_id: str,
+        audio_file_url: str,
+        extra: dict | None = None,
+        on_done: Callable[[float, int, str | None], None] | None = None,
+    ) -> int:
         """
-        Send a webhook with the specified peer ID and audio file URL.
+        Queue a webhook with the specified peer ID and audio file URL.
+
+        The webhook is persisted to the outbox before returning and delivered in the
+        background, so this never blocks on the receiver.
 
         Args:
             peer_id (str): The peer ID to include in the payload
             audio_file_url (str): The URL of the audio file
+            extra (dict, optional): Additional fields merged into the payload
+            on_done (callable, optional): Called with (finished_at, attempts, error) once the
+                                          webhook is delivered, or with an error once given up on
 
         Returns:
-            requests.Response: The response from the webhook endpoint
-
-        Raises:
-            requests.exceptions.RequestException: If the request fails
+            int: The outbox id of the queued delivery
         """
         payload = {
             "peerId": peer_id,
             "recording_file_url": audio_file_url
         }
+        if extra:
+            payload.update(extra)
 
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": self.webhook_secet
-        }
+        if on_done:
+            # Held so a fast delivery cannot settle before its callback is known
+            with self._lock:
+                delivery_id = self.outbox.add(payload)
+                self._callbacks[delivery_id] = on_done
+        else:
+            delivery_id = self.outbox.add(payload)
+        self._wakeup.set()
+        return delivery_id
 
+    def flush(self) -> int:
+        """
+        Retry the webhooks waiting out a backoff right away, e.g. before the process exits.
+
+        Returns:
+            int: How many webhooks were brought forward
+        """
+        with self._lock:
+            count = self.outbox.expedite(self._claimed)
+        if count:
+            logger.info(f"Retrying {count} webhooks now instead of after their backoff")
+        self._wakeup.set()
+        return count
+
+    def _dispatch(self):
+        # An in-flight delivery is leased for longer than its request can take
+        lease = sum(self.timeout) + 5
+        while True:
+            self._wakeup.clear()
+            with self._lock:
+                free = self.max_in_flight - self._in_flight
+                rows = self.outbox.claim_due(limit=free, lease=lease) if free > 0 else []
+                self._claimed.update(row[0] for row in rows)
+                self._in_flight += len(rows)
+
+            for delivery_id, payload, attempts, created_at in rows:
+                self.executor.submit(self._deliver, delivery_id, payload, attempts, created_at)
+
+            timeout = 1.0
+            next_due = self.outbox.next_due_at()
+            # With every slot busy, wait for a delivery to finish instead of polling
+            if next_due is not None and len(rows) < free:
+                timeout = min(timeout, max(0.01, next_due - time.time()))
+            self._wakeup.wait(timeout=timeout)
+
+    def _deliver(self, delivery_id: int, payload: str, attempts: int, created_at: float):
+        attempts += 1
+        started = time.time()
         try:
-            response = requests.post(
-                url=self.endpoint_url,
-                data=json.dumps(payload),
-                headers=headers,
-            )
+            response = self.session.post(url=self.endpoint_url, data=payload, timeout=self.timeout)
             response.raise_for_status()
-            return response
+
+            finished = time.time()
+            self.outbox.delivered(delivery_id)
+            WEBHOOK_ATTEMPTS.inc(outcome="delivered")
+            WEBHOOK_REQUEST_LATENCY.observe(finished - started)
+            WEBHOOK_DELIVERY_LATENCY.observe(finished - created_at)
+            with self._lock:
+                self.delivered += 1
+                self.recent_latencies.append({
+                    "request_ms": round((finished - started) * 1000, 1),
+                    "delivery_ms": round((finished - created_at) * 1000, 1),
+                    "attempts": attempts,
+                })
+            self._settle(delivery_id, finished, attempts, None)
         except requests.exceptions.RequestException as e:
-            raise e
+            with self._lock:
+                self.failed_attempts += 1
+
+            if attempts >= self.max_attempts:
+                logger.error(f"Giving up on webhook {delivery_id} after {attempts} attempts: {e}")
+                self.outbox.dead(delivery_id, attempts, str(e))
+                WEBHOOK_ATTEMPTS.inc(outcome="dead")
+                with self._lock:
+                    self.dead += 1
+                self._settle(delivery_id, time.time(), attempts, str(e))
+            else:
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** (attempts - 1))))
+                logger.warning(f"Webhook {delivery_id} failed (attempt {attempts}), retrying in {delay:.1f}s: {e}")
+                self.outbox.retry(delivery_id, attempts, time.time() + delay, str(e))
+                WEBHOOK_ATTEMPTS.inc(outcome="retry")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                self._claimed.discard(delivery_id)
+            self._wakeup.set()
+
+    def _settle(self, delivery_id: int, finished_at: float, attempts: int, error: str | None):
+        with self._lock:
+            on_done = self._callbacks.pop(delivery_id, None)
+        if on_done:
+            try:
+                on_done(finished_at, attempts, error)
+            except Exception as e:
+                logger.error(f"Error in webhook {delivery_id} callback: {e}")
+
+    def collect(self) -> list:
+        """Outbox backlog and in-flight requests, for `/metrics`."""
+        pending, oldest = self.outbox.backlog()
+        backlog = Gauge("chatot_webhook_backlog", "Webhooks waiting in the outbox.", register=False)
+        backlog.set(pending)
+        oldest_age = Gauge("chatot_webhook_oldest_pending_seconds", "Age of the oldest pending webhook.", register=False)
+        oldest_age.set(time.time() - oldest if oldest else 0)
+        in_flight = Gauge("chatot_webhooks_in_flight", "Webhook requests in flight.", register=False)
+        in_flight.set(self._in_flight)
+        return [backlog, oldest_age, in_flight]
+
+    def stats(self) -> dict:
+        """Backlog and delivery latency of the outbox."""
+        pending, oldest = self.outbox.backlog()
+        with self._lock:
+            latencies = [entry["delivery_ms"] for entry in self.recent_latencies]
+            return {
+                "backlog": pending,
+                "oldest_pending_age_s": round(time.time() - oldest, 1) if oldest else 0,
+                "in_flight": self._in_flight,
+                "delivered": self.delivered,
+                "failed_attempts": self.failed_attempts,
+                "dead": self.dead,
+                "avg_delivery_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0,
+                "recent": list(self.recent_latencies)[-10:],
+            }
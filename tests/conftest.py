@@ -0,0 +1,87 @@
+"""
+Shared fixtures. The tests run offline against the stand-ins in `benchmarks.harness`:
+rooms of synthetic participants, a local S3 and a local webhook endpoint.
+"""
+
+import os
+import time
+
+import pytest
+
+from benchmarks.harness import FakeS3Server, FakeWebhookServer
+from benchmarks.load import configure
+
+
+class Harness:
+    """The stand-ins chatot was pointed at, and a Flask test client for its API."""
+
+    def __init__(self, s3: FakeS3Server, webhook: FakeWebhookServer):
+        # Imported here, after `configure`
+        from chatot.api import apiHandler
+        from chatot.api.huddle_service import set_manager_factory
+        from chatot.utils.webhook_sender import WebhookSender
+        from benchmarks.harness.huddle import FakeHuddle01, FakeHuddle01Manager
+
+        self.s3 = s3
+        self.webhook = webhook
+        self.hub = FakeHuddle01()
+        set_manager_factory(FakeHuddle01Manager)
+        WebhookSender(
+            endpoint_url=os.environ["WEBHOOK_URL"],
+            webhook_secret=os.environ["WEBHOOK_API_KEY"],
+        )
+        self.client = apiHandler.test_client()
+
+    def start(self, room_id: str, participants: int = 2, **params) -> str:
+        """Create a fake room, start recording it and return the session id."""
+        self.hub.create_room(room_id, participants)
+        response = self.client.get(
+            "/start", query_string={"room_id": room_id, **params}
+        )
+        assert response.status_code == 202, response.get_data(as_text=True)
+        return response.get_json()["session_id"]
+
+    def status(self, session_id: str) -> dict:
+        return self.client.get(
+            "/status", query_string={"session_id": session_id}
+        ).get_json()
+
+    def wait_state(self, session_id: str, *states: str, timeout: float = 30.0) -> dict:
+        """Wait until the session is in one of `states` and return its status."""
+        deadline = time.monotonic() + timeout
+        status = self.status(session_id)
+        while status["state"] not in states:
+            assert time.monotonic() < deadline, (
+                f"Session stayed {status['state']}, expected {states}"
+            )
+            time.sleep(0.05)
+            status = self.status(session_id)
+        return status
+
+    def webhooks(self, room_id: str, count: int, timeout: float = 30.0) -> list:
+        """Wait for `count` webhooks about the peers of `room_id` and return them."""
+        deadline = time.monotonic() + timeout
+        while True:
+            payloads = [
+                payload
+                for payload in self.webhook.payloads
+                if str(payload.get("peerId")).startswith(f"{room_id}-")
+            ]
+            if len(payloads) >= count or time.monotonic() >= deadline:
+                return payloads
+            time.sleep(0.05)
+
+
+@pytest.fixture(scope="session")
+def harness(tmp_path_factory):
+    """Point chatot at the stand-ins. chatot's subsystems are singletons, so it is done once."""
+    cwd = os.getcwd()
+    s3 = FakeS3Server().start()
+    webhook = FakeWebhookServer().start()
+    configure(s3, webhook, str(tmp_path_factory.mktemp("chatot")), admission=False)
+    try:
+        yield Harness(s3, webhook)
+    finally:
+        os.chdir(cwd)
+        s3.stop()
+        webhook.stop()
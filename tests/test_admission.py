@@ -0,0 +1,81 @@
+import time
+
+import pytest
+
+from chatot.api.admission import ADMISSION_REJECT, AdmissionController, LoadSample
+from chatot.utils.sessions import (
+    SESSION_FAILED,
+    SESSION_QUEUED,
+    Session,
+    SessionRegistry,
+)
+
+
+@pytest.fixture
+def admission(harness, monkeypatch):
+    """
+    The node's admission controller on a fixed load: 10% CPU, 1% per track, memory
+    not counted, 2 tracks per room. A 17% CPU budget leaves room for 7 tracks.
+    """
+    controller = AdmissionController()
+    load = LoadSample(cpu_percent=10.0)
+    # The sampling thread keeps the load fixed, let a sample already running finish
+    monkeypatch.setattr(controller, "sample", lambda: load)
+    time.sleep(0.1)
+    monkeypatch.setattr(controller, "last_sample", load)
+    monkeypatch.setattr(controller, "_reserved", {})
+    monkeypatch.setattr(controller, "_queue", [])
+    monkeypatch.setattr(controller, "mode", ADMISSION_REJECT)
+    monkeypatch.setattr(controller, "cpu_budget", 17.0)
+    monkeypatch.setattr(controller, "lag_budget", 0.5)
+    monkeypatch.setattr(controller, "track_cpu", 1.0)
+    monkeypatch.setattr(controller, "track_rss", 0.0)
+    monkeypatch.setattr(controller, "tracks_per_room", 2)
+    return controller
+
+
+def test_admitted_rooms_reserve_their_tracks(admission):
+    assert admission.headroom() == 7
+    decisions = [admission.decide(f"reserve-{index}") for index in range(10)]
+    assert [decision.admitted for decision in decisions] == [True] * 3 + [False] * 7
+    assert "CPU" in decisions[-1].reason
+    assert decisions[-1].retry_after == admission.retry_after
+    assert admission.reserved() == 6
+    assert admission.headroom() == 1
+    assert admission.decide("reserve-small", expected_tracks=1).admitted
+
+
+def test_sample_releases_rooms_it_sees(admission):
+    assert admission.decide("sampled").admitted
+    session = SessionRegistry().create("sampled")
+    try:
+        AdmissionController.sample(admission)
+    finally:
+        session.set_state(SESSION_FAILED)
+    assert admission.reserved() == 0
+
+
+def test_lagging_node_takes_no_room(admission):
+    admission.last_sample.loop_lag = 1.0
+    decision = admission.decide("lagging")
+    assert not decision.admitted
+    assert "lagging" in decision.reason
+    assert admission.headroom() == 0
+
+
+def test_new_room_does_not_overtake_the_queue(admission):
+    waiting = Session(room_id="waiting", state=SESSION_QUEUED)
+    assert admission.enqueue(waiting, lambda: None, expected_tracks=100)
+    decision = admission.decide("overtaking", expected_tracks=1)
+    assert not decision.admitted
+    assert decision.reason == "Rooms are waiting for capacity"
+    assert admission.queued() == 1
+
+
+def test_start_is_refused_when_the_room_does_not_fit(harness, admission):
+    admission.cpu_budget = 11.0
+    response = harness.client.get("/start", query_string={"room_id": "refused"})
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "overloaded"
+    assert response.headers["Retry-After"] == str(admission.retry_after)
+    assert SessionRegistry().active("refused") is None
@@ -0,0 +1,65 @@
+import pytest
+
+from chatot.api.drain import DRAIN_PHASES, Drainer
+from chatot.cluster import ClusterNode
+from chatot.utils.sessions import (
+    SESSION_DONE,
+    SESSION_FAILED,
+    SESSION_QUEUED,
+    SESSION_RECORDING,
+    SessionRegistry,
+)
+
+
+@pytest.fixture
+def drainer(harness):
+    """A drain of its own, forgotten afterwards so later tests can still start rooms."""
+    Drainer._instance = None
+    yield Drainer(deadline=30)
+    Drainer._instance = None
+    ClusterNode().draining = False
+
+
+def test_drain_finishes_rooms_uploads_and_webhooks(harness, drainer):
+    session_ids = [
+        harness.start(room_id, participants=2) for room_id in ("drain-a", "drain-b")
+    ]
+    for session_id in session_ids:
+        harness.wait_state(session_id, SESSION_RECORDING)
+    assert harness.client.get("/drain").get_json() == {"status": "serving"}
+
+    reports = []
+    assert drainer.start("test", on_done=reports.append)
+    assert not drainer.start("again")
+    assert harness.client.get("/healthz").status_code == 503
+    response = harness.client.get("/start", query_string={"room_id": "drain-late"})
+    assert response.status_code == 503
+    assert response.get_json()["status"] == "draining"
+
+    report = drainer.wait(30)
+    assert reports == [report]
+    assert report["complete"]
+    assert report["reason"] == "test"
+    assert report["rooms_stopped"] == 2
+    assert report["sessions"] == []
+    assert report["uploads"] == 0
+    assert report["webhooks"] == 0
+    assert all(report["phases"][phase] is not None for phase in DRAIN_PHASES)
+
+    for session_id in session_ids:
+        assert harness.status(session_id)["state"] == SESSION_DONE
+    assert len(harness.webhooks("drain-a", count=2)) == 2
+    assert len(harness.webhooks("drain-b", count=2)) == 2
+    assert harness.client.get("/drain").get_json()["status"] == "drained"
+
+
+def test_drain_fails_queued_rooms(drainer):
+    session = SessionRegistry().create("drain-queued")
+    session.set_state(SESSION_QUEUED)
+
+    drainer.start("test")
+    report = drainer.wait(30)
+    assert report["complete"]
+    assert report["queued_failed"] == 1
+    assert report["rooms_stopped"] == 0
+    assert session.state == SESSION_FAILED
@@ -0,0 +1,75 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from chatot.recorder.encoder import (
+    OVERFLOW_BLOCK,
+    OVERFLOW_DROP_OLDEST,
+    OVERFLOW_SPILL,
+    EncodePipeline,
+)
+
+FRAMES = 40
+
+
+def run_pipeline(policy: str, encode_delay: float = 0.0, hold: bool = False) -> tuple:
+    """
+    Put `FRAMES` items through a pipeline of 4 and return (encoded items, pipeline).
+    With `hold`, nothing is encoded until every item was put.
+    """
+    encoded = []
+    release = threading.Event()
+    if not hold:
+        release.set()
+
+    def encode(item):
+        release.wait()
+        time.sleep(encode_delay)
+        encoded.append(item)
+
+    async def main():
+        pipeline = EncodePipeline(
+            encode, asyncio.get_running_loop(), max_size=4, policy=policy
+        )
+        for item in range(FRAMES):
+            await pipeline.put(item)
+        release.set()
+        await asyncio.wait_for(pipeline.close(), 10)
+        return pipeline
+
+    pipeline = asyncio.run(main())
+    return encoded, pipeline
+
+
+def test_block_keeps_every_frame():
+    encoded, pipeline = run_pipeline(OVERFLOW_BLOCK, encode_delay=0.001)
+    assert encoded == list(range(FRAMES))
+    assert pipeline.dropped_frames == 0
+    assert pipeline.queue_depth == 0
+
+
+def test_drop_oldest_keeps_the_newest_frames():
+    encoded, pipeline = run_pipeline(OVERFLOW_DROP_OLDEST, hold=True)
+    assert pipeline.dropped_frames > 0
+    assert len(encoded) + pipeline.dropped_frames == FRAMES
+    assert encoded == sorted(encoded)
+    assert encoded[-4:] == list(range(FRAMES - 4, FRAMES))
+
+
+def test_spill_replays_frames_in_order():
+    encoded, pipeline = run_pipeline(OVERFLOW_SPILL, hold=True)
+    assert encoded == list(range(FRAMES))
+    assert pipeline.spilled_frames > 0
+    assert pipeline.dropped_frames == 0
+    assert pipeline.queue_depth == 0
+
+
+def test_unknown_policy_is_refused():
+    loop = asyncio.new_event_loop()
+    try:
+        with pytest.raises(ValueError):
+            EncodePipeline(lambda item: None, loop, policy="discard")
+    finally:
+        loop.close()
@@ -0,0 +1,38 @@
+import time
+
+from chatot.utils.sessions import SESSION_DONE, SESSION_RECORDING, TRACK_DONE
+
+
+def test_room_is_recorded_uploaded_and_reported(harness):
+    session_id = harness.start("rec", participants=2)
+    harness.wait_state(session_id, SESSION_RECORDING)
+    time.sleep(1)
+
+    response = harness.client.get("/stop", query_string={"session_id": session_id})
+    assert response.status_code == 202
+    status = harness.wait_state(session_id, SESSION_DONE, "failed")
+    assert status["state"] == SESSION_DONE
+
+    tracks = [
+        track
+        for track in status["tracks"].values()
+        if track["peer_id"].startswith("rec-peer-")
+    ]
+    assert sorted(track["peer_id"] for track in tracks) == ["rec-peer-0", "rec-peer-1"]
+    for track in tracks:
+        assert track["state"] == TRACK_DONE
+        assert track["object_name"] in harness.s3.objects
+        assert harness.s3.objects[track["object_name"]]
+
+    webhooks = harness.webhooks("rec", count=2)
+    assert sorted(payload["peerId"] for payload in webhooks) == [
+        "rec-peer-0",
+        "rec-peer-1",
+    ]
+    urls = {track["url"] for track in tracks}
+    assert {payload["recording_file_url"] for payload in webhooks} == urls
+
+
+def test_unknown_session_is_not_found(harness):
+    response = harness.client.get("/stop", query_string={"session_id": "missing"})
+    assert response.status_code == 404
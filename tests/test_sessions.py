@@ -0,0 +1,85 @@
+import pytest
+
+from chatot.utils.sessions import (
+    SESSION_DONE,
+    SESSION_FAILED,
+    SESSION_JOINING,
+    SESSION_LEAVING,
+    SESSION_RECORDING,
+    SESSION_UPLOADING,
+    TRACK_DONE,
+    TRACK_FAILED,
+    TRACK_UPLOADING,
+    Session,
+    SessionRegistry,
+)
+
+
+def test_session_without_tracks_is_done_once_left():
+    session = Session(room_id="room")
+    assert session.state == SESSION_JOINING
+    assert session.set_state(SESSION_RECORDING)
+    assert session.set_state(SESSION_LEAVING)
+    session.left()
+    assert session.state == SESSION_DONE
+    assert session.finished
+
+
+def test_session_waits_for_its_uploads():
+    session = Session(room_id="room")
+    session.add_track("a", "peer-a", "recordings/a.mp3")
+    session.add_track("b", "peer-b", "recordings/b.mp3")
+    session.set_state(SESSION_RECORDING)
+
+    session.update_track("a", TRACK_UPLOADING)
+    session.left()
+    assert session.state == SESSION_UPLOADING
+
+    session.update_track("a", TRACK_DONE, url="https://example.com/a.mp3")
+    assert session.state == SESSION_UPLOADING
+    session.update_track("b", TRACK_FAILED, error="upload failed")
+    assert session.state == SESSION_DONE
+
+    tracks = session.to_dict()["tracks"]
+    assert tracks["a"]["url"] == "https://example.com/a.mp3"
+    assert tracks["b"]["error"] == "upload failed"
+
+
+def test_finished_session_does_not_change():
+    session = Session(room_id="room")
+    assert session.set_state(SESSION_FAILED, error="join failed")
+    assert not session.set_state(SESSION_RECORDING)
+    session.left()
+    assert session.state == SESSION_FAILED
+    assert session.error == "join failed"
+
+
+def test_unknown_state_is_refused():
+    with pytest.raises(ValueError):
+        Session(room_id="room").set_state("paused")
+
+
+def test_on_finish_runs_once():
+    finished = []
+    session = Session(room_id="room", on_finish=finished.append)
+    session.add_track("a", "peer-a", "recordings/a.mp3")
+    session.left()
+    session.update_track("a", TRACK_DONE)
+    session.set_state(SESSION_FAILED)
+    session.update_track("a", TRACK_DONE)
+    assert finished == [session]
+
+
+def test_registry_keeps_one_active_session_per_room():
+    registry = SessionRegistry()
+    first = registry.create("registry-room")
+    second = registry.create("registry-room")
+    assert registry.active("registry-room") is second
+    assert registry.get(first.session_id) is first
+
+    first.set_state(SESSION_FAILED)
+    assert registry.active("registry-room") is second
+    second.set_state(SESSION_FAILED)
+    assert registry.active("registry-room") is None
+    assert "registry-room" not in registry.active_rooms()
+    assert registry.get(second.session_id) is second